@@ -6,5 +6,6 @@ from hda_fits.fits import (  # noqa
 )
 from hda_fits.pink import (  # noqa
     write_catalog_objects_pink_file_v2,
+    write_catalog_objects_variable_size_pink_file_v2,
     write_mosaic_objects_to_pink_file_v2,
 )
@@ -5,27 +5,85 @@ This means reading in FITS tables, extracting coordinates and
 meta information as well as creating 2D cutouts of objects of
 interest.
 """
+import hashlib
+import mmap
 import os
+import pickle
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
-from typing import Optional, Union
+from typing import Dict, Iterator, List, Optional, Tuple, Union
 
 import numpy as np
 import pandas as pd
+import pyarrow.parquet as pq
 import requests
 from astropy.io import fits
 from astropy.io.fits.hdu.image import PrimaryHDU
 from astropy.nddata import Cutout2D
 from astropy.table import Table
 from astropy.wcs import WCS
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from scipy.spatial import cKDTree
 
 from hda_fits.logging_config import logging
-from hda_fits.types import RectangleSize, WCSCoordinates
+from hda_fits.types import (
+    BoxCoordinates,
+    CatalogSelection,
+    CutoutCacheStats,
+    DownloadResult,
+    IntegralImages,
+    MosaicTileStore,
+    RectangleSize,
+    SpatialIndex,
+    WCSCoordinates,
+)
 
 log = logging.getLogger(__name__)
 log.setLevel(logging.DEBUG)
 
 MOSAIC_FILENAME_TEMPLATE = "{}-mosaic.fits"
 SHIMWELL_FILENAME = "LOFAR_HBA_T1_DR1_catalog_v1.0.srl.fits"
+SHIMWELL_CATALOG_URL_TEMPLATE = "https://lofar-surveys.org/public/{}"
+MOSAIC_URL_TEMPLATE = "https://lofar-surveys.org/public/mosaics/{}"
+DOWNLOAD_MANIFEST_FILENAME = "downloads.parquet"
+DOWNLOAD_TEMPORARY_SUFFIX = ".part"
+DEFAULT_DOWNLOAD_CHUNK_SIZE = 2**20
+DEFAULT_DOWNLOAD_TIMEOUT = 60
+DEFAULT_DOWNLOAD_WORKERS = 4
+SHIMWELL_REDUCED_COLUMNS = ["Source_Name", "RA", "DEC", "S_Code", "Mosaic_ID"]
+CATALOG_CACHE_SUFFIX = ".parquet"
+DEFAULT_CATALOG_ROW_GROUP_SIZE = 2**13
+CATALOG_FILTER_OPERATORS = ("==", "=", "!=", "<", "<=", ">", ">=", "in", "not in")
+CATALOG_CATEGORICAL_COLUMNS = ["Mosaic_ID", "S_Code"]
+CATALOG_STRING_COLUMNS = ["Source_Name"]
+CATALOG_COORDINATE_COLUMNS = ["RA", "DEC"]
+INTEGRAL_IMAGE_FILENAME_TEMPLATE = "{}-mosaic.{}-integral.npy"
+TILE_STORE_FILENAME_TEMPLATE = "{}-mosaic.tiles-{}.npy"
+TILE_STORE_HEADER_FILENAME_TEMPLATE = "{}-mosaic.tiles-{}.hdr"
+MOSAIC_HASH_FILENAME_TEMPLATE = "{}-mosaic.hash"
+DEFAULT_TILE_SIZE = 512
+DEFAULT_MOSAIC_CDELT = 0.000416666666666666
+DEFAULT_MOSAIC_PREFETCH_MEMORY = 2**32
+EXTRACTION_ORDERS = ("morton", "tile")
+CUTOUT_TABLE_EXTNAME = "CUTOUTS"
+CUTOUT_CACHE_INDEX_FILENAME = "index.npy"
+CUTOUT_CACHE_CHUNK_FILENAME_TEMPLATE = "chunk-{:06d}.bin"
+CUTOUT_CACHE_INDEX_DTYPE = np.dtype(
+    [("key", "S32"), ("chunk", "<i4"), ("offset", "<i8"), ("length", "<i8")]
+)
+DEFAULT_CUTOUT_CACHE_MAX_SIZE = 2**32
+DEFAULT_CUTOUT_CACHE_CHUNK_SIZE = 2**26
+SIN_PROJECTION_BOUNDARY_TOLERANCE = 1e-6
+SPATIAL_INDEX_FILENAME_SUFFIX = ".kdtree.pkl"
+CATALOG_MANIFEST_FILENAME = "manifest.parquet"
+CATALOG_PARTITION_FILENAME_TEMPLATE = "{}/dec_band={:03d}.parquet"
+DEFAULT_DECLINATION_BAND_WIDTH = 5.0
+DEFAULT_CATALOG_BATCH_SIZE = 2**16
+DEDUPLICATION_POLICIES = {"brightest": "Total_flux", "largest": "Maj", "first": None}
+DEFAULT_DEDUPLICATION_OVERLAP = 0.5
 
 
 def column_dtype_byte_to_string(df: pd.DataFrame) -> pd.DataFrame:
@@ -34,38 +92,405 @@ def column_dtype_byte_to_string(df: pd.DataFrame) -> pd.DataFrame:
     return df
 
 
-def download_file_streamed(filepath: Union[str, Path], url: str):
-    with requests.get(url, stream=True) as r:
-        r.raise_for_status()
-        with open(filepath, "wb") as f:
-            for chunk in r.iter_content(chunk_size=8192):
-                f.write(chunk)
+def calculate_file_sha256(filepath: Union[str, Path], chunk_size: int = 2**20) -> str:
+    sha256 = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
 
 
-def download_shimwell_catalog(path: str):
-    shimwell_catalog_url = f"https://lofar-surveys.org/public/{SHIMWELL_FILENAME}"
+def parse_content_range_size(content_range: Optional[str]) -> Optional[int]:
+    """Returns the total size of a Content-Range header like bytes 100-199/1000"""
+    match = re.match(r"bytes (\d+-\d+|\*)/(\d+)", content_range or "")
+    return int(match.group(2)) if match else None
+
+
+def download_file_resumable(
+    filepath: Union[str, Path],
+    url: str,
+    expected_size: Optional[int] = None,
+    expected_sha256: Optional[str] = None,
+    chunk_size: int = DEFAULT_DOWNLOAD_CHUNK_SIZE,
+    timeout: float = DEFAULT_DOWNLOAD_TIMEOUT,
+    session: Optional[requests.Session] = None,
+) -> DownloadResult:
+    """Downloads a file via a temporary file which is renamed when complete
+
+    The data is written to filepath + ".part". An existing part file of
+    an interrupted download is resumed with an HTTP Range request; if
+    the server ignores the range the download starts over. The size is
+    checked against the size announced by the server and expected_size,
+    the checksum against expected_sha256. Raises ValueError on a
+    mismatch, the part file is removed in this case.
+    """
+    filepath = Path(filepath)
+    temporary_filepath = Path(str(filepath) + DOWNLOAD_TEMPORARY_SUFFIX)
+    get = session.get if session is not None else requests.get
+
+    offset = temporary_filepath.stat().st_size if temporary_filepath.exists() else 0
+    headers = {"Range": f"bytes={offset}-"} if offset else {}
+
+    with get(url, headers=headers, stream=True, timeout=timeout) as r:
+        if r.status_code == 416 and offset:
+            # the part file holds the complete file already
+            total_size = parse_content_range_size(r.headers.get("Content-Range"))
+        else:
+            r.raise_for_status()
+            if r.status_code == 206:
+                log.debug(f"Resuming {url} at byte {offset}")
+                total_size = parse_content_range_size(r.headers.get("Content-Range"))
+                mode = "ab"
+            else:
+                offset = 0
+                content_length = r.headers.get("Content-Length")
+                total_size = int(content_length) if content_length else None
+                mode = "wb"
+
+            with open(temporary_filepath, mode) as f:
+                for chunk in r.iter_content(chunk_size=chunk_size):
+                    f.write(chunk)
+
+    size = temporary_filepath.stat().st_size
+    expected_sizes = {s for s in [total_size, expected_size] if s is not None}
+    if expected_sizes and expected_sizes != {size}:
+        if size < max(expected_sizes):
+            # keep the part file of a truncated transfer to resume it later
+            raise ValueError(
+                f"Download of {url} incomplete: {size} of {expected_sizes} bytes"
+            )
+        temporary_filepath.unlink()
+        raise ValueError(
+            f"Download of {url} has {size} bytes, expected {expected_sizes}"
+        )
+
+    sha256 = calculate_file_sha256(temporary_filepath)
+    if expected_sha256 is not None and sha256 != expected_sha256:
+        temporary_filepath.unlink()
+        raise ValueError(f"Checksum of {url} is {sha256}, expected {expected_sha256}")
+
+    os.replace(temporary_filepath, filepath)
+    return DownloadResult(
+        url=url,
+        filepath=str(filepath),
+        status="downloaded",
+        size=size,
+        sha256=sha256,
+        error="",
+    )
+
+
+def read_download_manifest(path: Union[str, Path]) -> pd.DataFrame:
+    """Reads the manifest of the files downloaded to a directory
+
+    The manifest has one row per file with the columns of DownloadResult.
+    """
+    manifest_filepath = Path(path) / DOWNLOAD_MANIFEST_FILENAME
+    if not manifest_filepath.exists():
+        return pd.DataFrame(columns=list(DownloadResult._fields))
+    return pd.read_parquet(manifest_filepath)
+
+
+def write_download_manifest(path: Union[str, Path], manifest: pd.DataFrame):
+    manifest_filepath = Path(path) / DOWNLOAD_MANIFEST_FILENAME
+    temporary_filepath = Path(str(manifest_filepath) + ".tmp")
+    manifest.to_parquet(temporary_filepath, index=False)
+    os.replace(temporary_filepath, manifest_filepath)
+
+
+def download_files(
+    downloads: List[Tuple[str, str]],
+    path: Union[str, Path],
+    max_workers: int = DEFAULT_DOWNLOAD_WORKERS,
+    chunk_size: int = DEFAULT_DOWNLOAD_CHUNK_SIZE,
+    timeout: float = DEFAULT_DOWNLOAD_TIMEOUT,
+    expected_sha256: Optional[Dict[str, str]] = None,
+) -> List[DownloadResult]:
+    """Downloads several files concurrently into a directory
+
+    downloads is a list of (url, filename) pairs. Files present in the
+    manifest of the directory (see read_download_manifest) with matching
+    size are skipped, so repeated calls only fetch what is missing, and
+    interrupted downloads are resumed (see download_file_resumable).
+    Failed downloads are logged and returned with status "failed" instead
+    of raising, so one failure does not cancel the other downloads. The
+    manifest is updated once after all downloads, failed ones included.
+    expected_sha256 optionally maps filenames to their checksums.
+    """
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    expected_sha256 = expected_sha256 or {}
+
+    known_downloads = {
+        record["filepath"]: DownloadResult(**record)
+        for record in read_download_manifest(path).to_dict("records")
+    }
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=max_workers)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
 
+    def download(url: str, filename: str) -> DownloadResult:
+        filepath = path / filename
+        known_download = known_downloads.get(str(filepath))
+        if (
+            known_download is not None
+            and filepath.exists()
+            and known_download.size == filepath.stat().st_size
+        ):
+            log.debug(f"File {filepath} exists. Not downloading..")
+            return known_download._replace(status="skipped")
+
+        t0 = time.perf_counter()
+        try:
+            result = download_file_resumable(
+                filepath,
+                url,
+                expected_sha256=expected_sha256.get(filename),
+                chunk_size=chunk_size,
+                timeout=timeout,
+                session=session,
+            )
+        except (requests.exceptions.RequestException, ValueError) as e:
+            log.error(f"Download of {url} failed: {e}")
+            return DownloadResult(
+                url=url,
+                filepath=str(filepath),
+                status="failed",
+                size=-1,
+                sha256="",
+                error=str(e),
+            )
+
+        log.info(
+            f"Downloaded {url} ({result.size} bytes) in {time.perf_counter() - t0:.1f} s"
+        )
+        return result
+
+    results = {}
+    try:
+        with session, ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                executor.submit(download, url, filename): i
+                for i, (url, filename) in enumerate(downloads)
+            }
+            for future in as_completed(futures):
+                results[futures[future]] = future.result()
+    finally:
+        # written once, also if interrupted, with the failed downloads of this call
+        new_entries = [
+            result for result in results.values() if result.status != "skipped"
+        ]
+        if new_entries:
+            new_filepaths = {result.filepath for result in new_entries}
+            entries = read_download_manifest(path)
+            entries = pd.concat(
+                [
+                    entries[~entries["filepath"].isin(new_filepaths)],
+                    pd.DataFrame(new_entries, columns=list(DownloadResult._fields)),
+                ],
+                ignore_index=True,
+            )
+            write_download_manifest(path, entries)
+    return [results[i] for i in range(len(downloads))]
+
+
+def download_shimwell_catalog(path: str):
     _path = Path(path) / SHIMWELL_FILENAME
 
     if not _path.exists():
-        download_file_streamed(_path, shimwell_catalog_url)
+        url = SHIMWELL_CATALOG_URL_TEMPLATE.format(SHIMWELL_FILENAME)
+        download_file_resumable(_path, url)
+
+
+def resolve_shimwell_catalog_filepath(path: Union[str, Path]) -> Path:
+    _path = Path(path)
+    if not str(_path).endswith(".fits"):
+        _path = _path / SHIMWELL_FILENAME
+    return _path
+
+
+def create_catalog_cache_filepath(path: Union[str, Path]) -> Path:
+    """Returns the filepath of the Parquet cache next to a FITS catalog"""
+    return resolve_shimwell_catalog_filepath(path).with_suffix(CATALOG_CACHE_SUFFIX)
+
+
+def convert_shimwell_catalog_to_parquet(
+    path: Union[str, Path],
+    overwrite: bool = False,
+    row_group_size: int = DEFAULT_CATALOG_ROW_GROUP_SIZE,
+) -> Path:
+    """Converts the shimwell catalog once into a Parquet file next to it
+
+    The byte columns are decoded to strings before writing, so later
+    reads skip the FITS parsing and decoding completely. The cache is
+    rebuilt if the FITS file is newer than the Parquet file. Small row
+    groups keep the min/max statistics selective enough to skip most of
+    the file when filtering.
+    """
+    fits_filepath = resolve_shimwell_catalog_filepath(path)
+    cache_filepath = create_catalog_cache_filepath(fits_filepath)
+
+    if cache_filepath.exists() and not overwrite:
+        if (
+            not fits_filepath.exists()
+            or cache_filepath.stat().st_mtime >= fits_filepath.stat().st_mtime
+        ):
+            return cache_filepath
+
+    log.info(f"Converting {fits_filepath} to {cache_filepath}")
+    catalog = column_dtype_byte_to_string(Table.read(fits_filepath).to_pandas())
+
+    temporary_filepath = cache_filepath.with_name(cache_filepath.name + ".tmp")
+    catalog.to_parquet(
+        temporary_filepath, engine="pyarrow", index=False, row_group_size=row_group_size
+    )
+    os.replace(temporary_filepath, cache_filepath)
+    return cache_filepath
+
+
+def filter_catalog(
+    catalog: pd.DataFrame, filters: List[Tuple[str, str, object]]
+) -> pd.DataFrame:
+    """Applies Parquet style filters to an in-memory catalog
+
+    The filters are a list of (column, operator, value) tuples which
+    are combined with a logical and, e.g. [("S_Code", "==", "S")].
+    """
+    mask = np.ones(len(catalog), dtype=bool)
+    for column, operator, value in filters:
+        values = catalog[column]
+        if operator in ("==", "="):
+            selection = values == value
+        elif operator == "!=":
+            selection = values != value
+        elif operator == "<":
+            selection = values < value
+        elif operator == "<=":
+            selection = values <= value
+        elif operator == ">":
+            selection = values > value
+        elif operator == ">=":
+            selection = values >= value
+        elif operator == "in":
+            selection = values.isin(value)
+        elif operator == "not in":
+            selection = ~values.isin(value)
+        else:
+            raise ValueError(
+                f"Filter operator {operator} is not one of {CATALOG_FILTER_OPERATORS}"
+            )
+        mask &= np.asarray(selection, dtype=bool)
+    return catalog.loc[mask].reset_index(drop=True)
+
+
+def compact_catalog(
+    catalog: pd.DataFrame,
+    categorical_columns: List[str] = CATALOG_CATEGORICAL_COLUMNS,
+    string_columns: List[str] = CATALOG_STRING_COLUMNS,
+    float32: bool = True,
+) -> pd.DataFrame:
+    """Returns a catalog with a compact in-memory representation
+
+    Low-cardinality columns like Mosaic_ID and S_Code become categoricals,
+    names become Arrow backed strings and, if float32 is set, all float
+    columns except the coordinates are stored as float32. The coordinates
+    stay float64 since float32 only resolves about 0.03 arcsec at RA=360.
+    """
+    catalog = catalog.copy()
+    for column in categorical_columns:
+        if column in catalog.columns:
+            catalog[column] = catalog[column].astype("category")
+    for column in string_columns:
+        if column in catalog.columns:
+            catalog[column] = catalog[column].astype("string[pyarrow]")
+    if float32:
+        float_columns = [
+            column
+            for column in catalog.select_dtypes(include="float64").columns
+            if column not in CATALOG_COORDINATE_COLUMNS
+        ]
+        catalog[float_columns] = catalog[float_columns].astype(np.float32)
+    return catalog
+
+
+def select_catalog_categories(
+    catalog: pd.DataFrame, column: str, values: List[str]
+) -> pd.DataFrame:
+    """Selects the rows of a catalog whose column value is in values
+
+    For categorical columns the values are translated to category codes
+    once and the rows are compared as integers.
+    """
+    series = catalog[column]
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        codes = series.cat.categories.get_indexer(values)
+        mask = np.isin(series.cat.codes.values, codes[codes >= 0])
+    else:
+        mask = series.isin(values).values
+    return catalog.loc[mask]
+
+
+def calculate_catalog_group_indices(
+    catalog: pd.DataFrame, column: str = "Mosaic_ID"
+) -> Dict[str, np.ndarray]:
+    """Returns the row positions of every group of a catalog column
+
+    The groups are in order of first appearance like `Series.unique`, so
+    the writers keep their mosaic order. The rows are factorized once (via
+    the codes for categorical columns) and split with a stable sort
+    instead of comparing the whole column against every mosaic.
+    """
+    codes, uniques = pd.factorize(catalog[column], sort=False)
+    order = np.argsort(codes, kind="stable")
+    counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+    number_of_missing = len(codes) - counts.sum()
+    groups = np.split(order[number_of_missing:], np.cumsum(counts)[:-1])
+    return dict(zip(uniques.tolist(), groups))
 
 
-def read_shimwell_catalog(path: str, reduced: bool = False) -> pd.DataFrame:
+def read_shimwell_catalog(
+    path: str,
+    reduced: bool = False,
+    columns: Optional[List[str]] = None,
+    filters: Optional[List[Tuple[str, str, object]]] = None,
+    cache: bool = False,
+    compact: bool = False,
+) -> pd.DataFrame:
     """Reads in the shimwell catalog as DataFrame
 
     Additionally converts the byte columns to string such that they
     can be used in filtering actions via str-functions.
+
+    With cache=True the catalog is converted once into a Parquet file
+    next to the FITS file. Then only the requested columns are read and
+    the filters, e.g. [("Mosaic_ID", "in", ["P205+55"])], are pushed
+    down to the row groups. Without the cache the same columns and
+    filters are applied after reading the FITS table.
+
+    With compact=True the catalog is returned in the representation of
+    `compact_catalog`.
     """
 
-    _path = Path(path)
-    if not str(_path).endswith(".fits"):
-        _path = _path / SHIMWELL_FILENAME
+    _path = resolve_shimwell_catalog_filepath(path)
+    if columns is None and reduced:
+        columns = SHIMWELL_REDUCED_COLUMNS
+
+    if cache:
+        cache_filepath = convert_shimwell_catalog_to_parquet(_path)
+        table = pd.read_parquet(
+            cache_filepath, engine="pyarrow", columns=columns, filters=filters or None
+        )
+    else:
+        table = column_dtype_byte_to_string(Table.read(_path).to_pandas())
+        if filters:
+            table = filter_catalog(table, filters)
+        if columns is not None:
+            table = table.loc[:, columns].copy()
 
-    table = Table.read(_path).to_pandas()
-    if reduced:
-        table = table.loc[:, ["Source_Name", "RA", "DEC", "S_Code", "Mosaic_ID"]].copy()
-    return column_dtype_byte_to_string(table)
+    if compact:
+        table = compact_catalog(table)
+    return table
 
 
 def create_mosaic_filepath(mosaic_id: str, path: str) -> str:
@@ -77,13 +502,25 @@ def download_mosaic(mosaic_id: str, path: str) -> str:
     mosaic_filename = MOSAIC_FILENAME_TEMPLATE.format(mosaic_id)
     mosaic_filepath = os.path.join(path, mosaic_filename)
 
-    mosaic_url = f"https://lofar-surveys.org/public/mosaics/{mosaic_filename}"
+    mosaic_url = MOSAIC_URL_TEMPLATE.format(mosaic_filename)
 
-    download_file_streamed(path, mosaic_url)
+    download_file_resumable(mosaic_filepath, mosaic_url)
 
     return mosaic_filepath
 
 
+def download_mosaics(
+    mosaic_ids: List[str],
+    path: str,
+    max_workers: int = DEFAULT_DOWNLOAD_WORKERS,
+    url_template: str = MOSAIC_URL_TEMPLATE,
+) -> List[DownloadResult]:
+    """Downloads several mosaics concurrently, see download_files"""
+    filenames = [MOSAIC_FILENAME_TEMPLATE.format(mosaic_id) for mosaic_id in mosaic_ids]
+    downloads = [(url_template.format(filename), filename) for filename in filenames]
+    return download_files(downloads, path, max_workers=max_workers)
+
+
 def load_mosaic(mosaic_id: str, path: str, download=False) -> Optional[PrimaryHDU]:
     """Load mosaic with mosaic_id from filepath
 
@@ -109,55 +546,226 @@ def load_mosaic(mosaic_id: str, path: str, download=False) -> Optional[PrimaryHD
         return None
 
 
+def load_mosaic_paged_in(
+    mosaic_id: str, path: str, download=False
+) -> Optional[PrimaryHDU]:
+    """Load mosaic with load_mosaic and read all of its data pages
+
+    Touching one value per memory page makes the operating system read the
+    (memory-mapped) data of the mosaic from disk, so later accesses do not
+    wait for the disk.
+    """
+    hdu = load_mosaic(mosaic_id=mosaic_id, path=path, download=download)
+    if hdu is not None and hdu.data is not None:
+        data = hdu.data.reshape(-1)
+        data[:: max(1, mmap.PAGESIZE // data.itemsize)].sum()
+    return hdu
+
+
+def iterate_mosaics(
+    mosaic_ids: List[str],
+    path: str,
+    download=False,
+    prefetch: bool = True,
+    max_memory_bytes: int = DEFAULT_MOSAIC_PREFETCH_MEMORY,
+) -> Iterator[Tuple[str, Optional[PrimaryHDU]]]:
+    """Yields mosaic_id and PrimaryHDU (or None) of every mosaic in mosaic_ids
+
+    If `prefetch` is set, the next mosaic is loaded and paged in by a
+    background thread while the current one is processed, so reading from
+    disk and processing overlap. A mosaic is only prefetched if the files of
+    the current and the next mosaic together are not larger than
+    `max_memory_bytes`, otherwise it is loaded when it is needed.
+    """
+    if not prefetch:
+        for mosaic_id in mosaic_ids:
+            yield mosaic_id, load_mosaic(
+                mosaic_id=mosaic_id, path=path, download=download
+            )
+        return
+
+    def get_file_size(mosaic_id):
+        mosaic_filepath = create_mosaic_filepath(mosaic_id, path)
+        return (
+            os.path.getsize(mosaic_filepath) if os.path.exists(mosaic_filepath) else 0
+        )
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        next_hdu = None
+        for i, mosaic_id in enumerate(mosaic_ids):
+            if next_hdu is None:
+                hdu = load_mosaic(mosaic_id=mosaic_id, path=path, download=download)
+            else:
+                hdu = next_hdu.result()
+            next_hdu = None
+
+            if i + 1 < len(mosaic_ids):
+                next_mosaic_id = mosaic_ids[i + 1]
+                memory = get_file_size(mosaic_id) + get_file_size(next_mosaic_id)
+                if memory <= max_memory_bytes:
+                    log.debug(f"Prefetching {next_mosaic_id}")
+                    next_hdu = executor.submit(
+                        load_mosaic_paged_in, next_mosaic_id, path, download
+                    )
+
+            yield mosaic_id, hdu
+
+
 def get_sizes_of_objects(mosaic_id, mosaic_path, catalog_path, type_list):
     """
     Gets mosaic header and catalog and also list of types S, M and C, outputs list
     of WSCoordiantes and RectangleSizes of objects
     """
-    catalog = read_shimwell_catalog(catalog_path)
-    type_condition = "|".join(type_list)
-    catalog_subset = catalog[
-        (catalog.Mosaic_ID.str.contains(mosaic_id, regex=False))
-        & (catalog.S_Code.str.contains(type_condition, regex=True))
-    ]
+    catalog = read_shimwell_catalog(catalog_path, compact=True)
+    catalog_subset = select_catalog_categories(catalog, "Mosaic_ID", [mosaic_id])
+    catalog_subset = select_catalog_categories(catalog_subset, "S_Code", type_list)
     mosaic_header = load_mosaic(mosaic_id=mosaic_id, path=mosaic_path, download=True)
     return get_sizes_of_object_selection(mosaic_header, catalog_subset)
 
 
+def calculate_object_sizes_in_pixels(catalog: pd.DataFrame, cdelt: float) -> np.ndarray:
+    """Calculates the size of objects in pixels from `Maj` and `E_Maj`
+
+    `Maj` and `E_Maj` are given in arcsec and converted to pixels of a
+    mosaic with pixel scale `cdelt` (in degrees). The error of the major
+    axis is added as padding.
+    """
+    cdelt = np.abs(cdelt)
+    # convert arcsec to degrees, then convert degrees to pixels
+    maj = catalog["Maj"].values * 1 / 3600 * 1 / cdelt
+    e_maj = catalog["E_Maj"].values * 1 / 3600 * 1 / cdelt
+    return maj + e_maj
+
+
+def read_mosaic_cdelts(mosaic_ids: List[str], path: str) -> Dict[str, float]:
+    """Reads the pixel scale CDELT1 of mosaics from their headers only
+
+    Mosaics that do not exist get DEFAULT_MOSAIC_CDELT.
+    """
+    cdelts = {}
+    for mosaic_id in mosaic_ids:
+        try:
+            header = fits.getheader(create_mosaic_filepath(mosaic_id, path))
+            cdelts[mosaic_id] = header["CDELT1"]
+        except FileNotFoundError:
+            log.warning(
+                f"Mosaic {mosaic_id} not found, using CDELT {DEFAULT_MOSAIC_CDELT}"
+            )
+            cdelts[mosaic_id] = DEFAULT_MOSAIC_CDELT
+    return cdelts
+
+
+def calculate_catalog_selection_columns(
+    catalog: pd.DataFrame, cdelt: Union[float, Dict[str, float]] = DEFAULT_MOSAIC_CDELT
+) -> pd.DataFrame:
+    """Calculates the derived selection columns SNR and Size_Pixels of a catalog
+
+    SNR is Peak_flux / Isl_rms and Size_Pixels the size of
+    `calculate_object_sizes_in_pixels`. cdelt is either one pixel scale
+    in degrees or a pixel scale per Mosaic_ID, see read_mosaic_cdelts.
+    """
+    if isinstance(cdelt, dict):
+        cdelt = catalog["Mosaic_ID"].map(cdelt).values.astype(np.float64)
+
+    return pd.DataFrame(
+        {
+            "SNR": catalog["Peak_flux"].values / catalog["Isl_rms"].values,
+            "Size_Pixels": calculate_object_sizes_in_pixels(catalog, cdelt),
+        },
+        index=catalog.index,
+    )
+
+
+def calculate_catalog_selection_mask(
+    catalog: pd.DataFrame,
+    selection: CatalogSelection,
+    cdelt: Union[float, Dict[str, float]] = DEFAULT_MOSAIC_CDELT,
+) -> np.ndarray:
+    """Returns a mask of the catalog objects passing all cuts of the selection"""
+    mask = np.ones(len(catalog), dtype=bool)
+
+    if selection.min_peak_flux is not None:
+        mask &= catalog["Peak_flux"].values >= selection.min_peak_flux
+    if selection.min_total_flux is not None:
+        mask &= catalog["Total_flux"].values >= selection.min_total_flux
+    if selection.max_isl_rms is not None:
+        mask &= catalog["Isl_rms"].values <= selection.max_isl_rms
+    if selection.s_codes is not None:
+        mask &= catalog["S_Code"].isin(selection.s_codes).values
+
+    if selection.min_snr is not None:
+        snr = catalog["Peak_flux"].values / catalog["Isl_rms"].values
+        mask &= snr >= selection.min_snr
+
+    if selection.min_size is not None or selection.max_size is not None:
+        sizes = calculate_catalog_selection_columns(catalog, cdelt)[
+            "Size_Pixels"
+        ].values
+        if selection.min_size is not None:
+            mask &= sizes >= selection.min_size
+        if selection.max_size is not None:
+            mask &= sizes <= selection.max_size
+
+    return mask
+
+
+def select_catalog_objects(
+    catalog: pd.DataFrame,
+    selection: CatalogSelection,
+    cdelt: Union[float, Dict[str, float]] = DEFAULT_MOSAIC_CDELT,
+) -> pd.DataFrame:
+    """Selects the catalog objects passing all cuts of the selection
+
+    All cuts work on catalog columns only, so rejected objects never
+    cost any mosaic I/O.
+    """
+    mask = calculate_catalog_selection_mask(catalog, selection, cdelt)
+    log.info(f"Selected {mask.sum()} of {len(catalog)} objects")
+    return catalog.loc[mask]
+
+
 def get_sizes_of_object_selection(mosaic_header, catalog):
     """
     Gets WSCoordinates and RectangleSizes of Objects based on information in mosaic_header and catalog
 
     """
 
-    cdelt = mosaic_header.header["CDELT1"]
-    if cdelt < 1.0:
-        cdelt = cdelt * -1.0
-    # convert arcsec to degrees, then convert degrees to pixels
-    catalog.loc[:, ["Maj", "Min", "E_Maj", "E_Min"]] = catalog[
-        ["Maj", "Min", "E_Maj", "E_Min"]
-    ].apply(lambda x: x * 1 / 3600 * 1 / cdelt)
-    # add padding for object
-    catalog.loc[:, "Maj"] = catalog["Maj"] + catalog["E_Maj"]
-    catalog.loc[:, "Min"] = catalog["Min"] + catalog["E_Min"]
+    sizes = calculate_object_sizes_in_pixels(
+        catalog, mosaic_header.header["CDELT1"]
+    ).tolist()
     list_of_coordinates = list(
         map(
             WCSCoordinates,
-            np.array(catalog[["RA", "DEC"]].values.tolist())[:, 0],
-            np.array(catalog[["RA", "DEC"]].values.tolist())[:, 1],
-        )
-    )
-    list_of_sizes = list(
-        map(
-            RectangleSize,
-            np.array(catalog[["Maj", "Maj"]].values.tolist())[:, 0],
-            np.array(catalog[["Maj", "Maj"]].values.tolist())[:, 1],
+            catalog["RA"].values.tolist(),
+            catalog["DEC"].values.tolist(),
         )
     )
+    list_of_sizes = list(map(RectangleSize, sizes, sizes))
 
     return list_of_coordinates, list_of_sizes
 
 
+def calculate_cutout_sizes(
+    sizes: np.ndarray,
+    size_factor: float = 1.0,
+    min_size: int = 16,
+    max_size: int = 256,
+    size_step: int = 8,
+) -> np.ndarray:
+    """Converts object sizes in pixels to integer cutout sizes
+
+    The sizes are scaled by `size_factor`, rounded up to a multiple of
+    `size_step` and clipped to [`min_size`, `max_size`]. The rounding
+    groups objects of similar size, which can then be processed as
+    batches of equally sized cutouts.
+    """
+    cutout_sizes = np.ceil(
+        np.asarray(sizes, dtype=np.float64) * size_factor / size_step
+    )
+    cutout_sizes = np.nan_to_num(cutout_sizes * size_step, nan=min_size)
+    return np.clip(cutout_sizes, min_size, max_size).astype(int)
+
+
 def create_cutout2D(
     hdu: PrimaryHDU,
     coordinates: WCSCoordinates,
@@ -180,6 +788,17 @@ def create_cutout2D_as_flattened_numpy_array(
     return create_cutout2D(hdu, coordinates, size, wcs).data.flatten().astype("float32")
 
 
+def create_cutout_hdu(header: fits.Header, cutout: Cutout2D) -> PrimaryHDU:
+    """Creates a PrimaryHDU of a cutout from the header of its mosaic
+
+    Only the header is copied, the data of the mosaic is not touched.
+    The WCS keywords are updated to the WCS of the cutout.
+    """
+    hdu_cutout = PrimaryHDU(data=cutout.data, header=header.copy())
+    hdu_cutout.header.update(cutout.wcs.to_header())
+    return hdu_cutout
+
+
 def create_cutout2D_as_updated_hdu(
     hdu: PrimaryHDU,
     coordinates: WCSCoordinates,
@@ -187,7 +806,1478 @@ def create_cutout2D_as_updated_hdu(
     wcs: WCS = None,
 ) -> PrimaryHDU:
     cutout = create_cutout2D(hdu, coordinates, size, wcs)
-    hdu_cutout = hdu.copy()
-    hdu_cutout.data = cutout.data
-    hdu_cutout.header.update(cutout.wcs.to_header())
-    return hdu_cutout
+    return create_cutout_hdu(hdu.header, cutout)
+
+
+def create_integral_image_filepath(mosaic_id: str, path: str, kind: str) -> str:
+    integral_filename = INTEGRAL_IMAGE_FILENAME_TEMPLATE.format(mosaic_id, kind)
+    return os.path.join(path, integral_filename)
+
+
+def create_integral_image(data: np.ndarray, dtype=np.float64) -> np.ndarray:
+    """Creates the summed-area table of a 2D array
+
+    The table has an additional leading row and column of zeros, such
+    that the sum over `data[top:bottom, left:right]` is given by
+    `I[bottom, right] - I[top, right] - I[bottom, left] + I[top, left]`.
+    """
+    height, width = data.shape
+    integral = np.zeros((height + 1, width + 1), dtype=dtype)
+    np.cumsum(data, axis=0, dtype=dtype, out=integral[1:, 1:])
+    np.cumsum(integral[1:, 1:], axis=1, dtype=dtype, out=integral[1:, 1:])
+    return integral
+
+
+def create_nan_integral_image(data: np.ndarray) -> np.ndarray:
+    """Creates the summed-area table of the NaN pixels in data"""
+    dtype = np.int32 if data.size < np.iinfo(np.int32).max else np.int64
+    return create_integral_image(np.isnan(data), dtype=dtype)
+
+
+def create_sum_integral_image(data: np.ndarray) -> np.ndarray:
+    """Creates the summed-area table of data with NaNs counted as zero"""
+    return create_integral_image(np.nan_to_num(data, nan=0.0))
+
+
+def create_sum_of_squares_integral_image(data: np.ndarray) -> np.ndarray:
+    """Creates the summed-area table of squared data with NaNs counted as zero"""
+    return create_integral_image(np.square(np.nan_to_num(data, nan=0.0)))
+
+
+INTEGRAL_IMAGE_FUNCTIONS = {
+    "nan": create_nan_integral_image,
+    "sum": create_sum_integral_image,
+    "sum-of-squares": create_sum_of_squares_integral_image,
+}
+
+
+def load_integral_image(
+    mosaic_id: str,
+    path: str,
+    kind: str = "nan",
+    hdu: PrimaryHDU = None,
+    overwrite: bool = False,
+) -> Optional[np.ndarray]:
+    """Load a summed-area table of a mosaic
+
+    The table of the given `kind` (one of `INTEGRAL_IMAGE_FUNCTIONS`) is
+    cached as `.npy` file next to the mosaic and opened memory-mapped.
+    If no cache file exists, the table is computed from `hdu` (or the
+    mosaic loaded from `path`) and written to disk.
+    """
+    filepath = create_integral_image_filepath(mosaic_id, path, kind)
+
+    if os.path.exists(filepath) and not overwrite:
+        return np.load(filepath, mmap_mode="r")
+
+    if hdu is None:
+        hdu = load_mosaic(mosaic_id=mosaic_id, path=path)
+        if hdu is None:
+            return None
+
+    log.debug(f"Creating {kind} integral image {filepath}")
+    np.save(filepath, INTEGRAL_IMAGE_FUNCTIONS[kind](hdu.data))
+    return np.load(filepath, mmap_mode="r")
+
+
+def load_nan_integral_image(
+    mosaic_id: str,
+    path: str,
+    hdu: PrimaryHDU = None,
+    overwrite: bool = False,
+) -> Optional[np.ndarray]:
+    """Load the NaN summed-area table of a mosaic"""
+    return load_integral_image(mosaic_id, path, "nan", hdu=hdu, overwrite=overwrite)
+
+
+def load_integral_images(
+    mosaic_id: str,
+    path: str,
+    hdu: PrimaryHDU = None,
+    overwrite: bool = False,
+) -> Optional[IntegralImages]:
+    """Load the NaN, sum and sum of squares summed-area tables of a mosaic
+
+    The mosaic is only loaded if one of the tables is not cached yet.
+    """
+    integral_images_cached = all(
+        os.path.exists(create_integral_image_filepath(mosaic_id, path, kind))
+        for kind in INTEGRAL_IMAGE_FUNCTIONS
+    )
+    if hdu is None and (overwrite or not integral_images_cached):
+        hdu = load_mosaic(mosaic_id=mosaic_id, path=path)
+        if hdu is None:
+            return None
+
+    return IntegralImages(
+        *(
+            load_integral_image(mosaic_id, path, kind, hdu=hdu, overwrite=overwrite)
+            for kind in INTEGRAL_IMAGE_FUNCTIONS
+        )
+    )
+
+
+def is_plain_sin_projection(wcs: WCS) -> bool:
+    """Checks if a WCS is a celestial SIN projection without distortions
+
+    This is the projection of the LoTSS mosaics, for which the world to
+    pixel transformation has a closed form.
+    """
+    return (
+        wcs.naxis == 2
+        and list(wcs.wcs.ctype) == ["RA---SIN", "DEC--SIN"]
+        and list(wcs.wcs.cunit) == ["deg", "deg"]
+        and not wcs.wcs.get_pv()
+        and wcs.wcs.lonpole == 180.0
+        and wcs.sip is None
+        and not wcs.has_distortion
+    )
+
+
+def calculate_sin_pixel_positions(coordinates: np.ndarray, wcs: WCS) -> np.ndarray:
+    """Converts RA and DEC of shape (N, 2) to (x, y) pixel positions of a SIN projection
+
+    Evaluates the orthographic projection around CRVAL directly with NumPy,
+    which avoids the per-coordinate overhead of wcslib. Coordinates on the
+    far side of the projection are NaN, as with wcs_world2pix.
+    """
+    ra_reference, dec_reference = np.radians(wcs.wcs.crval)
+    ra = np.radians(coordinates[:, 0])
+    dec = np.radians(coordinates[:, 1])
+
+    delta_ra = ra - ra_reference
+    cos_dec = np.cos(dec)
+    cos_delta_ra = np.cos(delta_ra)
+    intermediate = np.degrees(
+        np.stack(
+            [
+                cos_dec * np.sin(delta_ra),
+                np.sin(dec) * np.cos(dec_reference)
+                - cos_dec * np.sin(dec_reference) * cos_delta_ra,
+            ]
+        )
+    )
+    pixel_positions = (np.linalg.inv(wcs.pixel_scale_matrix) @ intermediate).T + (
+        wcs.wcs.crpix - 1
+    )
+
+    cos_distance = (
+        np.sin(dec) * np.sin(dec_reference)
+        + cos_dec * np.cos(dec_reference) * cos_delta_ra
+    )
+    pixel_positions[cos_distance < 0] = np.nan
+    return pixel_positions
+
+
+def calculate_pixel_positions(
+    coordinates: List[WCSCoordinates], wcs: WCS
+) -> np.ndarray:
+    """Converts a list of coordinates to (x, y) pixel positions in one call
+
+    SIN projections without distortions are converted with
+    calculate_sin_pixel_positions, all other WCS with wcs_world2pix.
+    Cutout boxes are rounded at integer and half-integer positions, so
+    positions within SIN_PROJECTION_BOUNDARY_TOLERANCE pixels of them are
+    taken from wcs_world2pix to place the boxes exactly like Cutout2D.
+    """
+    coordinates_array = np.asarray(coordinates, dtype=np.float64).reshape(-1, 2)
+    if not is_plain_sin_projection(wcs):
+        return wcs.wcs_world2pix(coordinates_array, 0)
+
+    pixel_positions = calculate_sin_pixel_positions(coordinates_array, wcs)
+    doubled_positions = 2 * pixel_positions
+    is_near_boundary = (
+        np.abs(doubled_positions - np.round(doubled_positions))
+        < 2 * SIN_PROJECTION_BOUNDARY_TOLERANCE
+    ).any(axis=1)
+    if is_near_boundary.any():
+        pixel_positions[is_near_boundary] = wcs.wcs_world2pix(
+            coordinates_array[is_near_boundary], 0
+        )
+    return pixel_positions
+
+
+def calculate_cutout_boxes(
+    pixel_positions: np.ndarray, size: Union[int, RectangleSize]
+) -> BoxCoordinates:
+    """Calculates the (unclipped) pixel boxes of cutouts
+
+    The boxes are calculated the same way Cutout2D places a cutout
+    of `size` around a pixel position, so `data[top:bottom, left:right]`
+    is the cutout if it lies completely inside of the mosaic. The fields
+    of the returned BoxCoordinates are arrays. Non finite positions are
+    mapped to boxes far outside of any mosaic.
+    """
+    if isinstance(size, (int, np.integer)):
+        size = RectangleSize(size, size)
+
+    image_height = int(np.round(size.image_height))
+    image_width = int(np.round(size.image_width))
+
+    pixel_positions = np.asarray(pixel_positions, dtype=np.float64).reshape(-1, 2)
+    finite = np.isfinite(pixel_positions).all(axis=1)
+    x = np.where(finite, pixel_positions[:, 0], -np.iinfo(np.int32).max)
+    y = np.where(finite, pixel_positions[:, 1], -np.iinfo(np.int32).max)
+
+    top = np.ceil(y - image_height / 2.0).astype(np.int64)
+    left = np.ceil(x - image_width / 2.0).astype(np.int64)
+
+    return BoxCoordinates(
+        top=top, right=left + image_width, bottom=top + image_height, left=left
+    )
+
+
+def calculate_box_sums(integral: np.ndarray, boxes: BoxCoordinates) -> np.ndarray:
+    """Sums over boxes using four lookups in a summed-area table
+
+    The boxes are clipped to the extent of the table beforehand.
+    """
+    height, width = integral.shape[0] - 1, integral.shape[1] - 1
+
+    top = np.clip(boxes.top, 0, height)
+    bottom = np.clip(boxes.bottom, 0, height)
+    left = np.clip(boxes.left, 0, width)
+    right = np.clip(boxes.right, 0, width)
+
+    return (
+        integral[bottom, right]
+        - integral[top, right]
+        - integral[bottom, left]
+        + integral[top, left]
+    )
+
+
+def calculate_box_areas_inside(
+    boxes: BoxCoordinates, shape: Tuple[int, int]
+) -> np.ndarray:
+    height, width = shape
+    box_height = np.clip(boxes.bottom, 0, height) - np.clip(boxes.top, 0, height)
+    box_width = np.clip(boxes.right, 0, width) - np.clip(boxes.left, 0, width)
+    return box_height * box_width
+
+
+def calculate_cutout_nan_fractions(
+    hdu: PrimaryHDU,
+    coordinates: List[WCSCoordinates],
+    size: Union[int, RectangleSize],
+    nan_integral: np.ndarray = None,
+    wcs: WCS = None,
+) -> np.ndarray:
+    """Calculates the fraction of invalid pixels for each cutout
+
+    Pixels of a cutout are invalid if they are NaN or lie outside of the
+    mosaic. The calculation needs no pixel data besides the NaN
+    summed-area table, which is created from `hdu` if not provided.
+    """
+    if not wcs:
+        wcs = WCS(hdu.header)
+    if nan_integral is None:
+        nan_integral = create_nan_integral_image(hdu.data)
+
+    shape = (nan_integral.shape[0] - 1, nan_integral.shape[1] - 1)
+    boxes = calculate_cutout_boxes(calculate_pixel_positions(coordinates, wcs), size)
+
+    box_areas = (boxes.bottom - boxes.top) * (boxes.right - boxes.left)
+    valid_pixels = calculate_box_areas_inside(boxes, shape) - calculate_box_sums(
+        nan_integral, boxes
+    )
+
+    return 1.0 - valid_pixels / box_areas
+
+
+def calculate_cutout_statistics(
+    hdu: PrimaryHDU,
+    coordinates: List[WCSCoordinates],
+    size: Union[int, RectangleSize],
+    integral_images: IntegralImages = None,
+    wcs: WCS = None,
+) -> pd.DataFrame:
+    """Calculates mean, std and signal to noise ratio of cutouts
+
+    The statistics are computed over the valid (non NaN) pixels of each
+    cutout inside of the mosaic from the summed-area tables alone, so no
+    cutout is materialized. They match `np.mean` and `np.std` of the
+    extracted cutouts as used in `denoise_cutouts_from_mean` and
+    `calculate_signal_to_noise_ratio`.
+    """
+    if not wcs:
+        wcs = WCS(hdu.header)
+    if integral_images is None:
+        integral_images = IntegralImages(
+            *(function(hdu.data) for function in INTEGRAL_IMAGE_FUNCTIONS.values())
+        )
+
+    nan_integral, sum_integral, sum_of_squares_integral = integral_images
+    shape = (nan_integral.shape[0] - 1, nan_integral.shape[1] - 1)
+    boxes = calculate_cutout_boxes(calculate_pixel_positions(coordinates, wcs), size)
+
+    box_areas = (boxes.bottom - boxes.top) * (boxes.right - boxes.left)
+    number_of_valid_pixels = calculate_box_areas_inside(
+        boxes, shape
+    ) - calculate_box_sums(nan_integral, boxes)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = calculate_box_sums(sum_integral, boxes) / number_of_valid_pixels
+        mean_of_squares = (
+            calculate_box_sums(sum_of_squares_integral, boxes) / number_of_valid_pixels
+        )
+        std = np.sqrt(np.maximum(mean_of_squares - np.square(mean), 0.0))
+        snr = mean / std
+
+    return pd.DataFrame(
+        {
+            "cutout_mean": mean,
+            "cutout_std": std,
+            "cutout_snr": snr,
+            "cutout_nan_fraction": 1.0 - number_of_valid_pixels / box_areas,
+        }
+    )
+
+
+def calculate_catalog_cutout_statistics(
+    catalog: pd.DataFrame,
+    mosaic_path: str,
+    image_size: Union[int, RectangleSize],
+    download: bool = False,
+) -> pd.DataFrame:
+    """Calculates cutout statistics for all objects of a catalog
+
+    The summed-area tables of every mosaic are cached next to the mosaic,
+    so repeated calls only read the mosaic headers. Returns a DataFrame
+    with the index of `catalog` and the columns of
+    `calculate_cutout_statistics`. Objects of missing mosaics get NaNs.
+    """
+    statistics = []
+
+    mosaic_indices = calculate_catalog_group_indices(catalog, "Mosaic_ID")
+    for mosaic_id, indices in mosaic_indices.items():
+        catalog_mosaic_subset = catalog.iloc[indices]
+        hdu = load_mosaic(mosaic_id=mosaic_id, path=mosaic_path, download=download)
+        if hdu is None:
+            continue
+
+        integral_images = load_integral_images(mosaic_id, mosaic_path, hdu=hdu)
+        mosaic_statistics = calculate_cutout_statistics(
+            hdu,
+            catalog_mosaic_subset[["RA", "DEC"]].values,
+            image_size,
+            integral_images=integral_images,
+        )
+        mosaic_statistics.index = catalog_mosaic_subset.index
+        statistics.append(mosaic_statistics)
+
+    columns = ["cutout_mean", "cutout_std", "cutout_snr", "cutout_nan_fraction"]
+    if not statistics:
+        return pd.DataFrame(np.nan, index=catalog.index, columns=columns)
+
+    return pd.concat(statistics).reindex(catalog.index)
+
+
+def create_tile_store_filepaths(
+    mosaic_id: str, path: str, tile_size: int = DEFAULT_TILE_SIZE
+) -> Tuple[str, str]:
+    tiles_filename = TILE_STORE_FILENAME_TEMPLATE.format(mosaic_id, tile_size)
+    header_filename = TILE_STORE_HEADER_FILENAME_TEMPLATE.format(mosaic_id, tile_size)
+    return os.path.join(path, tiles_filename), os.path.join(path, header_filename)
+
+
+def create_mosaic_tile_store(
+    mosaic_id: str,
+    path: str,
+    tile_size: int = DEFAULT_TILE_SIZE,
+    hdu: PrimaryHDU = None,
+    dtype=np.float32,
+    overwrite: bool = False,
+) -> Optional[MosaicTileStore]:
+    """Re-tiles a mosaic into square tiles stored next to the mosaic
+
+    The tiles are written as a single `.npy` array of shape
+    (rows, columns, tile_size, tile_size), padded with NaNs at the
+    right and bottom edges, together with the mosaic header in a
+    separate file. The mosaic is copied one row of tiles at a time
+    to keep the memory footprint small.
+    """
+    tiles_filepath, header_filepath = create_tile_store_filepaths(
+        mosaic_id, path, tile_size
+    )
+
+    if os.path.exists(tiles_filepath) and not overwrite:
+        return load_mosaic_tile_store(mosaic_id, path, tile_size)
+
+    if hdu is None:
+        hdu = load_mosaic(mosaic_id=mosaic_id, path=path)
+        if hdu is None:
+            return None
+
+    height, width = hdu.data.shape
+    rows, columns = -(-height // tile_size), -(-width // tile_size)
+
+    log.debug(f"Creating tile store {tiles_filepath} with {rows}x{columns} tiles")
+    tiles = np.lib.format.open_memmap(
+        tiles_filepath,
+        mode="w+",
+        dtype=dtype,
+        shape=(rows, columns, tile_size, tile_size),
+    )
+    for row in range(rows):
+        tile_row = np.full((tile_size, columns * tile_size), np.nan, dtype=dtype)
+        mosaic_rows = hdu.data[slice(row * tile_size, (row + 1) * tile_size)]
+        tile_row[slice(mosaic_rows.shape[0]), :width] = mosaic_rows
+        tiles[row] = tile_row.reshape(tile_size, columns, tile_size).swapaxes(0, 1)
+    tiles.flush()
+    del tiles
+
+    header = hdu.header.copy()
+    header["TILESIZE"] = (tile_size, "Size of the square tiles in pixels")
+    header.tofile(header_filepath, overwrite=True)
+
+    return load_mosaic_tile_store(mosaic_id, path, tile_size)
+
+
+def load_mosaic_tile_store(
+    mosaic_id: str, path: str, tile_size: int = DEFAULT_TILE_SIZE
+) -> Optional[MosaicTileStore]:
+    """Load the memory-mapped tile store of a mosaic"""
+    tiles_filepath, header_filepath = create_tile_store_filepaths(
+        mosaic_id, path, tile_size
+    )
+
+    try:
+        tiles = np.load(tiles_filepath, mmap_mode="r")
+        header = fits.Header.fromfile(header_filepath)
+    except FileNotFoundError as e:
+        log.error(e)
+        return None
+
+    return MosaicTileStore(
+        tiles=tiles,
+        header=header,
+        tile_size=tile_size,
+        shape=(header["NAXIS2"], header["NAXIS1"]),
+    )
+
+
+def read_tile_store_box(tile_store: MosaicTileStore, box: BoxCoordinates) -> np.ndarray:
+    """Reads a box of pixels from a tile store
+
+    The box is trimmed to the extent of the mosaic, the same way Cutout2D
+    does in its default `trim` mode. A box not larger than a tile touches
+    at most four tiles.
+    """
+    height, width = tile_store.shape
+    tile_size = tile_store.tile_size
+
+    top, bottom = max(int(box.top), 0), min(int(box.bottom), height)
+    left, right = max(int(box.left), 0), min(int(box.right), width)
+
+    if top >= bottom or left >= right:
+        raise ValueError("Arrays do not overlap.")
+
+    data = np.empty((bottom - top, right - left), dtype=tile_store.tiles.dtype)
+
+    for row in range(top // tile_size, (bottom - 1) // tile_size + 1):
+        for column in range(left // tile_size, (right - 1) // tile_size + 1):
+            tile_top, tile_left = row * tile_size, column * tile_size
+            y_min, y_max = max(top, tile_top), min(bottom, tile_top + tile_size)
+            x_min, x_max = max(left, tile_left), min(right, tile_left + tile_size)
+            data_slices = (
+                slice(y_min - top, y_max - top),
+                slice(x_min - left, x_max - left),
+            )
+            tile_slices = (
+                slice(y_min - tile_top, y_max - tile_top),
+                slice(x_min - tile_left, x_max - tile_left),
+            )
+            data[data_slices] = tile_store.tiles[row, column][tile_slices]
+
+    return data
+
+
+def create_cutout2D_from_tile_store(
+    tile_store: MosaicTileStore,
+    coordinates: WCSCoordinates,
+    size: Union[int, RectangleSize],
+    wcs: WCS = None,
+) -> np.ndarray:
+    """Creates the data of a 2D cutout from a tile store
+
+    The result equals the data of `create_cutout2D` on the original
+    mosaic (cast to the dtype of the tile store).
+    """
+    if not wcs:
+        wcs = WCS(tile_store.header)
+    pixel_positions = calculate_pixel_positions([coordinates], wcs)
+    boxes = calculate_cutout_boxes(pixel_positions, size)
+    return read_tile_store_box(tile_store, BoxCoordinates(*(b[0] for b in boxes)))
+
+
+def read_padded_box(
+    source: Union[np.ndarray, MosaicTileStore], box: BoxCoordinates
+) -> np.ndarray:
+    """Reads a box of pixels from a mosaic array or tile store
+
+    Unlike Cutout2D, the box is not trimmed. Pixels outside of the
+    mosaic are set to NaN.
+    """
+    height, width = source.shape
+    dtype = source.tiles.dtype if isinstance(source, MosaicTileStore) else source.dtype
+
+    padded = np.full((box.bottom - box.top, box.right - box.left), np.nan, dtype=dtype)
+    inside = BoxCoordinates(
+        top=max(box.top, 0),
+        right=min(box.right, width),
+        bottom=min(box.bottom, height),
+        left=max(box.left, 0),
+    )
+    if inside.top >= inside.bottom or inside.left >= inside.right:
+        return padded
+
+    if isinstance(source, MosaicTileStore):
+        data = read_tile_store_box(source, inside)
+    else:
+        data = source[
+            slice(inside.top, inside.bottom), slice(inside.left, inside.right)
+        ]
+
+    padded_slices = (
+        slice(inside.top - box.top, inside.bottom - box.top),
+        slice(inside.left - box.left, inside.right - box.left),
+    )
+    padded[padded_slices] = data
+    return padded
+
+
+def create_cutout_stack(data: np.ndarray, boxes: BoxCoordinates) -> np.ndarray:
+    """Gathers equally sized boxes from a mosaic array in one indexing operation
+
+    All boxes have to lie completely inside of the mosaic. Returns an
+    array of shape (number_of_boxes, height, width).
+    """
+    height = int(boxes.bottom[0] - boxes.top[0]) if len(boxes.top) else 0
+    width = int(boxes.right[0] - boxes.left[0]) if len(boxes.left) else 0
+    rows = boxes.top[:, np.newaxis, np.newaxis] + np.arange(height)[:, np.newaxis]
+    columns = boxes.left[:, np.newaxis, np.newaxis] + np.arange(width)
+    return np.asarray(data[rows, columns])
+
+
+def calculate_boxes_inside(boxes: BoxCoordinates, shape: Tuple[int, int]) -> np.ndarray:
+    """Returns a mask of the boxes lying completely inside of shape"""
+    height, width = shape
+    return (
+        (boxes.top >= 0)
+        & (boxes.left >= 0)
+        & (boxes.bottom <= height)
+        & (boxes.right <= width)
+    )
+
+
+def create_multi_size_cutouts(
+    source: Union[np.ndarray, MosaicTileStore],
+    pixel_position: np.ndarray,
+    sizes: List[Union[int, RectangleSize]],
+) -> List[Optional[np.ndarray]]:
+    """Creates cutouts of several sizes around a pixel position from one read
+
+    The box enclosing the cutouts of all sizes is read once and every
+    cutout is cropped from it. A cutout equals the data of Cutout2D for
+    the same position and size, or is None if it exceeds the mosaic (in
+    which case Cutout2D would have truncated it).
+    """
+    boxes = [
+        BoxCoordinates(
+            *(side[0] for side in calculate_cutout_boxes(pixel_position, size))
+        )
+        for size in sizes
+    ]
+    enclosing_box = BoxCoordinates(
+        top=min(box.top for box in boxes),
+        right=max(box.right for box in boxes),
+        bottom=max(box.bottom for box in boxes),
+        left=min(box.left for box in boxes),
+    )
+    height, width = source.shape
+    data = read_padded_box(source, enclosing_box)
+
+    cutouts = []
+    for box in boxes:
+        if not calculate_boxes_inside(box, (height, width)):
+            cutouts.append(None)
+            continue
+
+        cutout_slices = (
+            slice(box.top - enclosing_box.top, box.bottom - enclosing_box.top),
+            slice(box.left - enclosing_box.left, box.right - enclosing_box.left),
+        )
+        cutouts.append(data[cutout_slices])
+
+    return cutouts
+
+
+def write_cutouts_to_fits_file(
+    filepath: Union[str, Path],
+    hdu: PrimaryHDU,
+    coordinates: List[WCSCoordinates],
+    size: Union[int, RectangleSize],
+    multi_extension: bool = False,
+    wcs: Optional[WCS] = None,
+    overwrite: bool = False,
+) -> np.ndarray:
+    """Writes the cutouts of all coordinates to a single FITS file
+
+    By default the cutouts are the planes of a cube in the primary HDU. The
+    binary table CUTOUTS holds RA, DEC and the reference pixel CRPIX1/CRPIX2
+    of every plane, so the WCS of plane i is the WCS of the primary header
+    with the reference pixel of row i (see read_cutout_wcs). With
+    `multi_extension`, every cutout is written to its own ImageHDU with its
+    full WCS header instead. Pixels outside of the mosaic are NaN.
+
+    Returns a boolean mask of the cutouts lying completely inside the mosaic.
+    """
+    if isinstance(size, int):
+        size = RectangleSize(size, size)
+    if not wcs:
+        wcs = WCS(hdu.header)
+
+    pixel_positions = calculate_pixel_positions(coordinates, wcs)
+    boxes = calculate_cutout_boxes(pixel_positions, size)
+    inside = calculate_boxes_inside(boxes, hdu.data.shape)
+
+    cutouts = np.full(
+        (len(pixel_positions), size.image_height, size.image_width),
+        np.nan,
+        dtype=np.result_type(hdu.data.dtype, np.float32),
+    )
+    if inside.any():
+        cutouts[inside] = create_cutout_stack(
+            hdu.data, BoxCoordinates(*(side[inside] for side in boxes))
+        )
+    for i in np.flatnonzero(~inside):
+        cutouts[i] = read_padded_box(
+            hdu.data, BoxCoordinates(*(int(side[i]) for side in boxes))
+        )
+
+    wcs_header = wcs.to_header()
+    crpix1 = wcs_header["CRPIX1"] - boxes.left
+    crpix2 = wcs_header["CRPIX2"] - boxes.top
+
+    coordinates = np.asarray(coordinates, dtype=np.float64).reshape(-1, 2)
+    table = Table(
+        {
+            "RA": coordinates[:, 0],
+            "DEC": coordinates[:, 1],
+            "CRPIX1": crpix1.astype(np.float64),
+            "CRPIX2": crpix2.astype(np.float64),
+            "Complete": inside,
+        }
+    )
+    table_hdu = fits.table_to_hdu(table)
+    table_hdu.name = CUTOUT_TABLE_EXTNAME
+
+    header = hdu.header.copy()
+    header.update(wcs_header)
+    if multi_extension:
+        hdus = [PrimaryHDU(header=header)]
+        for cutout, ra, dec, x, y in zip(cutouts, *coordinates.T, crpix1, crpix2):
+            cutout_header = wcs_header.copy()
+            cutout_header.update(CRPIX1=float(x), CRPIX2=float(y), RA=ra, DEC=dec)
+            hdus.append(fits.ImageHDU(data=cutout, header=cutout_header))
+    else:
+        hdus = [PrimaryHDU(data=cutouts, header=header)]
+
+    fits.HDUList(hdus + [table_hdu]).writeto(filepath, overwrite=overwrite)
+
+    log.info(f"Wrote {len(cutouts)} cutouts to {filepath}")
+    return inside
+
+
+def read_cutout_wcs(filepath: Union[str, Path], index: int) -> WCS:
+    """Reads the WCS of cutout `index` of a file written by write_cutouts_to_fits_file"""
+    with fits.open(filepath) as hdul:
+        if hdul[0].header["NAXIS"] == 3:
+            header = hdul[0].header.copy()
+            row = hdul[CUTOUT_TABLE_EXTNAME].data[index]
+            header.update(CRPIX1=float(row["CRPIX1"]), CRPIX2=float(row["CRPIX2"]))
+            return WCS(header, naxis=2)
+        return WCS(hdul[index + 1].header)
+
+
+def spread_bits(values: np.ndarray) -> np.ndarray:
+    """Spreads the lower 32 bits of values to the even bits of 64 bit integers"""
+    spread = values.astype(np.uint64) & np.uint64(0x00000000FFFFFFFF)
+    for shift, mask in [
+        (16, 0x0000FFFF0000FFFF),
+        (8, 0x00FF00FF00FF00FF),
+        (4, 0x0F0F0F0F0F0F0F0F),
+        (2, 0x3333333333333333),
+        (1, 0x5555555555555555),
+    ]:
+        spread = (spread | (spread << np.uint64(shift))) & np.uint64(mask)
+    return spread
+
+
+def calculate_pixel_cells(pixel_positions: np.ndarray, cell_size: int) -> np.ndarray:
+    """Maps (x, y) pixel positions to non-negative integer cells of cell_size
+
+    Positions with a non finite component are mapped to the last cell.
+    """
+    max_cell = np.iinfo(np.uint32).max
+    pixel_positions = np.asarray(pixel_positions, dtype=np.float64).reshape(-1, 2)
+    finite = np.isfinite(pixel_positions).all(axis=1, keepdims=True)
+    cells = np.where(finite, np.floor_divide(pixel_positions, cell_size), max_cell)
+    return np.clip(cells, 0, max_cell).astype(np.uint64)
+
+
+def calculate_morton_codes(
+    pixel_positions: np.ndarray, cell_size: int = 1
+) -> np.ndarray:
+    """Calculates the Z-order (Morton) codes of (x, y) pixel positions
+
+    The bits of the row are interleaved above the bits of the column,
+    so sorting by the codes walks through the mosaic in Z-order.
+    """
+    cells = calculate_pixel_cells(pixel_positions, cell_size)
+    return spread_bits(cells[:, 0]) | (spread_bits(cells[:, 1]) << np.uint64(1))
+
+
+def plan_extraction_order(
+    pixel_positions: np.ndarray,
+    order: str = "morton",
+    tile_size: int = DEFAULT_TILE_SIZE,
+) -> np.ndarray:
+    """Plans the order in which cutouts of a mosaic are extracted
+
+    Returns the indices of `pixel_positions` sorted by Z-order (`morton`)
+    or by tile row, tile column and row within the tile (`tile`), such
+    that consecutive cutouts are read from nearby pages of the mosaic.
+    The sort is stable, so sources at the same position keep their order.
+    """
+    if order == "morton":
+        return np.argsort(calculate_morton_codes(pixel_positions), kind="stable")
+    elif order == "tile":
+        tiles = calculate_pixel_cells(pixel_positions, tile_size)
+        rows = calculate_pixel_cells(pixel_positions, 1)[:, 1]
+        return np.lexsort((rows, tiles[:, 0], tiles[:, 1]))
+    else:
+        raise ValueError(f"order must be one of {', '.join(EXTRACTION_ORDERS)}")
+
+
+def calculate_mosaic_hash(hdu: PrimaryHDU) -> str:
+    """Calculates a content hash of the header and data of a mosaic"""
+    mosaic_hash = hashlib.blake2b(digest_size=16)
+    mosaic_hash.update(hdu.header.tostring().encode())
+    mosaic_hash.update(np.ascontiguousarray(hdu.data).data)
+    return mosaic_hash.hexdigest()
+
+
+def create_mosaic_hash_filepath(mosaic_id: str, path: str) -> str:
+    mosaic_hash_filename = MOSAIC_HASH_FILENAME_TEMPLATE.format(mosaic_id)
+    return os.path.join(path, mosaic_hash_filename)
+
+
+def load_mosaic_hash(
+    mosaic_id: str,
+    path: str,
+    hdu: PrimaryHDU = None,
+    overwrite: bool = False,
+) -> Optional[str]:
+    """Load the content hash of a mosaic
+
+    The hash is cached in a sidecar file next to the mosaic together with the
+    size and modification time of the mosaic file. It is only calculated
+    (from `hdu` or the mosaic loaded from `path`) if the sidecar is missing
+    or the mosaic file changed.
+    """
+    mosaic_filepath = create_mosaic_filepath(mosaic_id, path)
+    filepath = create_mosaic_hash_filepath(mosaic_id, path)
+    identity = None
+    if os.path.exists(mosaic_filepath):
+        stat = os.stat(mosaic_filepath)
+        identity = f"{stat.st_size} {stat.st_mtime_ns}"
+
+    if identity is not None and os.path.exists(filepath) and not overwrite:
+        with open(filepath) as f:
+            cached_identity, _, mosaic_hash = f.read().strip().rpartition(" ")
+        if cached_identity == identity:
+            return mosaic_hash
+
+    if hdu is None:
+        hdu = load_mosaic(mosaic_id=mosaic_id, path=path)
+        if hdu is None:
+            return None
+
+    log.debug(f"Calculating hash of mosaic {mosaic_id}")
+    mosaic_hash = calculate_mosaic_hash(hdu)
+    if identity is not None:
+        with open(filepath, "w") as f:
+            f.write(f"{identity} {mosaic_hash}\n")
+    return mosaic_hash
+
+
+def create_cutout_cache_key(
+    mosaic_hash: str, coordinates: WCSCoordinates, size: Union[int, RectangleSize]
+) -> str:
+    """Creates the key of a cutout from the mosaic hash, its position and size"""
+    if isinstance(size, int):
+        size = RectangleSize(size, size)
+    ra, dec = coordinates
+    height, width = size
+    key = f"{mosaic_hash}:{float(ra)!r}:{float(dec)!r}:{height}x{width}"
+    return hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
+
+
+class CutoutCache:
+    """
+    A class to represent a content-addressed on-disk cache of raw cutouts
+
+    Cutouts are stored as flattened float32 arrays appended to chunk files
+    of roughly chunk_size_bytes. The index maps the key of a cutout to its
+    chunk, offset and length and is written to index.npy on flush. If the
+    cache grows beyond max_size_bytes, the least recently used chunks are
+    removed as a whole.
+
+    Attributes
+    ----------
+    path : Path
+        directory of the chunk files and the index
+    max_size_bytes : int
+        maximum size of all chunk files in bytes
+    chunk_size_bytes : int
+        size in bytes after which a new chunk file is started
+    entries : Dict[str, Tuple[int, int, int]]
+        chunk, byte offset and length of every cached cutout
+
+    Methods
+    ----------
+    get(key:str)
+        reads a cutout or returns None if it is not cached
+    put(key:str, data:np.ndarray)
+        appends a cutout to the current chunk file
+    flush()
+        writes the index to disk
+    stats()
+        returns the CutoutCacheStats of the cache
+    """
+
+    def __init__(
+        self,
+        path: Union[str, Path],
+        max_size_bytes: int = DEFAULT_CUTOUT_CACHE_MAX_SIZE,
+        chunk_size_bytes: int = DEFAULT_CUTOUT_CACHE_CHUNK_SIZE,
+    ):
+        """
+        Constructor for CutoutCache. Loads the index if the cache already exists
+
+        Parameters
+        ----------
+        path :  Union[str, Path]
+            directory of the cache. Is created if it does not exist
+        max_size_bytes : int
+            maximum size of all chunk files in bytes. Default is DEFAULT_CUTOUT_CACHE_MAX_SIZE
+        chunk_size_bytes : int
+            size in bytes after which a new chunk file is started.
+            Default is DEFAULT_CUTOUT_CACHE_CHUNK_SIZE
+        """
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.max_size_bytes = max_size_bytes
+        self.chunk_size_bytes = chunk_size_bytes
+
+        self.entries: Dict[str, Tuple[int, int, int]] = {}
+        self.chunk_sizes: Dict[int, int] = {}
+        self.chunk_last_used: Dict[int, int] = {}
+        self.access_counter = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self.load_index()
+
+        # Chunks of earlier sessions are never appended to, so bytes written
+        # after the last flush cannot end up in the middle of a chunk.
+        self.current_chunk = max(self.chunk_sizes, default=-1) + 1
+        self.access_counter = self.current_chunk
+
+    def create_chunk_filepath(self, chunk: int) -> Path:
+        return self.path / CUTOUT_CACHE_CHUNK_FILENAME_TEMPLATE.format(chunk)
+
+    def load_index(self):
+        """
+        a method of CutoutCache to load the index and remove unreferenced chunk files
+        """
+        index_filepath = self.path / CUTOUT_CACHE_INDEX_FILENAME
+        if index_filepath.exists():
+            index = np.load(index_filepath)
+            for key, chunk, offset, length in index.tolist():
+                self.entries[key.decode()] = (chunk, offset, length)
+                self.chunk_sizes[chunk] = max(
+                    self.chunk_sizes.get(chunk, 0), offset + 4 * length
+                )
+                self.chunk_last_used[chunk] = chunk
+
+        for chunk_filepath in self.path.glob(
+            CUTOUT_CACHE_CHUNK_FILENAME_TEMPLATE.replace("{:06d}", "*")
+        ):
+            chunk = int(chunk_filepath.stem.split("-")[1])
+            if chunk not in self.chunk_sizes:
+                chunk_filepath.unlink()
+
+    def touch(self, chunk: int):
+        self.access_counter += 1
+        self.chunk_last_used[chunk] = self.access_counter
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        """
+        a method of CutoutCache to read a cached cutout
+
+        Parameters
+        ----------
+        key : str
+            key of the cutout as created by create_cutout_cache_key
+
+        Returns
+        ----------
+        Optional[np.ndarray]
+            flattened float32 cutout or None if it is not cached
+        """
+        if key not in self.entries:
+            self.misses += 1
+            return None
+
+        chunk, offset, length = self.entries[key]
+        try:
+            data = np.fromfile(
+                self.create_chunk_filepath(chunk),
+                dtype=np.float32,
+                count=length,
+                offset=offset,
+            )
+        except FileNotFoundError:
+            log.warning(f"Chunk {chunk} of cutout cache {self.path} is missing")
+            self.remove_chunk(chunk)
+            self.misses += 1
+            return None
+
+        self.touch(chunk)
+        self.hits += 1
+        return data
+
+    def put(self, key: str, data: np.ndarray):
+        """
+        a method of CutoutCache to append a cutout to the current chunk file
+
+        Parameters
+        ----------
+        key : str
+            key of the cutout as created by create_cutout_cache_key
+        data : np.ndarray
+            cutout, stored flattened as float32
+        """
+        if key in self.entries:
+            return
+
+        data = np.ascontiguousarray(data, dtype=np.float32).ravel()
+        offset = self.chunk_sizes.get(self.current_chunk, 0)
+        if offset > 0 and offset + data.nbytes > self.chunk_size_bytes:
+            self.current_chunk += 1
+            offset = 0
+
+        with open(self.create_chunk_filepath(self.current_chunk), "ab") as chunk_file:
+            chunk_file.write(data.tobytes())
+
+        self.entries[key] = (self.current_chunk, offset, data.size)
+        self.chunk_sizes[self.current_chunk] = offset + data.nbytes
+        self.touch(self.current_chunk)
+
+        self.evict()
+
+    def remove_chunk(self, chunk: int):
+        keys = [key for key, entry in self.entries.items() if entry[0] == chunk]
+        for key in keys:
+            del self.entries[key]
+        self.evictions += len(keys)
+        self.chunk_sizes.pop(chunk, None)
+        self.chunk_last_used.pop(chunk, None)
+        self.create_chunk_filepath(chunk).unlink(missing_ok=True)
+
+    def evict(self):
+        """
+        a method of CutoutCache to remove the least recently used chunks until the
+        cache is not larger than max_size_bytes. The current chunk is kept
+        """
+        while self.size_bytes() > self.max_size_bytes:
+            chunks = [
+                chunk for chunk in self.chunk_sizes if chunk != self.current_chunk
+            ]
+            if not chunks:
+                break
+            chunk = min(chunks, key=self.chunk_last_used.__getitem__)
+            log.debug(f"Evicting chunk {chunk} of cutout cache {self.path}")
+            self.remove_chunk(chunk)
+
+    def size_bytes(self) -> int:
+        return sum(self.chunk_sizes.values())
+
+    def flush(self):
+        """
+        a method of CutoutCache to write the index next to the chunk files
+        """
+        index = np.array(
+            [(key.encode(), *entry) for key, entry in self.entries.items()],
+            dtype=CUTOUT_CACHE_INDEX_DTYPE,
+        )
+        index_filepath = self.path / CUTOUT_CACHE_INDEX_FILENAME
+        temporary_filepath = index_filepath.with_suffix(".tmp.npy")
+        np.save(temporary_filepath, index)
+        os.replace(temporary_filepath, index_filepath)
+
+    def stats(self) -> CutoutCacheStats:
+        """
+        a method of CutoutCache to report hits, misses, evictions and size
+
+        Returns
+        ----------
+        CutoutCacheStats
+        """
+        return CutoutCacheStats(
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions,
+            entries=len(self.entries),
+            size_bytes=self.size_bytes(),
+        )
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.entries
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __enter__(self) -> "CutoutCache":
+        return self
+
+    def __exit__(self, *args):
+        self.flush()
+
+
+def calculate_unit_vectors(coordinates: np.ndarray) -> np.ndarray:
+    """Converts RA and DEC in degrees of shape (N, 2) to unit vectors (N, 3)"""
+    coordinates = np.radians(np.asarray(coordinates, dtype=np.float64).reshape(-1, 2))
+    ra, dec = coordinates[:, 0], coordinates[:, 1]
+    cos_dec = np.cos(dec)
+    return np.stack([cos_dec * np.cos(ra), cos_dec * np.sin(ra), np.sin(dec)], axis=1)
+
+
+def convert_arcsec_to_chord(separation: np.ndarray) -> np.ndarray:
+    """Converts angular separations in arcsec to chord lengths on the unit sphere"""
+    return 2 * np.sin(np.radians(np.asarray(separation) / 3600) / 2)
+
+
+def convert_chord_to_arcsec(chord: np.ndarray) -> np.ndarray:
+    """Converts chord lengths on the unit sphere to angular separations in arcsec"""
+    return np.degrees(2 * np.arcsin(np.clip(np.asarray(chord) / 2, 0, 1))) * 3600
+
+
+def create_spatial_index(coordinates: Union[np.ndarray, pd.DataFrame]) -> SpatialIndex:
+    """Builds a KD-tree over the unit vectors of sky coordinates
+
+    Accepts RA and DEC in degrees of shape (N, 2) or a catalog with RA
+    and DEC columns. Working on unit vectors avoids the RA wrap-around
+    and the pole distortions of a tree over (RA, DEC) directly.
+    """
+    if isinstance(coordinates, pd.DataFrame):
+        coordinates = coordinates[["RA", "DEC"]].values
+    coordinates = np.asarray(coordinates, dtype=np.float64).reshape(-1, 2)
+    tree = cKDTree(calculate_unit_vectors(coordinates))
+    return SpatialIndex(tree=tree, coordinates=coordinates)
+
+
+def create_spatial_index_filepath(catalog_path: Union[str, Path]) -> Path:
+    _path = resolve_shimwell_catalog_filepath(catalog_path)
+    return _path.with_name(_path.stem + SPATIAL_INDEX_FILENAME_SUFFIX)
+
+
+def write_spatial_index(index: SpatialIndex, filepath: Union[str, Path]):
+    """Pickles the KD-tree including its node structure to a file"""
+    temporary_filepath = Path(str(filepath) + ".tmp")
+    with open(temporary_filepath, "wb") as f:
+        pickle.dump(index, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temporary_filepath, filepath)
+
+
+def read_spatial_index(filepath: Union[str, Path]) -> SpatialIndex:
+    with open(filepath, "rb") as f:
+        return pickle.load(f)
+
+
+def load_spatial_index(
+    catalog_path: Union[str, Path], catalog: Optional[pd.DataFrame] = None
+) -> SpatialIndex:
+    """Loads the spatial index of a catalog or builds it once
+
+    The index is stored next to the catalog file and rebuilt if the
+    catalog file is newer. If no catalog is given it is read from
+    catalog_path. The index has the row order of the full catalog.
+    """
+    filepath = create_spatial_index_filepath(catalog_path)
+    catalog_filepath = resolve_shimwell_catalog_filepath(catalog_path)
+
+    if filepath.exists() and (
+        not catalog_filepath.exists()
+        or filepath.stat().st_mtime >= catalog_filepath.stat().st_mtime
+    ):
+        return read_spatial_index(filepath)
+
+    if catalog is None:
+        catalog = read_shimwell_catalog(catalog_filepath, columns=["RA", "DEC"])
+    index = create_spatial_index(catalog)
+    write_spatial_index(index, filepath)
+    return index
+
+
+def query_cone(
+    index: SpatialIndex, coordinates: np.ndarray, radius: float
+) -> List[np.ndarray]:
+    """Returns the indices of all objects within radius (arcsec) of every position
+
+    Accepts RA and DEC in degrees of shape (N, 2), all positions are
+    queried in one call to the KD-tree.
+    """
+    vectors = calculate_unit_vectors(coordinates)
+    neighbours = index.tree.query_ball_point(vectors, convert_arcsec_to_chord(radius))
+    return [np.sort(np.asarray(n, dtype=np.intp)) for n in neighbours]
+
+
+def count_cone(
+    index: SpatialIndex, coordinates: np.ndarray, radius: float
+) -> np.ndarray:
+    """Returns the number of objects within radius (arcsec) of every position"""
+    vectors = calculate_unit_vectors(coordinates)
+    return np.asarray(
+        index.tree.query_ball_point(
+            vectors, convert_arcsec_to_chord(radius), return_length=True
+        ),
+        dtype=int,
+    ).reshape(-1)
+
+
+def query_nearest_neighbours(
+    index: SpatialIndex,
+    coordinates: np.ndarray,
+    k: int = 1,
+    max_radius: Optional[float] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Finds the k nearest objects of every position
+
+    Returns the separations in arcsec and the indices, both of shape
+    (N, k). Missing neighbours beyond max_radius (arcsec) get an infinite
+    separation and the index len(index.coordinates).
+    """
+    vectors = calculate_unit_vectors(coordinates)
+    distance_upper_bound = np.inf
+    if max_radius is not None:
+        distance_upper_bound = convert_arcsec_to_chord(max_radius)
+
+    chords, indices = index.tree.query(
+        vectors, k=list(range(1, k + 1)), distance_upper_bound=distance_upper_bound
+    )
+    separations = np.where(np.isinf(chords), np.inf, convert_chord_to_arcsec(chords))
+    return separations, indices
+
+
+def query_pairs_within(
+    index: SpatialIndex, radius: float
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Finds all pairs of indexed objects closer than radius (arcsec)
+
+    Returns the pairs of indices (i < j) of shape (M, 2) sorted by i and j
+    and their separations in arcsec.
+    """
+    pairs = index.tree.query_pairs(
+        convert_arcsec_to_chord(radius), output_type="ndarray"
+    ).reshape(-1, 2)
+    pairs = pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))]
+    vectors = index.tree.data
+    chords = np.linalg.norm(vectors[pairs[:, 0]] - vectors[pairs[:, 1]], axis=1)
+    return pairs, convert_chord_to_arcsec(chords)
+
+
+def calculate_declination_bands(
+    dec: np.ndarray, band_width: float = DEFAULT_DECLINATION_BAND_WIDTH
+) -> np.ndarray:
+    """Returns the index of the declination band, counted from DEC=-90"""
+    number_of_bands = int(np.ceil(180 / band_width))
+    bands = np.floor((np.asarray(dec) + 90) / band_width).astype(int)
+    return np.clip(bands, 0, number_of_bands - 1)
+
+
+def write_partitioned_catalog(
+    catalog: pd.DataFrame,
+    path: Union[str, Path],
+    band_width: float = DEFAULT_DECLINATION_BAND_WIDTH,
+    row_group_size: int = DEFAULT_CATALOG_ROW_GROUP_SIZE,
+) -> pd.DataFrame:
+    """Writes a catalog as Parquet partitions by Mosaic_ID and declination band
+
+    Every partition holds all columns in the original row order. The
+    manifest lists the file, the number of rows and the RA/DEC bounds of
+    every partition, so loaders can select partitions without opening
+    them. Returns the manifest.
+    """
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+
+    catalog = catalog.reset_index(drop=True)
+    bands = calculate_declination_bands(catalog["DEC"].values, band_width)
+    partitions = []
+
+    mosaic_indices = calculate_catalog_group_indices(catalog, "Mosaic_ID")
+    for mosaic_id, indices in mosaic_indices.items():
+        for band in np.unique(bands[indices]):
+            partition = catalog.iloc[indices[bands[indices] == band]]
+            filename = CATALOG_PARTITION_FILENAME_TEMPLATE.format(mosaic_id, band)
+            (path / filename).parent.mkdir(parents=True, exist_ok=True)
+            partition.to_parquet(
+                path / filename,
+                engine="pyarrow",
+                index=False,
+                row_group_size=row_group_size,
+            )
+            partitions.append(
+                {
+                    "Filename": filename,
+                    "Mosaic_ID": mosaic_id,
+                    "DEC_Band": band,
+                    "Rows": len(partition),
+                    "RA_Min": partition["RA"].min(),
+                    "RA_Max": partition["RA"].max(),
+                    "DEC_Min": partition["DEC"].min(),
+                    "DEC_Max": partition["DEC"].max(),
+                }
+            )
+
+    manifest = pd.DataFrame(partitions)
+    manifest.to_parquet(path / CATALOG_MANIFEST_FILENAME, engine="pyarrow", index=False)
+    log.info(f"Wrote {len(catalog)} objects in {len(manifest)} partitions to {path}")
+    return manifest
+
+
+def read_catalog_manifest(path: Union[str, Path]) -> pd.DataFrame:
+    return pd.read_parquet(Path(path) / CATALOG_MANIFEST_FILENAME, engine="pyarrow")
+
+
+def calculate_region_mask(
+    ra: np.ndarray, dec: np.ndarray, region: Tuple[float, float, float, float]
+) -> np.ndarray:
+    """Returns which coordinates lie inside a region (ra_min, ra_max, dec_min, dec_max)
+
+    The region wraps around RA=0 if ra_min is larger than ra_max.
+    """
+    ra_min, ra_max, dec_min, dec_max = region
+    ra = np.mod(ra, 360)
+    if ra_min <= ra_max:
+        ra_mask = (ra >= ra_min) & (ra <= ra_max)
+    else:
+        ra_mask = (ra >= ra_min) | (ra <= ra_max)
+    return ra_mask & (dec >= dec_min) & (dec <= dec_max)
+
+
+def select_catalog_partitions(
+    manifest: pd.DataFrame,
+    mosaic_ids: Optional[List[str]] = None,
+    region: Optional[Tuple[float, float, float, float]] = None,
+) -> pd.DataFrame:
+    """Selects the partitions of a manifest matching the mosaics and the region
+
+    A partition matches the region if its bounding box overlaps with it.
+    Partitions spanning more than 180 degrees in RA wrap around RA=0 and
+    are always kept.
+    """
+    mask = np.ones(len(manifest), dtype=bool)
+    if mosaic_ids is not None:
+        mask &= manifest["Mosaic_ID"].isin(mosaic_ids).values
+
+    if region is not None:
+        ra_min, ra_max, dec_min, dec_max = region
+        dec_overlap = (manifest["DEC_Max"] >= dec_min) & (
+            manifest["DEC_Min"] <= dec_max
+        )
+        if ra_min <= ra_max:
+            ra_overlap = (manifest["RA_Max"] >= ra_min) & (manifest["RA_Min"] <= ra_max)
+        else:
+            ra_overlap = (manifest["RA_Max"] >= ra_min) | (manifest["RA_Min"] <= ra_max)
+        ra_overlap |= (manifest["RA_Max"] - manifest["RA_Min"]) > 180
+        mask &= (dec_overlap & ra_overlap).values
+
+    return manifest.loc[mask]
+
+
+def read_partitioned_catalog(
+    path: Union[str, Path],
+    mosaic_ids: Optional[List[str]] = None,
+    region: Optional[Tuple[float, float, float, float]] = None,
+    columns: Optional[List[str]] = None,
+) -> pd.DataFrame:
+    """Reads only the partitions of a partitioned catalog matching mosaics or a region
+
+    The objects of the selected partitions are additionally filtered to
+    the exact region. The region is (ra_min, ra_max, dec_min, dec_max) in
+    degrees.
+    """
+    return pd.concat(
+        iterate_partitioned_catalog(
+            path, mosaic_ids=mosaic_ids, region=region, columns=columns
+        ),
+        ignore_index=True,
+    )
+
+
+def iterate_partitioned_catalog(
+    path: Union[str, Path],
+    batch_size: int = DEFAULT_CATALOG_BATCH_SIZE,
+    mosaic_ids: Optional[List[str]] = None,
+    region: Optional[Tuple[float, float, float, float]] = None,
+    columns: Optional[List[str]] = None,
+) -> Iterator[pd.DataFrame]:
+    """Streams a partitioned catalog in batches of at most batch_size rows
+
+    Only the partitions matching the mosaics and the region are opened and
+    never more than one row batch is held in memory, so whole-survey passes
+    work with a constant memory footprint. Yields at least one, possibly
+    empty, batch.
+    """
+    path = Path(path)
+    partitions = select_catalog_partitions(
+        read_catalog_manifest(path), mosaic_ids=mosaic_ids, region=region
+    )
+
+    read_columns = columns
+    if columns is not None and region is not None:
+        read_columns = columns + [c for c in ["RA", "DEC"] if c not in columns]
+
+    empty = True
+    for filename in partitions["Filename"]:
+        parquet_file = pq.ParquetFile(path / filename)
+        for batch in parquet_file.iter_batches(
+            batch_size=batch_size, columns=read_columns
+        ):
+            catalog = batch.to_pandas()
+            if region is not None:
+                mask = calculate_region_mask(
+                    catalog["RA"].values, catalog["DEC"].values, region
+                )
+                catalog = catalog.loc[mask].reset_index(drop=True)
+            if columns is not None:
+                catalog = catalog.loc[:, columns]
+            if len(catalog) > 0:
+                empty = False
+                yield catalog
+
+    if empty:
+        if columns is None:
+            manifest = read_catalog_manifest(path)
+            columns = []
+            if len(manifest) > 0:
+                columns = pq.read_schema(path / manifest["Filename"].iloc[0]).names
+        yield pd.DataFrame(columns=columns)
+
+
+def calculate_box_overlaps(
+    coordinates: np.ndarray, sizes: np.ndarray, pairs: np.ndarray
+) -> np.ndarray:
+    """Calculates the intersection over union of the cutout boxes of pairs of objects
+
+    The square boxes with sizes in arcsec are centered on the RA and DEC
+    (in degrees) of the objects and aligned with the local RA/DEC axes.
+    """
+    first, second = coordinates[pairs[:, 0]], coordinates[pairs[:, 1]]
+    cos_dec = np.cos(np.radians((first[:, 1] + second[:, 1]) / 2))
+    delta_ra = (second[:, 0] - first[:, 0] + 180) % 360 - 180
+    dx = np.abs(delta_ra * cos_dec) * 3600
+    dy = np.abs(second[:, 1] - first[:, 1]) * 3600
+
+    size_first, size_second = sizes[pairs[:, 0]], sizes[pairs[:, 1]]
+    half_sum = (size_first + size_second) / 2
+    max_overlap = np.minimum(size_first, size_second)
+    width = np.clip(half_sum - dx, 0, max_overlap)
+    height = np.clip(half_sum - dy, 0, max_overlap)
+
+    intersection = width * height
+    union = size_first**2 + size_second**2 - intersection
+    return intersection / union
+
+
+def assign_duplicate_groups(
+    catalog: pd.DataFrame,
+    size: Union[float, np.ndarray],
+    min_overlap: float = DEFAULT_DEDUPLICATION_OVERLAP,
+    policy: str = "brightest",
+) -> pd.DataFrame:
+    """Groups objects whose cutout boxes overlap by more than min_overlap
+
+    Two objects are linked if the intersection over union of their square
+    cutouts of size arcsec (scalar or per object) exceeds min_overlap, and
+    groups are the connected components of these links. Candidates are
+    found with the spatial index, so only nearby objects are compared.
+
+    Returns a copy of the catalog with the columns Group_ID, Group_Size
+    and Group_Representative. The representative of every group is chosen
+    by the policy: "brightest" (largest Total_flux), "largest" (largest
+    Maj) or "first" (first row of the group).
+    """
+    if policy not in DEDUPLICATION_POLICIES:
+        raise ValueError(
+            f"Policy {policy} is not one of {list(DEDUPLICATION_POLICIES)}"
+        )
+
+    coordinates = catalog[["RA", "DEC"]].values.astype(np.float64)
+    number_of_objects = len(catalog)
+    sizes = np.broadcast_to(np.asarray(size, dtype=np.float64), (number_of_objects,))
+
+    # boxes can only overlap if their centers are closer than the diagonal
+    index = create_spatial_index(coordinates)
+    radius = sizes.max() * np.sqrt(2) if number_of_objects else 0
+    pairs, _ = query_pairs_within(index, radius)
+    pairs = pairs[calculate_box_overlaps(coordinates, sizes, pairs) > min_overlap]
+
+    graph = coo_matrix(
+        (np.ones(len(pairs)), (pairs[:, 0], pairs[:, 1])),
+        shape=(number_of_objects, number_of_objects),
+    )
+    _, group_ids = connected_components(graph, directed=False)
+
+    column = DEDUPLICATION_POLICIES[policy]
+    score = np.zeros(number_of_objects)
+    if column is not None:
+        score = -np.nan_to_num(catalog[column].values.astype(np.float64), nan=-np.inf)
+    order = np.lexsort((np.arange(number_of_objects), score, group_ids))
+    is_first = np.ones(number_of_objects, dtype=bool)
+    is_first[1:] = group_ids[order[1:]] != group_ids[order[:-1]]
+
+    representative = np.zeros(number_of_objects, dtype=bool)
+    representative[order[is_first]] = True
+
+    catalog = catalog.copy()
+    catalog["Group_ID"] = group_ids
+    catalog["Group_Size"] = np.bincount(group_ids)[group_ids]
+    catalog["Group_Representative"] = representative
+    return catalog
+
+
+def deduplicate_catalog(
+    catalog: pd.DataFrame,
+    size: Union[float, np.ndarray],
+    min_overlap: float = DEFAULT_DEDUPLICATION_OVERLAP,
+    policy: str = "brightest",
+) -> pd.DataFrame:
+    """Keeps one representative per group of overlapping cutouts
+
+    See `assign_duplicate_groups`. The groups are deterministic, so the
+    pruned objects can be recovered by matching the Group_ID of the result
+    with the grouped full catalog.
+    """
+    grouped_catalog = assign_duplicate_groups(
+        catalog, size, min_overlap=min_overlap, policy=policy
+    )
+    deduplicated = grouped_catalog[grouped_catalog["Group_Representative"]]
+    log.info(f"Kept {len(deduplicated)} of {len(catalog)} objects")
+    return deduplicated
@@ -1,19 +1,22 @@
 from typing import Callable, List, Tuple, Union
 
 import numpy as np
-from scipy import signal
+from scipy import ndimage, signal
 from scipy.ndimage.morphology import distance_transform_edt
 from scipy.spatial import ConvexHull
 from skimage.draw import disk, polygon
+from skimage.transform import resize
 
 from hda_fits import pink as hpink
 
 from .logging_config import logging
-from .types import BoxCoordinates
+from .types import BoxCoordinates, ImageOrientations, RectangleSize
 
 log = logging.getLogger(__name__)
 log.setLevel(logging.DEBUG)
 
+DOWNSAMPLING_METHODS = ("mean", "sum")
+
 
 def denoise_cutouts_from_above(cutout_flatarray, sigma=1.5):
     std = np.std(cutout_flatarray)
@@ -314,3 +317,219 @@ def create_weight_factors_gauss(image: np.ndarray, std: float):
     gkerncol = signal.gaussian(col, std=std).reshape(col, 1)
     gkern2d = np.outer(gkernrow, gkerncol)
     return image * gkern2d
+
+
+def resample_images(
+    images: np.ndarray,
+    image_size: Union[int, RectangleSize],
+    order: int = 1,
+    anti_aliasing: bool = True,
+) -> np.ndarray:
+    """Function takes in a stack of images as a 3D numpy array of shape
+    (number_of_images, height, width) and resamples all of them to
+    image_size in a single vectorized interpolation.
+    """
+    if isinstance(image_size, int):
+        image_size = RectangleSize(image_size, image_size)
+
+    number_of_images, height, width = images.shape
+    output_shape = (number_of_images, image_size.image_height, image_size.image_width)
+    if output_shape == images.shape:
+        return images.copy()
+
+    return resize(
+        images,
+        output_shape,
+        order=order,
+        mode="edge",
+        anti_aliasing=anti_aliasing
+        and (image_size.image_height < height or image_size.image_width < width),
+        preserve_range=True,
+    )
+
+
+def calculate_downsampled_size(
+    image_size: Union[int, RectangleSize], factor: float
+) -> RectangleSize:
+    """Function calculates the size of images downsampled by factor. Integer
+    factors drop the border pixels that do not fill a complete block,
+    fractional factors round to the nearest size.
+    """
+    if isinstance(image_size, int):
+        image_size = RectangleSize(image_size, image_size)
+
+    height, width = image_size
+    if float(factor).is_integer():
+        return RectangleSize(height // int(factor), width // int(factor))
+    return RectangleSize(
+        max(1, int(round(height / factor))), max(1, int(round(width / factor)))
+    )
+
+
+def downsample_images(
+    images: np.ndarray, factor: float, method: str = "mean"
+) -> np.ndarray:
+    """Function takes in an image or a stack of images of shape
+    (..., height, width) and downsamples all of them by factor.
+    Integer factors take the mean (or sum) of blocks of factor x factor
+    pixels, the border pixels not filling a block are cropped symmetrically.
+    Fractional factors use the anti-aliased interpolation of resample_images,
+    scaled by factor**2 for method sum to preserve the total flux.
+    """
+    if method not in DOWNSAMPLING_METHODS:
+        raise ValueError(f"method must be one of {DOWNSAMPLING_METHODS}")
+    if factor < 1:
+        raise ValueError("Downsampling factor must be at least 1")
+
+    images = np.asarray(images)
+    *leading_shape, height, width = images.shape
+    stack = images.reshape(-1, height, width)
+    output_height, output_width = calculate_downsampled_size(
+        RectangleSize(height, width), factor
+    )
+
+    if float(factor).is_integer():
+        factor = int(factor)
+        top = (height - output_height * factor) // 2
+        left = (width - output_width * factor) // 2
+        blocks = stack[
+            :,
+            slice(top, top + output_height * factor),
+            slice(left, left + output_width * factor),
+        ].reshape(-1, output_height, factor, output_width, factor)
+        if method == "mean":
+            downsampled = blocks.mean(axis=(2, 4))
+        else:
+            downsampled = blocks.sum(axis=(2, 4))
+    else:
+        downsampled = resample_images(
+            stack, RectangleSize(output_height, output_width), anti_aliasing=True
+        ).astype(stack.dtype, copy=False)
+        if method == "sum":
+            downsampled = downsampled * factor**2
+
+    return downsampled.reshape(*leading_shape, output_height, output_width)
+
+
+def calculate_image_moments(images: np.ndarray) -> Tuple[np.ndarray, ...]:
+    """Function takes in a stack of images of shape (number_of_images, height, width)
+    and calculates the centroid (x, y) and the central second order moments
+    (mu_xx, mu_yy, mu_xy) of the positive pixel values of every image.
+    x runs along the columns, y along the rows, both relative to the image center.
+    """
+    number_of_images, height, width = images.shape
+    weights = np.clip(np.nan_to_num(images), 0, None)
+    y = np.arange(height) - (height - 1) / 2
+    x = np.arange(width) - (width - 1) / 2
+
+    total = weights.sum(axis=(1, 2))
+    total[total == 0] = 1
+
+    x_mean = np.einsum("nij,j->n", weights, x) / total
+    y_mean = np.einsum("nij,i->n", weights, y) / total
+    mu_xx = np.einsum("nij,j->n", weights, x**2) / total - x_mean**2
+    mu_yy = np.einsum("nij,i->n", weights, y**2) / total - y_mean**2
+    mu_xy = np.einsum("nij,i,j->n", weights, y, x) / total - x_mean * y_mean
+    return x_mean, y_mean, mu_xx, mu_yy, mu_xy
+
+
+def calculate_principal_axis_angles(images: np.ndarray) -> np.ndarray:
+    """Function takes in a stack of images of shape (number_of_images, height, width)
+    and calculates the angle in degrees between the x axis and the principal
+    axis of the flux of every image from its second order moments.
+    """
+    _, _, mu_xx, mu_yy, mu_xy = calculate_image_moments(images)
+    return np.degrees(0.5 * np.arctan2(2 * mu_xy, mu_xx - mu_yy))
+
+
+def rotate_images(
+    images: np.ndarray, angles: np.ndarray, order: int = 1, cval: float = 0.0
+) -> np.ndarray:
+    """Function takes in a stack of images of shape (number_of_images, height, width)
+    and rotates every image around its center by its angle in degrees, turning
+    the x axis towards the y axis. All images are interpolated in a single
+    call, pixels rotated in from outside of the image are set to cval.
+    """
+    number_of_images, height, width = images.shape
+    angles = np.radians(np.asarray(angles, dtype=np.float64))[:, None, None]
+    cos, sin = np.cos(angles), np.sin(angles)
+    y = (np.arange(height) - (height - 1) / 2)[None, :, None]
+    x = (np.arange(width) - (width - 1) / 2)[None, None, :]
+
+    shape = (number_of_images, height, width)
+    coordinates = [
+        np.broadcast_to(np.arange(number_of_images)[:, None, None], shape),
+        np.broadcast_to(-x * sin + y * cos + (height - 1) / 2, shape),
+        np.broadcast_to(x * cos + y * sin + (width - 1) / 2, shape),
+    ]
+    return ndimage.map_coordinates(
+        images, coordinates, order=order, mode="constant", cval=cval
+    )
+
+
+def calculate_orientation_flips(
+    images: np.ndarray, eps: float = 1e-6
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Function takes in a stack of aligned images of shape
+    (number_of_images, height, width) and determines which images have to be
+    mirrored so that the third order moments of their flux along x and y are
+    not negative. Images with a skewness within eps of zero are not mirrored.
+    """
+    number_of_images, height, width = images.shape
+    weights = np.clip(np.nan_to_num(images), 0, None)
+    y = np.arange(height) - (height - 1) / 2
+    x = np.arange(width) - (width - 1) / 2
+    x_mean, y_mean, mu_xx, mu_yy, _ = calculate_image_moments(images)
+    total = weights.sum(axis=(1, 2))
+    total[total == 0] = 1
+
+    mu_xxx = np.einsum("nij,nj->n", weights, (x[None, :] - x_mean[:, None]) ** 3)
+    mu_yyy = np.einsum("nij,ni->n", weights, (y[None, :] - y_mean[:, None]) ** 3)
+
+    # Standardized skewness, so that symmetric images are not flipped due to rounding
+    skewness_x = mu_xxx / total / np.maximum(mu_xx, eps) ** 1.5
+    skewness_y = mu_yyy / total / np.maximum(mu_yy, eps) ** 1.5
+    return skewness_x < -eps, skewness_y < -eps
+
+
+def flip_images(
+    images: np.ndarray, flip_x: np.ndarray, flip_y: np.ndarray
+) -> np.ndarray:
+    """Function mirrors the images of a stack of shape (number_of_images, height, width)
+    selected by flip_x along the x axis and the ones selected by flip_y along the y axis.
+    """
+    images = np.where(flip_x[:, None, None], images[:, :, ::-1], images)
+    return np.where(flip_y[:, None, None], images[:, ::-1, :], images)
+
+
+def normalize_image_orientations(
+    images: np.ndarray, flip: bool = False, order: int = 1
+) -> Tuple[np.ndarray, ImageOrientations]:
+    """Function takes in a stack of images of shape (number_of_images, height, width)
+    and rotates every image so that the principal axis of its flux is aligned
+    with the x axis. If flip is set, the images are additionally mirrored so
+    that most of their flux lies towards positive x and y. The applied
+    orientations are returned to undo them with restore_image_orientations.
+    """
+    angles = calculate_principal_axis_angles(images)
+    images_rotated = rotate_images(images, -angles, order=order)
+
+    if flip:
+        flip_x, flip_y = calculate_orientation_flips(images_rotated)
+        images_rotated = flip_images(images_rotated, flip_x, flip_y)
+    else:
+        flip_x = np.full(len(images), False)
+        flip_y = np.full(len(images), False)
+
+    return images_rotated, ImageOrientations(angles, flip_x, flip_y)
+
+
+def restore_image_orientations(
+    images: np.ndarray, orientations: ImageOrientations, order: int = 1
+) -> np.ndarray:
+    """Function undoes normalize_image_orientations for a stack of images of
+    shape (number_of_images, height, width) with the returned orientations.
+    """
+    angle, flip_x, flip_y = orientations
+    images = flip_images(images, np.asarray(flip_x), np.asarray(flip_y))
+    return rotate_images(images, angle, order=order)
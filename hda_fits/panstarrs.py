@@ -1,15 +1,21 @@
 import os
-import tempfile
+import threading
 import time
-from io import StringIO
-from time import sleep
+import warnings
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from io import BytesIO, StringIO
+from pathlib import Path
+from typing import Optional, Union
 
 import numpy as np
 import pandas as pd
 import requests
 from astropy.io import fits
 from astropy.table import Table
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
+from . import fits as hfits
 from .logging_config import logging
 from .types import WCSCoordinates
 
@@ -20,6 +26,485 @@ log.setLevel(logging.DEBUG)
 ps1filename = "https://ps1images.stsci.edu/cgi-bin/ps1filenames.py"
 fitscut = "https://ps1images.stsci.edu/cgi-bin/fitscut.cgi"
 
+DEFAULT_REQUESTS_PER_SECOND = 5.0
+SLEEP_TIME_REQUESTS = 500
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_BACKOFF_FACTOR = 0.5
+DEFAULT_REQUEST_TIMEOUT = 60
+DEFAULT_POOL_SIZE = 10
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+FETCH_MANIFEST_FILENAME = "fetch_manifest.parquet"
+FETCH_MANIFEST_COLUMNS = [
+    "url",
+    "filename",
+    "status",
+    "http_status",
+    "size",
+    "seconds",
+    "error",
+]
+DEFAULT_FETCH_WORKERS = 8
+DEFAULT_FETCH_CHUNK_SIZE = 2**16
+DEFAULT_MANIFEST_FLUSH_INTERVAL = 100
+PS1FILENAMES_CACHE_FILENAME = "ps1filenames_cache.parquet"
+PS1FILENAMES_COLUMNS = [
+    "projcell",
+    "subcell",
+    "filter",
+    "mjd",
+    "type",
+    "filename",
+    "shortname",
+    "badflag",
+]
+PS1FILENAMES_DTYPES = {
+    "RA_Key": "float64",
+    "DEC_Key": "float64",
+    "imagetypes": "string",
+    "projcell": "Int64",
+    "subcell": "Int64",
+    "filter": "string",
+    "mjd": "float64",
+    "type": "string",
+    "filename": "string",
+    "shortname": "string",
+    "badflag": "Int64",
+}
+PS1FILENAMES_CACHE_COLUMNS = ["RA_Key", "DEC_Key", "imagetypes"] + PS1FILENAMES_COLUMNS
+PS1FILENAMES_UNIQUE_COLUMNS = ["RA_Key", "DEC_Key", "imagetypes", "filter", "filename"]
+COORDINATE_KEY_DECIMALS = 7
+MAX_PS1FILENAMES_SEPARATION = 1.0
+DEFAULT_RESOLVE_CHUNK_SIZE = 1000
+DEFAULT_RESOLVE_WORKERS = 4
+PS1_ZONE_HEIGHT = 4.0
+PS1_SKYCELLS_PER_SIDE = 10
+PS1_FIRST_PROJECTION_CELL = 635
+PS1_STACK_FILENAME_TEMPLATE = (
+    "/rings.v3.skycell/{projcell:04d}/{subcell:03d}/"
+    "rings.v3.skycell.{projcell:04d}.{subcell:03d}.stk.{filter}.unconv.fits"
+)
+
+
+class TokenBucket:
+    """
+    A class to represent a token bucket rate limiter shared between threads
+
+    Attributes
+    ----------
+    rate : float
+        tokens added per second, i.e. the allowed requests per second
+    capacity : float
+        maximum number of tokens, i.e. the largest allowed burst of requests
+
+    Methods
+    ----------
+    acquire(tokens:float)
+        blocks until the tokens are available and takes them from the bucket
+    """
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        if rate <= 0:
+            raise ValueError("The rate of a token bucket must be positive")
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.timestamp = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens: float = 1.0):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.timestamp) * self.rate
+                )
+                self.timestamp = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                waiting_time = (tokens - self.tokens) / self.rate
+            time.sleep(waiting_time)
+
+
+def create_session(
+    max_retries: int = DEFAULT_MAX_RETRIES,
+    backoff_factor: float = DEFAULT_BACKOFF_FACTOR,
+    pool_size: int = DEFAULT_POOL_SIZE,
+) -> requests.Session:
+    """
+    Creates a requests Session with a connection pool of pool_size connections per host.
+    Requests failing with a connection error or a status of RETRY_STATUS_CODES are retried
+    up to max_retries times with exponential backoff (backoff_factor * 2 ** retry seconds),
+    a Retry-After header of the service is respected.
+    """
+    retry = Retry(
+        total=max_retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=RETRY_STATUS_CODES,
+        allowed_methods=["GET", "POST"],
+    )
+    adapter = HTTPAdapter(
+        max_retries=retry, pool_connections=pool_size, pool_maxsize=pool_size
+    )
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def fetch_url(
+    url: str,
+    session: requests.Session,
+    rate_limiter: Optional[TokenBucket] = None,
+    timeout: float = DEFAULT_REQUEST_TIMEOUT,
+) -> Optional[bytes]:
+    """
+    Gets the content of url through the session after taking a token of the rate limiter.
+    Returns None if the request failed after all retries.
+    """
+    if rate_limiter is not None:
+        rate_limiter.acquire()
+    try:
+        r = session.get(url, timeout=timeout)
+    except requests.exceptions.RequestException as e:
+        log.warning(e)
+        return None
+    if r.status_code != 200:
+        log.warning(f"Request of {url} returned status {r.status_code}")
+        return None
+    return r.content
+
+
+def create_coordinate_keys(ra: np.ndarray, dec: np.ndarray) -> np.ndarray:
+    """
+    Rounds positions to COORDINATE_KEY_DECIMALS decimals (about 0.04 arcsec) to use them as
+    keys of the ps1filenames cache. Returns an array of shape (N, 2)
+    """
+    return np.round(
+        np.stack([np.asarray(ra, dtype=float), np.asarray(dec, dtype=float)], axis=1),
+        COORDINATE_KEY_DECIMALS,
+    )
+
+
+def read_ps1filenames_cache(cache_directory: str) -> pd.DataFrame:
+    """
+    Reads the cached ps1filenames responses with the columns PS1FILENAMES_CACHE_COLUMNS.
+    Every resolved position, filter and imagetypes has at least one row, with an empty
+    filename if the service has no image.
+    """
+    filepath = Path(cache_directory) / PS1FILENAMES_CACHE_FILENAME
+    if not filepath.exists():
+        return pd.DataFrame(columns=PS1FILENAMES_CACHE_COLUMNS)
+    return pd.read_parquet(filepath)
+
+
+def write_ps1filenames_cache(cache_directory: str, cache: pd.DataFrame):
+    filepath = Path(cache_directory) / PS1FILENAMES_CACHE_FILENAME
+    temporary_filepath = Path(str(filepath) + ".tmp")
+    cache.to_parquet(temporary_filepath, index=False)
+    os.replace(temporary_filepath, filepath)
+
+
+def request_ps1filenames(
+    keys: np.ndarray,
+    filters: str,
+    imagetypes: str,
+    session: requests.Session,
+    timeout: float = DEFAULT_REQUEST_TIMEOUT,
+) -> pd.DataFrame:
+    """
+    Posts one chunk of positions of shape (N, 2) to the ps1filenames.py service and returns
+    the response as rows of the ps1filenames cache. The rows are assigned to the nearest
+    requested position, so they do not depend on the precision of the positions echoed by
+    the service. Filters without an image get a row with an empty filename.
+    """
+    cbuf = StringIO("\n".join("{} {}".format(ra, dec) for ra, dec in keys))
+    r = session.post(
+        ps1filename,
+        data=dict(filters=filters, type=imagetypes),
+        files=dict(file=cbuf),
+        timeout=timeout,
+    )
+    r.raise_for_status()
+    response = Table.read(r.text, format="ascii").to_pandas()
+
+    position = np.zeros(len(response), dtype=int)
+    if len(response) > 0:
+        separations, indices = hfits.query_nearest_neighbours(
+            hfits.create_spatial_index(keys),
+            response[["ra", "dec"]].values,
+            max_radius=MAX_PS1FILENAMES_SEPARATION,
+        )
+        position = indices[:, 0]
+        response = response[np.isfinite(separations[:, 0])]
+        position = position[np.isfinite(separations[:, 0])]
+
+    resolved = response.reindex(columns=PS1FILENAMES_COLUMNS)
+    resolved.insert(0, "RA_Key", keys[position, 0])
+    resolved.insert(1, "DEC_Key", keys[position, 1])
+    resolved.insert(2, "imagetypes", imagetypes)
+
+    found = set(zip(position, resolved["filter"]))
+    missing = [
+        (i, filter)
+        for i in range(len(keys))
+        for filter in filters
+        if (i, filter) not in found
+    ]
+    if missing:
+        missing_positions = np.array([i for i, _ in missing])
+        missing_rows = pd.DataFrame(
+            {
+                "RA_Key": keys[missing_positions, 0],
+                "DEC_Key": keys[missing_positions, 1],
+                "imagetypes": imagetypes,
+                "filter": [filter for _, filter in missing],
+            }
+        ).reindex(columns=PS1FILENAMES_CACHE_COLUMNS)
+        resolved = pd.concat([resolved, missing_rows], ignore_index=True)
+    return resolved
+
+
+def resolve_ps1filenames(
+    ra: np.ndarray,
+    dec: np.ndarray,
+    filters: str = "gri",
+    imagetypes: str = "stack",
+    cache_directory: Optional[str] = None,
+    chunk_size: int = DEFAULT_RESOLVE_CHUNK_SIZE,
+    max_workers: int = DEFAULT_RESOLVE_WORKERS,
+    session: Optional[requests.Session] = None,
+    timeout: float = DEFAULT_REQUEST_TIMEOUT,
+) -> pd.DataFrame:
+    """
+    Resolves the Pan-STARRS image filenames of many positions in chunks of chunk_size
+    positions, with max_workers chunks requested in parallel.
+
+    If cache_directory is set, the resolved filenames are stored in a Parquet cache (see
+    read_ps1filenames_cache) and only the filters of positions missing from the cache
+    are requested.
+
+    If chunks fail, the resolved chunks are still written to the cache before the first
+    error is raised, so resolving again only requests the failed chunks.
+
+    Returns the rows of the ps1filenames response with the additional columns position
+    (row of the input), RA and DEC (input coordinates), ordered by position. Filters
+    without an image are not included.
+    """
+    keys = create_coordinate_keys(ra, dec)
+    cache = pd.DataFrame(columns=PS1FILENAMES_CACHE_COLUMNS)
+    if cache_directory is not None:
+        cache = read_ps1filenames_cache(cache_directory)
+
+    cached = cache[cache["imagetypes"] == imagetypes]
+    cached_filters = cached.groupby(["RA_Key", "DEC_Key"])["filter"].agg(set).to_dict()
+    unique_keys = np.unique(keys, axis=0)
+    # positions are grouped by their uncached filters, only those are requested
+    missing_filters = {}
+    for key in unique_keys:
+        cached_key_filters = cached_filters.get(tuple(key), set())
+        key_filters = "".join(f for f in filters if f not in cached_key_filters)
+        if key_filters:
+            missing_filters.setdefault(key_filters, []).append(key)
+    number_of_uncached_keys = sum(len(k) for k in missing_filters.values())
+
+    if number_of_uncached_keys > 0:
+        log.info(
+            f"Resolving {number_of_uncached_keys} of {len(unique_keys)} positions "
+            f"in chunks of {chunk_size}"
+        )
+        if session is None:
+            session = create_session(pool_size=max_workers)
+        chunks = [
+            (np.array(uncached_keys[i : i + chunk_size]), key_filters)  # noqa: E203
+            for key_filters, uncached_keys in missing_filters.items()
+            for i in range(0, len(uncached_keys), chunk_size)
+        ]
+        responses = []
+        errors = []
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                executor.submit(
+                    request_ps1filenames,
+                    chunk,
+                    chunk_filters,
+                    imagetypes,
+                    session,
+                    timeout,
+                ): chunk
+                for chunk, chunk_filters in chunks
+            }
+            for future in as_completed(futures):
+                try:
+                    responses.append(future.result())
+                except Exception as error:
+                    log.warning(
+                        f"Failed to resolve a chunk of {len(futures[future])} "
+                        f"positions: {error}"
+                    )
+                    errors.append(error)
+        cache = pd.concat([cache] + responses, ignore_index=True)
+        cache = cache.astype(PS1FILENAMES_DTYPES).drop_duplicates(
+            subset=PS1FILENAMES_UNIQUE_COLUMNS, keep="last", ignore_index=True
+        )
+        if cache_directory is not None and responses:
+            write_ps1filenames_cache(cache_directory, cache)
+        if errors:
+            log.warning(
+                f"{len(errors)} of {len(chunks)} chunks failed, the resolved chunks "
+                "are cached and skipped when resolving again"
+            )
+            raise errors[0]
+
+    cache = cache.astype(PS1FILENAMES_DTYPES)
+    cache = cache[
+        (cache["imagetypes"] == imagetypes)
+        & cache["filter"].isin(list(filters))
+        & cache["filename"].notna()
+    ]
+    positions = pd.DataFrame(
+        {"position": np.arange(len(keys)), "RA_Key": keys[:, 0], "DEC_Key": keys[:, 1]}
+    )
+    resolved = positions.merge(cache, on=["RA_Key", "DEC_Key"], how="inner")
+    resolved = resolved.sort_values("position", kind="stable").reset_index(drop=True)
+    resolved.insert(1, "RA", np.asarray(ra, dtype=float)[resolved["position"].values])
+    resolved.insert(2, "DEC", np.asarray(dec, dtype=float)[resolved["position"].values])
+    return resolved.drop(columns=["RA_Key", "DEC_Key", "imagetypes"])
+
+
+def create_ps1_zones() -> pd.DataFrame:
+    """
+    Creates the declination zones of the PS1 RINGS.V3 tessellation. The zones are
+    PS1_ZONE_HEIGHT degrees high and centered on DEC -90, -86, ..., 90, the polar caps
+    are a single projection cell. The other zones have as many projection cells as fit
+    with a width of PS1_ZONE_HEIGHT degrees on their edge closest to the equator.
+    Projection cells are numbered from the south pole and from RA 0 in every zone, which
+    gives the cells 0 to 2643, of which the 3pi survey covers PS1_FIRST_PROJECTION_CELL
+    and up.
+
+    Returns a DataFrame with the columns DEC (zone center), NBAND (number of projection
+    cells) and PROJCELL (first projection cell of the zone)
+    """
+    n_zones = int(round(180 / PS1_ZONE_HEIGHT)) + 1
+    dec = -90 + PS1_ZONE_HEIGHT * np.arange(n_zones)
+    edge = np.clip(np.abs(dec) - PS1_ZONE_HEIGHT / 2, 0, 90)
+    # the small offset keeps zones with an exact integer width from rounding down
+    nband = np.floor(360 / PS1_ZONE_HEIGHT * np.cos(np.radians(edge)) + 1e-9)
+    nband[[0, -1]] = 1
+    nband = nband.astype(int)
+    projcell = np.concatenate([[0], np.cumsum(nband)[:-1]])
+    return pd.DataFrame({"DEC": dec, "NBAND": nband, "PROJCELL": projcell})
+
+
+def calculate_ps1_skycells(ra: np.ndarray, dec: np.ndarray):
+    """
+    Calculates the PS1 projection cell and skycell of positions without querying the
+    ps1filenames.py service.
+
+    A projection cell is a gnomonic projection centered on its zone center DEC and on
+    the RA of the cell, with the RA increasing to the left. It is split into
+    PS1_SKYCELLS_PER_SIDE x PS1_SKYCELLS_PER_SIDE skycells of PS1_ZONE_HEIGHT /
+    PS1_SKYCELLS_PER_SIDE degrees, numbered row by row from the bottom left.
+
+    Returns the arrays projcell and subcell
+    """
+    ra = np.mod(np.asarray(ra, dtype=float), 360)
+    dec = np.asarray(dec, dtype=float)
+    zones = create_ps1_zones()
+
+    zone = np.floor((dec + 90 + PS1_ZONE_HEIGHT / 2) / PS1_ZONE_HEIGHT).astype(int)
+    zone = np.clip(zone, 0, len(zones) - 1)
+    nband = zones["NBAND"].values[zone]
+    band = np.mod(np.round(ra / (360 / nband)).astype(int), nband)
+    projcell = zones["PROJCELL"].values[zone] + band
+
+    ra_center = np.radians(band * 360 / nband)
+    dec_center = np.radians(zones["DEC"].values[zone])
+    ra, dec = np.radians(ra), np.radians(dec)
+    cos_distance = np.sin(dec) * np.sin(dec_center) + np.cos(dec) * np.cos(
+        dec_center
+    ) * np.cos(ra - ra_center)
+    xi = np.cos(dec) * np.sin(ra - ra_center) / cos_distance
+    eta = (
+        np.sin(dec) * np.cos(dec_center)
+        - np.cos(dec) * np.sin(dec_center) * np.cos(ra - ra_center)
+    ) / cos_distance
+
+    skycell_size = np.radians(PS1_ZONE_HEIGHT) / PS1_SKYCELLS_PER_SIDE
+    half_size = np.radians(PS1_ZONE_HEIGHT) / 2
+    x = np.floor((half_size - xi) / skycell_size).astype(int)
+    y = np.floor((eta + half_size) / skycell_size).astype(int)
+    x = np.clip(x, 0, PS1_SKYCELLS_PER_SIDE - 1)
+    y = np.clip(y, 0, PS1_SKYCELLS_PER_SIDE - 1)
+    subcell = y * PS1_SKYCELLS_PER_SIDE + x
+    return projcell, subcell
+
+
+def create_ps1_filenames(
+    ra: np.ndarray, dec: np.ndarray, filters: str = "gri", imagetypes: str = "stack"
+) -> pd.DataFrame:
+    """
+    Creates the stack filenames of positions offline, see calculate_ps1_skycells.
+    Returns the same columns as resolve_ps1filenames (without mjd and badflag, which are
+    only known to the service). Positions outside of the 3pi survey are not included.
+    """
+    if imagetypes != "stack":
+        raise ValueError("Only stack images can be resolved offline")
+    ra = np.asarray(ra, dtype=float)
+    dec = np.asarray(dec, dtype=float)
+    projcell, subcell = calculate_ps1_skycells(ra, dec)
+    position = np.flatnonzero(projcell >= PS1_FIRST_PROJECTION_CELL)
+
+    n_filters = len(filters)
+    position = np.repeat(position, n_filters)
+    filter = np.tile(list(filters), len(position) // max(n_filters, 1))
+    filenames = [
+        PS1_STACK_FILENAME_TEMPLATE.format(projcell=p, subcell=c, filter=f)
+        for p, c, f in zip(projcell[position], subcell[position], filter)
+    ]
+    return pd.DataFrame(
+        {
+            "position": position,
+            "RA": ra[position],
+            "DEC": dec[position],
+            "projcell": projcell[position],
+            "subcell": subcell[position],
+            "filter": filter,
+            "type": imagetypes,
+            "filename": filenames,
+            "shortname": [os.path.basename(filename) for filename in filenames],
+        }
+    )
+
+
+def validate_ps1_filenames(cache_directory: str) -> pd.DataFrame:
+    """
+    Compares the offline stack filenames (create_ps1_filenames) with the responses of
+    the ps1filenames.py service in the cache of cache_directory.
+
+    Returns the cached stack rows with the additional columns Offline_Filename and
+    Match. Positions close to skycell borders lie in the overlap of two skycells, for
+    them both filenames contain the position.
+    """
+    cache = read_ps1filenames_cache(cache_directory).astype(PS1FILENAMES_DTYPES)
+    cache = cache[(cache["type"] == "stack") & cache["filename"].notna()].reset_index(
+        drop=True
+    )
+    projcell, subcell = calculate_ps1_skycells(
+        cache["RA_Key"].values, cache["DEC_Key"].values
+    )
+    cache["Offline_Filename"] = [
+        PS1_STACK_FILENAME_TEMPLATE.format(projcell=p, subcell=c, filter=f)
+        for p, c, f in zip(projcell, subcell, cache["filter"])
+    ]
+    cache["Match"] = cache["Offline_Filename"] == cache["filename"]
+    if not cache["Match"].all():
+        log.warning(
+            f"{(~cache['Match']).sum()} of {len(cache)} cached filenames differ "
+            "from the offline skycells"
+        )
+    return cache
+
 
 def get_images_panstarrs(
     catalog: pd.DataFrame,
@@ -29,9 +514,12 @@ def get_images_panstarrs(
     format: str = "fits",
     imagetypes: str = "stack",
     return_table_only: bool = False,
+    cache_directory: Optional[str] = None,
+    chunk_size: int = DEFAULT_RESOLVE_CHUNK_SIZE,
+    max_workers: int = DEFAULT_RESOLVE_WORKERS,
+    offline: bool = False,
     **kwargs,
 ):
-
     """Query ps1filenames.py service for multiple positions to get a list of images
     This adds a url column to the table to retrieve the cutout.
 
@@ -44,6 +532,11 @@ def get_images_panstarrs(
         stack.mask, stack.exp (exposure time), stack.num (number of exposures),
         warp.wt, and warp.mask.  This parameter can be a list of strings or a
         comma-separated string.
+    cache_directory = directory of the ps1filenames cache, see resolve_ps1filenames.
+        Default is file_directory
+    chunk_size, max_workers = number of positions per request and number of parallel requests
+    offline = create the stack filenames locally instead of querying ps1filenames.py,
+        see create_ps1_filenames
 
     Returns an astropy table with the results
     """
@@ -53,33 +546,42 @@ def get_images_panstarrs(
     # if imagetypes is a list, convert to a comma-separated string
     if not isinstance(imagetypes, str):
         imagetypes = ",".join(imagetypes)
-    # put the positions in an in-memory file object
-    tra = catalog["RA"].tolist()
-    tdec = catalog["DEC"].tolist()
-    tsource = catalog["Source_Name"].tolist()
+    tsource = catalog["Source_Name"].values
     n_bands = len(filters)
 
-    cbuf = StringIO()
-    cbuf.write("\n".join(["{} {}".format(ra, dec) for (ra, dec) in zip(tra, tdec)]))
-    cbuf.seek(0)
-    # use requests.post to pass in positions as a file
-    r = requests.post(
-        ps1filename, data=dict(filters=filters, type=imagetypes), files=dict(file=cbuf)
-    )
-    r.raise_for_status()
-    tab = Table.read(r.text, format="ascii")
+    if cache_directory is None:
+        cache_directory = file_directory
+    if offline:
+        resolved = create_ps1_filenames(
+            catalog["RA"].values,
+            catalog["DEC"].values,
+            filters=filters,
+            imagetypes=imagetypes,
+        )
+    else:
+        resolved = resolve_ps1filenames(
+            catalog["RA"].values,
+            catalog["DEC"].values,
+            filters=filters,
+            imagetypes=imagetypes,
+            cache_directory=cache_directory,
+            chunk_size=chunk_size,
+            max_workers=max_workers,
+        )
 
     urlbase = "{}?size={}&format={}".format(fitscut, size, format)
-    tab["url"] = [
+    resolved["url"] = [
         "{}&ra={}&dec={}&red={}".format(urlbase, ra, dec, filename)
-        for (filename, ra, dec) in zip(tab["filename"], tab["ra"], tab["dec"])
+        for (filename, ra, dec) in zip(
+            resolved["filename"], resolved["RA"], resolved["DEC"]
+        )
     ]
-    pandas_table = Table.to_pandas(tab)
-    pandas_table.rename(columns={"ra": "RA", "dec": "DEC"}, inplace=True)
+    resolved["Source_Name"] = tsource[resolved["position"].values]
+    pandas_table = resolved.drop(columns=["position"])
     grouped = pandas_table.groupby(["RA", "DEC"], sort=False).agg(list)
     grouped.reset_index(inplace=True)
+    grouped["Source_Name"] = grouped["Source_Name"].str[0]
     grouped["number_list"] = grouped.apply(lambda x: len(x["filter"]), axis=1)
-    grouped["Source_Name"] = tsource
     if not grouped[grouped["number_list"] != n_bands].empty:
         log.warning(
             "Following objects with their coordinates have missing filters; RA:{} DEC:{}".format(
@@ -118,7 +620,10 @@ def panstarrs_image_loader(
     astropy_table: Table,
     file_directory: str,
     seperate_channels: bool = True,
-    sleep_time: int = 60,
+    sleep_time: Optional[float] = None,
+    requests_per_second: float = DEFAULT_REQUESTS_PER_SECOND,
+    session: Optional[requests.Session] = None,
+    timeout: float = DEFAULT_REQUEST_TIMEOUT,
 ):
     """
     This function takes in an Astropy Table and saves the files from the Pan STARRS API as
@@ -127,55 +632,49 @@ def panstarrs_image_loader(
     If filepath to FITS file exists, the file is skipped and not downloaded.
     Seperate Channels eg. grizy can be downloaded or a combination of theses channels
     can be calculated and downloaded as a single image.
-    The sleep time for the requests.get function can also be manually set.
+    All requests share one pooled session (see create_session) and are spaced by a token
+    bucket to requests_per_second, so the download rate stays steady at the rate allowed
+    by the service.
+    sleep_time is deprecated: it used to pause sleep_time seconds after every
+    SLEEP_TIME_REQUESTS requests and is now converted to the same average rate of
+    SLEEP_TIME_REQUESTS / sleep_time requests per second.
 
     Returns a saved FITS files saved in specified file_directory and with format:
     {Source_Name}_filter={filter}.fits for seperate channels and {Source_Name}.fits when all channels are combined
     """
+    if sleep_time is not None:
+        requests_per_second = SLEEP_TIME_REQUESTS / sleep_time
+        warnings.warn(
+            "sleep_time is deprecated, use requests_per_second instead. "
+            f"Using requests_per_second={requests_per_second}",
+            DeprecationWarning,
+            stacklevel=2,
+        )
+
     t0 = time.time()
     number_of_missing_images = 0
-    number_of_loading_images = 0
+    if session is None:
+        session = create_session()
+    rate_limiter = TokenBucket(requests_per_second)
+
     if seperate_channels:
         for row in astropy_table:
             coordinates = WCSCoordinates(row["RA"], row["DEC"])
             filter = row["filter"]
-            url = row["url"]
             source_name = row["Source_Name"]
-            filename = "{}_filter={}.fits".format(source_name, filter)
+            filename = create_cutout_filename(source_name, filter)
             filepath = os.path.join(file_directory, filename)
             if not os.path.exists(filepath):
-                try:
-                    number_of_loading_images += 1
-                    if number_of_loading_images <= 500:
-                        r = requests.get(url)
-                        if r.status_code == 200:
-                            with open(filepath, "wb") as fitsfile:
-                                fitsfile.write(r.content)
-                        else:
-                            number_of_missing_images += 1
-                            log.warning(
-                                f"Image at coordinates RA:{coordinates.RA} , DEC:{coordinates.DEC} with name:{source_name} at Band:{filter}\
-                                    not added to panSTARRS file stream"
-                            )
-                    else:
-                        number_of_loading_images = 0
-                        sleep(sleep_time)
-                        r = requests.get(url)
-                        if r.status_code == 200:
-                            with open(filepath, "wb") as fitsfile:
-                                fitsfile.write(r.content)
-                        else:
-                            number_of_missing_images += 1
-                            log.warning(
-                                f"Image at coordinates RA:{coordinates.RA} , DEC:{coordinates.DEC} with name:{source_name} at Band:{filter}\
-                                    not added to panSTARRS file stream"
-                            )
-                except requests.exceptions.ConnectionError:
-                    #                    r.status_code = "Connection refused"
+                content = fetch_url(row["url"], session, rate_limiter, timeout)
+                if content is None:
+                    number_of_missing_images += 1
                     log.warning(
                         f"Image at coordinates RA:{coordinates.RA} , DEC:{coordinates.DEC} with name:{source_name} at Band:{filter}\
-                                    not added to panSTARRS file stream"
+                            not added to panSTARRS file stream"
                     )
+                    continue
+                with open(filepath, "wb") as fitsfile:
+                    fitsfile.write(content)
         log.info(
             "{:.1f} s: loaded {} FITS files from {} expected FITS files at different bands".format(
                 time.time() - t0,
@@ -197,55 +696,21 @@ def panstarrs_image_loader(
             list_of_channel_data = []
             if not os.path.exists(filepath):
                 for filter, url in zip(row["filter"], row["url"]):
-                    try:
-                        number_of_loading_images += 1
-                        if number_of_loading_images <= 500:
-                            r = requests.get(url)
-                            if r.status_code == 200:
-
-                                tf = tempfile.TemporaryFile()
-                                tf.write(r.content)
-                                tf.seek(0)
-                                header = fits.open(tf, mode="update")[0].header
-                                data = fits.open(tf, mode="update")[0].data
-                                list_of_channel_data.append(data)
-                                tf.close()
-                            else:
-                                number_of_missing_images += 1
-                                log.warning(
-                                    f"Image at coordinates RA:{coordinates.RA} , DEC:{coordinates.DEC} with name:{source_name} at Band:{filter}\
-                                        not added to panSTARRS file stream"
-                                )
-                        else:
-                            number_of_loading_images = 0
-                            sleep(sleep_time)
-                            r = requests.get(url)
-                            if r.status_code == 200:
-
-                                tf = tempfile.TemporaryFile()
-                                tf.write(r.content)
-                                tf.seek(0)
-                                header = fits.open(tf, mode="update")[0].header
-                                data = fits.open(tf, mode="update")[0].data
-                                list_of_channel_data.append(data)
-                                tf.close()
-                            else:
-                                number_of_missing_images += 1
-                                log.warning(
-                                    f"Image at coordinates RA:{coordinates.RA} , DEC:{coordinates.DEC} with name:{source_name} at Band:{filter}\
-                                        not added to panSTARRS file stream"
-                                )
-
-                    except requests.exceptions.ConnectionError:
-                        #                        r.status_code = "Connection refused"
+                    content = fetch_url(url, session, rate_limiter, timeout)
+                    if content is None:
                         number_of_missing_images += 1
                         log.warning(
                             f"Image at coordinates RA:{coordinates.RA} , DEC:{coordinates.DEC} with name:{source_name} at Band:{filter}\
-                            not added to panSTARRS file stream"
+                                not added to panSTARRS file stream"
                         )
+                        continue
+                    with fits.open(BytesIO(content)) as hdul:
+                        header = hdul[0].header
+                        list_of_channel_data.append(hdul[0].data)
 
-                image_info = np.mean(np.array(list_of_channel_data), axis=0)
-                fits.writeto(filepath, image_info, header, overwrite=True)
+                if list_of_channel_data:
+                    image_info = np.mean(np.array(list_of_channel_data), axis=0)
+                    fits.writeto(filepath, image_info, header, overwrite=True)
 
         log.info(
             "{:.1f} s: loaded  {} FITS files from {} expected FITS files at different bands".format(
@@ -256,6 +721,163 @@ def panstarrs_image_loader(
         )
 
 
+def create_cutout_filename(source_name: str, filter: str) -> str:
+    return "{}_filter={}.fits".format(source_name, filter)
+
+
+def read_fetch_manifest(file_directory: str) -> pd.DataFrame:
+    """
+    Reads the manifest of the cutouts fetched into file_directory, with one row per url
+    and the columns FETCH_MANIFEST_COLUMNS
+    """
+    filepath = Path(file_directory) / FETCH_MANIFEST_FILENAME
+    if not filepath.exists():
+        return pd.DataFrame(columns=FETCH_MANIFEST_COLUMNS)
+    return pd.read_parquet(filepath)
+
+
+def write_fetch_manifest(file_directory: str, manifest: pd.DataFrame):
+    filepath = Path(file_directory) / FETCH_MANIFEST_FILENAME
+    temporary_filepath = Path(str(filepath) + ".tmp")
+    manifest.to_parquet(temporary_filepath, index=False)
+    os.replace(temporary_filepath, filepath)
+
+
+def fetch_url_to_file(
+    url: str,
+    filepath: Union[str, Path],
+    session: requests.Session,
+    rate_limiter: Optional[TokenBucket] = None,
+    timeout: float = DEFAULT_REQUEST_TIMEOUT,
+    chunk_size: int = DEFAULT_FETCH_CHUNK_SIZE,
+) -> dict:
+    """
+    Streams the response of url into a temporary file which is renamed to filepath when
+    complete. Returns the outcome as a row of the fetch manifest.
+    """
+    filepath = Path(filepath)
+    temporary_filepath = Path(str(filepath) + ".part")
+    outcome = {
+        "url": url,
+        "filename": filepath.name,
+        "status": "failed",
+        "http_status": -1,
+        "size": -1,
+        "seconds": 0.0,
+        "error": "",
+    }
+
+    if rate_limiter is not None:
+        rate_limiter.acquire()
+    t0 = time.perf_counter()
+    try:
+        with session.get(url, stream=True, timeout=timeout) as r:
+            outcome["http_status"] = r.status_code
+            r.raise_for_status()
+            with open(temporary_filepath, "wb") as f:
+                for chunk in r.iter_content(chunk_size=chunk_size):
+                    f.write(chunk)
+        os.replace(temporary_filepath, filepath)
+        outcome["status"] = "fetched"
+        outcome["size"] = filepath.stat().st_size
+    except (requests.exceptions.RequestException, OSError) as e:
+        log.warning(f"Fetching {url} failed: {e}")
+        outcome["error"] = str(e)
+        if temporary_filepath.exists():
+            temporary_filepath.unlink()
+    outcome["seconds"] = time.perf_counter() - t0
+    return outcome
+
+
+def fetch_panstarrs_cutouts(
+    url_table: Union[Table, pd.DataFrame],
+    file_directory: str,
+    max_workers: int = DEFAULT_FETCH_WORKERS,
+    requests_per_second: Optional[float] = DEFAULT_REQUESTS_PER_SECOND,
+    session: Optional[requests.Session] = None,
+    timeout: float = DEFAULT_REQUEST_TIMEOUT,
+    flush_interval: int = DEFAULT_MANIFEST_FLUSH_INTERVAL,
+) -> pd.DataFrame:
+    """
+    Fetches the cutouts of a url table as returned by get_images_panstarrs with
+    return_table_only=True concurrently with max_workers threads.
+
+    Every cutout is streamed to disk as {Source_Name}_filter={filter}.fits like in
+    panstarrs_image_loader. The outcome of every url is recorded in a manifest in
+    file_directory (see read_fetch_manifest) which is flushed every flush_interval
+    urls, so an interrupted run is resumed by calling the function again: urls that
+    were fetched before and whose files exist are skipped. requests_per_second limits
+    the request rate of all threads together, None disables the limit.
+
+    Returns the manifest of all urls of the table
+    """
+    if isinstance(url_table, Table):
+        url_table = url_table.to_pandas()
+    file_directory = Path(file_directory)
+    file_directory.mkdir(parents=True, exist_ok=True)
+
+    if session is None:
+        session = create_session(pool_size=max_workers)
+    rate_limiter = None
+    if requests_per_second is not None:
+        rate_limiter = TokenBucket(requests_per_second)
+
+    manifest = read_fetch_manifest(file_directory)
+    outcomes = {row["url"]: row for row in manifest.to_dict("records")}
+
+    pending = []
+    for url, source_name, filter in zip(
+        url_table["url"], url_table["Source_Name"], url_table["filter"]
+    ):
+        filepath = file_directory / create_cutout_filename(source_name, filter)
+        fetched = outcomes.get(url, {}).get("status") in ("fetched", "skipped")
+        if fetched and filepath.exists():
+            continue
+        if filepath.exists():
+            outcomes[url] = {
+                "url": url,
+                "filename": filepath.name,
+                "status": "skipped",
+                "http_status": -1,
+                "size": filepath.stat().st_size,
+                "seconds": 0.0,
+                "error": "",
+            }
+            continue
+        pending.append((url, filepath))
+
+    log.info(f"Fetching {len(pending)} of {len(url_table)} cutouts")
+    t0 = time.time()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(
+                fetch_url_to_file, url, filepath, session, rate_limiter, timeout
+            )
+            for url, filepath in pending
+        ]
+        for i, future in enumerate(as_completed(futures)):
+            outcome = future.result()
+            outcomes[outcome["url"]] = outcome
+            if (i + 1) % flush_interval == 0:
+                write_fetch_manifest(
+                    file_directory,
+                    pd.DataFrame(
+                        list(outcomes.values()), columns=FETCH_MANIFEST_COLUMNS
+                    ),
+                )
+
+    manifest = pd.DataFrame(list(outcomes.values()), columns=FETCH_MANIFEST_COLUMNS)
+    write_fetch_manifest(file_directory, manifest)
+
+    number_of_failed = sum(outcomes[url]["status"] == "failed" for url, _ in pending)
+    log.info(
+        f"{time.time() - t0:.1f} s: fetched {len(pending) - number_of_failed} of "
+        f"{len(pending)} cutouts, {number_of_failed} failed"
+    )
+    return manifest[manifest["url"].isin(url_table["url"])].reset_index(drop=True)
+
+
 def load_panstarrs_file(
     catalog: pd.DataFrame, source_name: str, path: str, download: bool = False
 ):
@@ -4,27 +4,53 @@ This module provides I/O functionality related to the PINK self
 organizing maps application.
 """
 import struct
-from typing import BinaryIO, List, Tuple, Union
+import time
+from pathlib import Path
+from typing import BinaryIO, List, Optional, Tuple, Union
 
 import numpy as np
 import pandas as pd
 from astropy.io.fits.hdu.image import PrimaryHDU
+from astropy.wcs import WCS
 
 import hda_fits.fits as hfits
 from hda_fits import image_processing as himg
 from hda_fits import panstarrs as ps
-from hda_fits.fits import RectangleSize, WCSCoordinates, load_mosaic
+from hda_fits.fits import RectangleSize, WCSCoordinates
 from hda_fits.logging_config import logging
 from hda_fits.sdss import (
     create_reprojected_rgb_image,
     extract_crossmatch_attributes,
     load_sdss_field_files,
 )
-from hda_fits.types import Layout, PinkHeader
+from hda_fits.types import (
+    CatalogSelection,
+    ImageOrientations,
+    Layout,
+    MosaicTileStore,
+    PinkHeader,
+)
 
 log = logging.getLogger(__name__)
 log.setLevel(logging.DEBUG)
 
+LEDGER_STATUS_WRITTEN = 0
+LEDGER_STATUS_NOT_PROCESSED = 1
+LEDGER_STATUS_MISSING_MOSAIC = 2
+LEDGER_STATUS_OUTSIDE_MOSAIC = 3
+LEDGER_STATUS_CONTAINS_NAN = 4
+LEDGER_STATUS_NAN_FRACTION = 5
+LEDGER_STATUS_DESELECTED = 6
+LEDGER_STATUS_REASONS = {
+    LEDGER_STATUS_WRITTEN: "written",
+    LEDGER_STATUS_NOT_PROCESSED: "not processed",
+    LEDGER_STATUS_MISSING_MOSAIC: "missing mosaic",
+    LEDGER_STATUS_OUTSIDE_MOSAIC: "outside of mosaic",
+    LEDGER_STATUS_CONTAINS_NAN: "contains NaN",
+    LEDGER_STATUS_NAN_FRACTION: "NaN fraction above maximum",
+    LEDGER_STATUS_DESELECTED: "rejected by selection",
+}
+
 
 def read_pink_file_header_from_stream(file_stream: BinaryIO) -> PinkHeader:
     """
@@ -267,6 +293,49 @@ def write_pink_file_header_multichannel(
         )
 
 
+def write_pink_file_header_for_layout(
+    filepath: str,
+    number_of_images: int,
+    image_layout: Layout,
+    overwrite: bool = False,
+):
+    """
+    a function to write a pink file header of version 2 for single or multichannel images.
+    Uses write_pink_file_header for images of depth 1 and
+    write_pink_file_header_multichannel otherwise.
+
+    Parameters
+    ----------
+    filepath :  str
+        filepath to pink file to be written
+    number_of_images : int
+        number of images to be written
+    image_layout : Layout
+        layout of image
+    overwrite : bool
+        Boolean to set if a pink file header should be overwritten. Default is False.
+
+    Returns
+    ----------
+    None
+    """
+    if image_layout.depth == 1:
+        write_pink_file_header(
+            filepath=filepath,
+            number_of_images=number_of_images,
+            image_height=image_layout.height,
+            image_width=image_layout.width,
+            overwrite=overwrite,
+        )
+    else:
+        write_pink_file_header_multichannel(
+            filepath=filepath,
+            number_of_images=number_of_images,
+            image_layout=image_layout,
+            overwrite=overwrite,
+        )
+
+
 def convert_pink_file_header_v1_to_v2(filepath: str):
     """
     converts a pink file with file header format of version 1 to version 2
@@ -377,29 +446,271 @@ def write_pink_file_v2_data(filepath: str, data: np.ndarray):
         f.write(struct.pack("%sf" % data.size, *data.tolist()))
 
 
+def transform_pink_image_data(
+    data: np.ndarray,
+    coordinates: WCSCoordinates,
+    image_size: RectangleSize,
+    min_max_scale: bool = False,
+    denoise: bool = True,
+    fill_nan: bool = False,
+    fill_nan_with_mean: bool = False,
+) -> Optional[np.ndarray]:
+    """
+    transforms the flattened cutout of an object to image data of a pink file
+
+    Parameters
+    ----------
+    data : np.ndarray
+        flattened float32 cutout of the object
+    coordinates : WCSCoordinates
+        WCSCoordinates of the object
+    image_size : RectangleSize
+        size of image/cutout
+    min_max_scale :  bool
+        scales cutout based on minimum and maximum. Default is False
+    denoise : bool
+        denoises cutout based on its mean. Default is True
+    fill_nan : bool
+        fills NaN with mean. Default is False
+    fill_nan_with_mean : bool
+        fills NaN with the mean of the valid pixels. Default is False
+
+    Returns
+    ----------
+    Optional[np.ndarray]
+        image data or None if the cutout contains NaNs or was truncated
+    """
+    number_of_pixels = image_size.image_height * image_size.image_width
+
+    try:
+        if np.isnan(data).any():
+            if fill_nan:
+                data = np.nan_to_num(data, data.mean())
+            elif fill_nan_with_mean:
+                data = np.nan_to_num(data, nan=np.nanmean(data))
+            else:
+                raise ValueError("Objects data array contains NaNs")
+
+        if denoise:
+            data = himg.denoise_cutouts_from_mean(data)
+
+    except ValueError as e:
+        log.warning(e)
+        log.warning(f"Image at coordinates {coordinates} not added to pink file_stream")
+        return None
+
+    if min_max_scale:
+        dmax, dmin = data.max(), data.min()
+        data = (data - dmin) / (dmax - dmin)
+
+    if data.size != number_of_pixels:
+        log.warning(
+            f"Data was truncated. Expected {number_of_pixels}, got {data.size} floats."
+        )
+        log.warning(f"Image at coordinates {coordinates} not added to pink file_stream")
+        return None
+
+    return data
+
+
+def extract_pink_image_data(
+    hdu: PrimaryHDU,
+    coordinates: WCSCoordinates,
+    image_size: RectangleSize,
+    min_max_scale: bool = False,
+    denoise: bool = True,
+    fill_nan: bool = False,
+    fill_nan_with_mean: bool = False,
+    tile_store: Optional[MosaicTileStore] = None,
+    wcs: Optional[WCS] = None,
+    cutout_cache: Optional[hfits.CutoutCache] = None,
+    mosaic_hash: Optional[str] = None,
+) -> Optional[np.ndarray]:
+    """
+    extracts and transforms the cutout of an object as flattened image data of a pink file
+
+    Parameters
+    ----------
+    hdu :  PrimaryHDU
+        PrimaryHDU of mosaic
+    coordinates : WCSCoordinates
+        WCSCoordinates of the object
+    image_size : RectangleSize
+        size of image/cutout
+    min_max_scale :  bool
+        scales cutout based on minimum and maximum. Default is False
+    denoise : bool
+        denoises cutout based on its mean. Default is True
+    fill_nan : bool
+        fills NaN with mean. Default is False
+    fill_nan_with_mean : bool
+        fills NaN with the mean of the valid pixels. Default is False
+    tile_store : Optional[MosaicTileStore]
+        if provided, the cutout is read from the tile store. Default is None
+    wcs : Optional[WCS]
+        WCS of the mosaic. Is created from the header if not provided. Default is None
+    cutout_cache : Optional[CutoutCache]
+        if provided, the raw cutout is read from the cache or added to it. Default is None
+    mosaic_hash : Optional[str]
+        hash of the mosaic as calculated by calculate_mosaic_hash, required with
+        cutout_cache. Default is None
+
+    Returns
+    ----------
+    Optional[np.ndarray]
+        image data or None if the cutout contains NaNs or was truncated
+    """
+    data = None
+    if cutout_cache is not None:
+        cache_key = hfits.create_cutout_cache_key(mosaic_hash, coordinates, image_size)
+        data = cutout_cache.get(cache_key)
+
+    if data is None:
+        try:
+            if tile_store is None:
+                data = hfits.create_cutout2D_as_flattened_numpy_array(
+                    hdu, coordinates, image_size, wcs
+                )
+            else:
+                data = hfits.create_cutout2D_from_tile_store(
+                    tile_store, coordinates, image_size, wcs
+                )
+                data = data.flatten().astype("float32")
+        except ValueError as e:
+            log.warning(e)
+            log.warning(
+                f"Image at coordinates {coordinates} not added to pink file_stream"
+            )
+            return None
+
+        if cutout_cache is not None:
+            cutout_cache.put(cache_key, data)
+
+    return transform_pink_image_data(
+        data,
+        coordinates,
+        image_size,
+        min_max_scale=min_max_scale,
+        denoise=denoise,
+        fill_nan=fill_nan,
+        fill_nan_with_mean=fill_nan_with_mean,
+    )
+
+
+def extract_multi_size_pink_image_data(
+    hdu: PrimaryHDU,
+    coordinates: WCSCoordinates,
+    image_sizes: List[RectangleSize],
+    min_max_scale: bool = False,
+    denoise: bool = True,
+    fill_nan: bool = False,
+    fill_nan_with_mean: bool = False,
+    tile_store: Optional[MosaicTileStore] = None,
+    wcs: Optional[WCS] = None,
+    cutout_cache: Optional[hfits.CutoutCache] = None,
+    mosaic_hash: Optional[str] = None,
+) -> List[Optional[np.ndarray]]:
+    """
+    extracts and transforms the cutouts of an object in several sizes from a single read
+
+    The parameters are the same as for extract_pink_image_data, except for image_sizes.
+    The image data of every size equals the result of extract_pink_image_data.
+
+    Returns
+    ----------
+    List[Optional[np.ndarray]]
+        image data for every size or None if the cutout contains NaNs or was truncated
+    """
+    cutouts = [None] * len(image_sizes)
+    if cutout_cache is not None:
+        cache_keys = [
+            hfits.create_cutout_cache_key(mosaic_hash, coordinates, size)
+            for size in image_sizes
+        ]
+        cutouts = [cutout_cache.get(key) for key in cache_keys]
+
+    if any(cutout is None for cutout in cutouts):
+        if not wcs:
+            wcs = WCS(hdu.header if tile_store is None else tile_store.header)
+
+        pixel_position = hfits.calculate_pixel_positions([coordinates], wcs)
+        cutouts = hfits.create_multi_size_cutouts(
+            hdu.data if tile_store is None else tile_store, pixel_position, image_sizes
+        )
+
+        if cutout_cache is not None:
+            for key, cutout in zip(cache_keys, cutouts):
+                if cutout is not None:
+                    cutout_cache.put(key, cutout)
+
+    images = []
+    for cutout, image_size in zip(cutouts, image_sizes):
+        if cutout is None:
+            log.warning(f"Cutout of size {image_size} exceeds the mosaic")
+            log.warning(
+                f"Image at coordinates {coordinates} not added to pink file_stream"
+            )
+            images.append(None)
+            continue
+
+        images.append(
+            transform_pink_image_data(
+                cutout.flatten().astype("float32"),
+                coordinates,
+                image_size,
+                min_max_scale=min_max_scale,
+                denoise=denoise,
+                fill_nan=fill_nan,
+                fill_nan_with_mean=fill_nan_with_mean,
+            )
+        )
+
+    return images
+
+
+def create_multi_size_filepath(filepath: str, image_size: RectangleSize) -> str:
+    """
+    creates the filepath of the pink file of one size, e.g. objects_95x95.pink for objects.pink
+    """
+    _path = Path(filepath)
+    size_suffix = f"_{image_size.image_height}x{image_size.image_width}"
+    return str(_path.with_name(_path.stem + size_suffix + _path.suffix))
+
+
 def write_mosaic_objects_to_pink_file_v2(
-    filepath: str,
+    filepath: Union[str, List[str]],
     hdu: PrimaryHDU,
     coordinates: List[WCSCoordinates],
-    image_size: Union[int, RectangleSize],
+    image_size: Union[int, RectangleSize, List[Union[int, RectangleSize]]],
     min_max_scale: bool = False,
     denoise: bool = True,
     fill_nan=False,
     overwrite_header=False,
-) -> List[bool]:
+    max_nan_fraction: Optional[float] = None,
+    nan_integral: Optional[np.ndarray] = None,
+    tile_store: Optional[MosaicTileStore] = None,
+    extraction_order: Optional[str] = None,
+    cutout_cache: Optional[hfits.CutoutCache] = None,
+    mosaic_hash: Optional[str] = None,
+    downsample_factor: Optional[float] = None,
+    downsample_method: str = "mean",
+) -> Union[List[bool], List[List[bool]]]:
     """
     writes objects from a mosaic in a pink file of file format version 2
 
     Parameters
     ----------
-    filepath : str
-        filepath of pink file to be written
+    filepath : Union[str, List[str]]
+        filepath of pink file to be written. If image_size is a list, either a list of
+        filepaths (one per size) or a filepath from which the filepaths are created
+        with create_multi_size_filepath
     hdu :  PrimaryHDU
         PrimaryHDU of mosaic
     coordinates : List[WSCoordinates]
         List of WSCoordinates of objects in mosaic
-    image_size : Union[int, RectangleSize]
-        size of image/cutout to be written
+    image_size : Union[int, RectangleSize, List[Union[int, RectangleSize]]]
+        size of image/cutout to be written. If a list of sizes is given, every object is
+        located and read once and a centered crop is written to one pink file per size
     min_max_scale :  bool
         scales cutouts based on minimum and maximum. Default is False
     denoise : bool
@@ -408,73 +719,177 @@ def write_mosaic_objects_to_pink_file_v2(
         fills NaN with mean. Default is False
     overwrite_header : bool
         overwrites header of pink file. Default is False
+    max_nan_fraction : Optional[float]
+        if set, objects whose cutouts have a larger fraction of NaN pixels (or pixels
+        outside of the mosaic) are rejected before extraction. NaNs in the accepted
+        cutouts are filled with the cutout mean. Default is None
+    nan_integral : Optional[np.ndarray]
+        NaN summed-area table of the mosaic used with max_nan_fraction. Is computed
+        from hdu if not provided. Default is None
+    tile_store : Optional[MosaicTileStore]
+        tile store of the mosaic. If provided, cutouts are read from its tiles
+        instead of the data of hdu. Default is None
+    extraction_order : Optional[str]
+        if set to "morton" or "tile", cutouts are extracted in Z-order or tile order
+        of their pixel positions for near-sequential reads. The images are still
+        written in the order of coordinates. Default is None
+    cutout_cache : Optional[CutoutCache]
+        cache of raw cutouts. Cached cutouts are not extracted from the mosaic again,
+        so only the transformations are repeated. Default is None
+    mosaic_hash : Optional[str]
+        hash of the mosaic used in the keys of cutout_cache, see load_mosaic_hash.
+        Is calculated with calculate_mosaic_hash if not provided. Default is None
+    downsample_factor : Optional[float]
+        if set, the images are downsampled by this factor before they are written, see
+        image_processing.downsample_images. The header holds the downsampled size.
+        Default is None
+    downsample_method : str
+        "mean" or "sum" of the pixels combined by downsampling. Default is "mean"
 
     Returns
     ----------
-    None
+    Union[List[bool], List[List[bool]]]
+        mask of written images, one mask per size if image_size is a list
     """
 
-    if isinstance(image_size, int):
-        image_size = RectangleSize(image_size, image_size)
+    multi_size = isinstance(image_size, list)
+    image_sizes = [
+        RectangleSize(size, size) if isinstance(size, int) else size
+        for size in (image_size if multi_size else [image_size])
+    ]
+    if not multi_size:
+        filepaths = [filepath]
+    elif isinstance(filepath, list):
+        filepaths = filepath
+    else:
+        filepaths = [create_multi_size_filepath(filepath, size) for size in image_sizes]
 
-    number_of_pixels = image_size.image_height * image_size.image_width
+    output_sizes = image_sizes
+    if downsample_factor is not None:
+        output_sizes = [
+            himg.calculate_downsampled_size(size, downsample_factor)
+            for size in image_sizes
+        ]
 
     number_of_images = len(coordinates)
-    image_was_written = []
 
-    write_pink_file_header(
-        filepath=filepath,
-        number_of_images=number_of_images,
-        image_height=image_size.image_height,
-        image_width=image_size.image_width,
-        overwrite=overwrite_header,
-    )
-    for coord in coordinates:
-        try:
-            data = hfits.create_cutout2D_as_flattened_numpy_array(
-                hdu, coord, image_size
-            )
-            if np.isnan(data).any():
-                if fill_nan:
-                    data = np.nan_to_num(data, data.mean())
-                else:
-                    raise ValueError("Objects data array contains NaNs")
+    wcs = WCS(hdu.header if tile_store is None else tile_store.header)
 
-            if denoise:
-                data = himg.denoise_cutouts_from_mean(data)
+    if cutout_cache is not None and mosaic_hash is None:
+        mosaic_hash = hfits.calculate_mosaic_hash(hdu)
 
-        except ValueError as e:
-            log.warning(e)
-            log.warning(f"Image at coordinates {coord} not added to pink file_stream")
-            image_was_written.append(False)
-            continue
+    image_is_rejected = np.full((len(image_sizes), number_of_images), False)
+    if max_nan_fraction is not None:
+        if nan_integral is None:
+            nan_integral = hfits.create_nan_integral_image(hdu.data)
+        for i, size in enumerate(image_sizes):
+            nan_fractions = hfits.calculate_cutout_nan_fractions(
+                hdu, coordinates, size, nan_integral=nan_integral, wcs=wcs
+            )
+            image_is_rejected[i] = nan_fractions > max_nan_fraction
+            log.info(
+                f"Rejected {image_is_rejected[i].sum()} of {number_of_images} objects "
+                f"of size {size} with a NaN fraction above {max_nan_fraction}"
+            )
+
+    if extraction_order is None:
+        extraction_indices = np.arange(number_of_images)
+    else:
+        extraction_indices = hfits.plan_extraction_order(
+            hfits.calculate_pixel_positions(coordinates, wcs), order=extraction_order
+        )
 
-        if min_max_scale:
-            dmax, dmin = data.max(), data.min()
-            data = (data - dmin) / (dmax - dmin)
+    for path, size in zip(filepaths, output_sizes):
+        write_pink_file_header(
+            filepath=path,
+            number_of_images=number_of_images,
+            image_height=size.image_height,
+            image_width=size.image_width,
+            overwrite=overwrite_header,
+        )
 
-        if data.size == number_of_pixels:
-            write_pink_file_v2_data(filepath, data)
-            image_was_written.append(True)
-        else:
-            log.warning(
-                f"Data was truncated. Expected {number_of_pixels}, got {data.size} floats."
+    # Images are extracted in extraction order but written in the order of
+    # coordinates. Extracted images wait in the buffer until all preceding
+    # images have been handled.
+    image_was_written = np.full((len(image_sizes), number_of_images), False)
+    image_buffer = {}
+    next_image_index = 0
+
+    for image_index in extraction_indices:
+        coord = coordinates[image_index]
+        is_rejected = image_is_rejected[:, image_index]
+
+        if is_rejected.all():
+            images = [None] * len(image_sizes)
+        elif multi_size:
+            images = extract_multi_size_pink_image_data(
+                hdu=hdu,
+                coordinates=coord,
+                image_sizes=image_sizes,
+                min_max_scale=min_max_scale,
+                denoise=denoise,
+                fill_nan=fill_nan,
+                fill_nan_with_mean=bool(max_nan_fraction),
+                tile_store=tile_store,
+                wcs=wcs,
+                cutout_cache=cutout_cache,
+                mosaic_hash=mosaic_hash,
             )
-            log.warning(f"Image at coordinates {coord} not added to pink file_stream")
-            image_was_written.append(False)
+            images = [
+                None if rejected else data
+                for data, rejected in zip(images, is_rejected)
+            ]
+        else:
+            images = [
+                extract_pink_image_data(
+                    hdu=hdu,
+                    coordinates=coord,
+                    image_size=image_sizes[0],
+                    min_max_scale=min_max_scale,
+                    denoise=denoise,
+                    fill_nan=fill_nan,
+                    fill_nan_with_mean=bool(max_nan_fraction),
+                    tile_store=tile_store,
+                    wcs=wcs,
+                    cutout_cache=cutout_cache,
+                    mosaic_hash=mosaic_hash,
+                )
+            ]
+
+        image_buffer[image_index] = images
+        while next_image_index in image_buffer:
+            images = image_buffer.pop(next_image_index)
+            for i, (path, data) in enumerate(zip(filepaths, images)):
+                if data is not None:
+                    if downsample_factor is not None:
+                        data = himg.downsample_images(
+                            data.reshape(image_sizes[i]),
+                            downsample_factor,
+                            method=downsample_method,
+                        ).flatten()
+                    write_pink_file_v2_data(path, data)
+                    image_was_written[i, next_image_index] = True
+            next_image_index += 1
+
+    for path, size, was_written in zip(filepaths, output_sizes, image_was_written):
+        number_of_images = int(was_written.sum())
+        write_pink_file_header(
+            filepath=path,
+            number_of_images=number_of_images,
+            image_height=size.image_height,
+            image_width=size.image_width,
+            overwrite=True,
+        )
 
-    number_of_images = sum(image_was_written)
-    write_pink_file_header(
-        filepath=filepath,
-        number_of_images=number_of_images,
-        image_height=image_size.image_height,
-        image_width=image_size.image_width,
-        overwrite=True,
-    )
+        log.info(f"Wrote {number_of_images} images to {path}")
 
-    log.info(f"Wrote {number_of_images} images to {filepath}")
+    if cutout_cache is not None:
+        cutout_cache.flush()
+        log.info(f"Cutout cache {cutout_cache.path}: {cutout_cache.stats()}")
 
-    return image_was_written
+    if multi_size:
+        return image_was_written.tolist()
+    return image_was_written[0].tolist()
 
 
 def write_all_objects_pink_file_v2(
@@ -485,6 +900,12 @@ def write_all_objects_pink_file_v2(
     min_max_scale: bool = True,
     save_in_different_files: bool = True,
     download: bool = False,
+    extraction_order: Optional[str] = None,
+    cutout_cache: Optional[hfits.CutoutCache] = None,
+    downsample_factor: Optional[float] = None,
+    downsample_method: str = "mean",
+    prefetch_mosaics: bool = True,
+    max_prefetch_memory: int = hfits.DEFAULT_MOSAIC_PREFETCH_MEMORY,
 ):
     """
     writes objects from a catalog in a pink file of file format version 2
@@ -506,6 +927,24 @@ def write_all_objects_pink_file_v2(
     download : bool
         Sets download parameter in load_mosaic. If True, mosaic files are downloaded if they
         dont exist. Default is False
+    extraction_order : Optional[str]
+        order in which the cutouts of each mosaic are extracted, "morton" or "tile".
+        Default is None
+    cutout_cache : Optional[CutoutCache]
+        cache of raw cutouts consulted before extracting from the mosaics. Default is None
+    downsample_factor : Optional[float]
+        if set, the images are downsampled by this factor before they are written, see
+        image_processing.downsample_images. The header holds the downsampled size.
+        Default is None
+    downsample_method : str
+        "mean" or "sum" of the pixels combined by downsampling. Default is "mean"
+
+    prefetch_mosaics : bool
+        loads the next mosaic in a background thread while the current one is
+        processed, see iterate_mosaics. Default is True
+    max_prefetch_memory : int
+        maximum size in bytes of the current and the prefetched mosaic together.
+        Default is DEFAULT_MOSAIC_PREFETCH_MEMORY
 
     Returns
     ----------
@@ -514,13 +953,25 @@ def write_all_objects_pink_file_v2(
     if isinstance(image_size, int):
         image_size = RectangleSize(image_height=image_size, image_width=image_size)
 
+    output_size = image_size
+    if downsample_factor is not None:
+        output_size = himg.calculate_downsampled_size(image_size, downsample_factor)
+
     catalog = hfits.read_shimwell_catalog(catalog_path, reduced=True)
-    list_of_mosaics = catalog.Mosaic_ID.unique().tolist()
+    mosaic_indices = hfits.calculate_catalog_group_indices(catalog, "Mosaic_ID")
     number_of_images = 0
-    for i in list_of_mosaics:
-        hdu = hfits.load_mosaic(i, mosaic_path, download=download)
-        table_with_unique_mosaic = catalog[catalog.Mosaic_ID == i]
+    for i, hdu in hfits.iterate_mosaics(
+        list(mosaic_indices),
+        mosaic_path,
+        download=download,
+        prefetch=prefetch_mosaics,
+        max_memory_bytes=max_prefetch_memory,
+    ):
+        table_with_unique_mosaic = catalog.iloc[mosaic_indices[i]]
         coord = table_with_unique_mosaic.loc[:, ["RA", "DEC"]].values.tolist()
+        mosaic_hash = None
+        if cutout_cache is not None:
+            mosaic_hash = hfits.load_mosaic_hash(mosaic_id=i, path=mosaic_path, hdu=hdu)
         if save_in_different_files:
             write_mosaic_objects_to_pink_file_v2(
                 filepath=filepath + f"{i}.bin",
@@ -528,6 +979,11 @@ def write_all_objects_pink_file_v2(
                 hdu=hdu,
                 image_size=image_size,
                 min_max_scale=min_max_scale,
+                extraction_order=extraction_order,
+                cutout_cache=cutout_cache,
+                mosaic_hash=mosaic_hash,
+                downsample_factor=downsample_factor,
+                downsample_method=downsample_method,
             )
         else:
             image_was_written = write_mosaic_objects_to_pink_file_v2(
@@ -536,41 +992,174 @@ def write_all_objects_pink_file_v2(
                 hdu=hdu,
                 image_size=image_size,
                 min_max_scale=min_max_scale,
+                extraction_order=extraction_order,
+                cutout_cache=cutout_cache,
+                mosaic_hash=mosaic_hash,
+                downsample_factor=downsample_factor,
+                downsample_method=downsample_method,
             )
             number_of_images += sum(image_was_written)
 
             write_pink_file_header(
                 filepath=filepath + "all_objects_pink.bin",
                 number_of_images=number_of_images,
-                image_height=image_size.image_height,
-                image_width=image_size.image_width,
+                image_height=output_size.image_height,
+                image_width=output_size.image_width,
                 overwrite=True,
             )
 
 
+def classify_unwritten_images(
+    hdu: PrimaryHDU,
+    coordinates: List[WCSCoordinates],
+    image_size: RectangleSize,
+    was_written: np.ndarray,
+    max_nan_fraction: Optional[float] = None,
+    nan_integral: Optional[np.ndarray] = None,
+    wcs: Optional[WCS] = None,
+) -> np.ndarray:
+    """
+    assigns a ledger status code to every image of a mosaic
+
+    Images that were not written are classified without touching the pixel data:
+    rejected by max_nan_fraction, cutout not completely inside of the mosaic, or
+    otherwise containing NaNs.
+
+    Returns
+    ----------
+    np.ndarray
+        int8 status codes, see LEDGER_STATUS_REASONS
+    """
+    was_written = np.asarray(was_written, dtype=bool)
+    status = np.full(len(was_written), LEDGER_STATUS_WRITTEN, dtype=np.int8)
+    unwritten = np.flatnonzero(~was_written)
+    if len(unwritten) == 0:
+        return status
+
+    if wcs is None:
+        wcs = WCS(hdu.header)
+    unwritten_coordinates = [coordinates[i] for i in unwritten]
+    boxes = hfits.calculate_cutout_boxes(
+        hfits.calculate_pixel_positions(unwritten_coordinates, wcs), image_size
+    )
+    inside = hfits.calculate_boxes_inside(boxes, hdu.data.shape)
+    unwritten_status = np.where(
+        inside, LEDGER_STATUS_CONTAINS_NAN, LEDGER_STATUS_OUTSIDE_MOSAIC
+    )
+
+    if max_nan_fraction is not None:
+        nan_fractions = hfits.calculate_cutout_nan_fractions(
+            hdu, unwritten_coordinates, image_size, nan_integral=nan_integral, wcs=wcs
+        )
+        unwritten_status[nan_fractions > max_nan_fraction] = LEDGER_STATUS_NAN_FRACTION
+
+    status[unwritten] = unwritten_status
+    return status
+
+
+def calculate_writer_selection_mask(
+    catalog: pd.DataFrame, selection: CatalogSelection, mosaic_path: str
+) -> np.ndarray:
+    """
+    calculates which catalog objects pass the selection before any cutout is extracted
+
+    The pixel scales for size cuts are read from the mosaic headers only, see
+    fits.read_mosaic_cdelts.
+    """
+    cdelt = hfits.DEFAULT_MOSAIC_CDELT
+    if selection.min_size is not None or selection.max_size is not None:
+        cdelt = hfits.read_mosaic_cdelts(
+            catalog["Mosaic_ID"].unique().tolist(), mosaic_path
+        )
+    is_selected = hfits.calculate_catalog_selection_mask(catalog, selection, cdelt)
+    log.info(f"Selected {is_selected.sum()} of {len(catalog)} objects")
+    return is_selected
+
+
+def create_ledger_filepath(filepath: str) -> str:
+    """
+    creates the filepath of the ledger sidecar of a pink file, e.g. objects.ledger.parquet
+    """
+    return str(Path(filepath).with_suffix(".ledger.parquet"))
+
+
+def create_write_ledger(
+    catalog: pd.DataFrame,
+    slots: np.ndarray,
+    statuses: np.ndarray,
+    seconds: np.ndarray,
+) -> pd.DataFrame:
+    """
+    creates the ledger of a catalog written to a pink file
+
+    The ledger has the index of catalog and the columns Source_Name (if catalog
+    has source names, otherwise the objects are identified by the index only),
+    Mosaic_ID, Slot (position of the image in the pink file or -1), Status (see
+    LEDGER_STATUS_REASONS), Reason and Mosaic_Seconds (time spent on the mosaic
+    of the object).
+    """
+    reasons = pd.Categorical.from_codes(
+        statuses, categories=list(LEDGER_STATUS_REASONS.values())
+    )
+    ledger = pd.DataFrame(
+        {
+            "Mosaic_ID": catalog["Mosaic_ID"].values,
+            "Slot": slots,
+            "Status": statuses,
+            "Reason": reasons,
+            "Mosaic_Seconds": seconds,
+        },
+        index=catalog.index,
+    )
+    if "Source_Name" in catalog.columns:
+        ledger.insert(0, "Source_Name", catalog["Source_Name"].values)
+    return ledger
+
+
+def read_write_ledger(filepath: str) -> pd.DataFrame:
+    """
+    reads the ledger sidecar of a pink file, see create_write_ledger
+    """
+    return pd.read_parquet(create_ledger_filepath(filepath))
+
+
 def write_catalog_objects_pink_file_v2(
-    filepath: str,
+    filepath: Union[str, List[str]],
     catalog: pd.DataFrame,
     mosaic_path: str,
-    image_size: Union[int, RectangleSize],
+    image_size: Union[int, RectangleSize, List[Union[int, RectangleSize]]],
     min_max_scale: bool = False,
     denoise: bool = True,
     download: bool = False,
     fill_nan: bool = False,
-) -> pd.DataFrame:
+    max_nan_fraction: Optional[float] = None,
+    use_tile_store: bool = False,
+    tile_size: int = hfits.DEFAULT_TILE_SIZE,
+    extraction_order: Optional[str] = None,
+    cutout_cache: Optional[hfits.CutoutCache] = None,
+    downsample_factor: Optional[float] = None,
+    downsample_method: str = "mean",
+    prefetch_mosaics: bool = True,
+    max_prefetch_memory: int = hfits.DEFAULT_MOSAIC_PREFETCH_MEMORY,
+    write_ledger: bool = True,
+    selection: Optional[CatalogSelection] = None,
+) -> Union[pd.DataFrame, List[pd.DataFrame]]:
     """
     writes objects from a catalog in a single pink file of file format version 2
 
     Parameters
     ----------
-    filepath : str
-        filepath of pink file to be written
+    filepath : Union[str, List[str]]
+        filepath of pink file to be written. If image_size is a list, either a list of
+        filepaths (one per size) or a filepath from which the filepaths are created
+        with create_multi_size_filepath
     catalog : pandas.DataFrame
         catalog with mosaics in the form of a dataframe
     mosaic_path : str
         folder containing files of mosaics
-    image_size : Union[int, RectangleSize]
-        size of image/cutout to be written
+    image_size : Union[int, RectangleSize, List[Union[int, RectangleSize]]]
+        size of image/cutout to be written. If a list of sizes is given, every object is
+        located and read once and written to one pink file per size
     min_max_scale :  bool
         scales cutouts based on minimum and maximum. Default is False.
     denoise : bool
@@ -580,55 +1169,431 @@ def write_catalog_objects_pink_file_v2(
         dont exist. Default is False
     fill_nan : bool
         fills NaN with mean. Default is False
+    max_nan_fraction : Optional[float]
+        if set, objects are pre-filtered by their fraction of NaN pixels using the
+        NaN summed-area table cached next to each mosaic. Default is None
+    use_tile_store : bool
+        reads cutouts from the tile store of each mosaic, which is created next to
+        the mosaic if it does not exist yet. Default is False
+    tile_size : int
+        size of the tiles of the tile store. Default is DEFAULT_TILE_SIZE
+    extraction_order : Optional[str]
+        order in which the cutouts of each mosaic are extracted, "morton" or "tile".
+        The images are still written in catalog order. Default is None
+    cutout_cache : Optional[CutoutCache]
+        cache of raw cutouts consulted before extracting from the mosaics, so that
+        changing the transformations does not require new cutouts. Default is None
+    downsample_factor : Optional[float]
+        if set, the images are downsampled by this factor before they are written, see
+        image_processing.downsample_images. The header holds the downsampled size.
+        Default is None
+    downsample_method : str
+        "mean" or "sum" of the pixels combined by downsampling. Default is "mean"
+
+    prefetch_mosaics : bool
+        loads the next mosaic in a background thread while the current one is
+        processed, see iterate_mosaics. Default is True
+    max_prefetch_memory : int
+        maximum size in bytes of the current and the prefetched mosaic together.
+        Default is DEFAULT_MOSAIC_PREFETCH_MEMORY
+    write_ledger : bool
+        writes the ledger of every object (slot in the pink file, status code and
+        reason of skipped objects, time) as parquet sidecar next to every pink file,
+        see create_write_ledger and create_ledger_filepath. Default is True
+    selection : Optional[CatalogSelection]
+        cuts on the catalog columns applied before any mosaic is loaded. Rejected
+        objects are recorded in the ledger. Default is None
 
     Returns
     ----------
-    None
+    Union[pd.DataFrame, List[pd.DataFrame]]
+        catalog of the written images, one catalog per size if image_size is a list
+    """
+
+    multi_size = isinstance(image_size, list)
+    image_sizes = [
+        (
+            RectangleSize(image_height=size, image_width=size)
+            if isinstance(size, int)
+            else size
+        )
+        for size in (image_size if multi_size else [image_size])
+    ]
+    if not multi_size:
+        filepaths = [filepath]
+    elif isinstance(filepath, list):
+        filepaths = filepath
+    else:
+        filepaths = [create_multi_size_filepath(filepath, size) for size in image_sizes]
+
+    output_sizes = image_sizes
+    if downsample_factor is not None:
+        output_sizes = [
+            himg.calculate_downsampled_size(size, downsample_factor)
+            for size in image_sizes
+        ]
+
+    # The ledger is accumulated in preallocated arrays in catalog row order
+    slots = np.full((len(image_sizes), catalog.shape[0]), -1, dtype=np.int64)
+    statuses = np.full(
+        (len(image_sizes), catalog.shape[0]), LEDGER_STATUS_NOT_PROCESSED, dtype=np.int8
+    )
+    seconds = np.zeros(catalog.shape[0])
+
+    mosaic_indices = hfits.calculate_catalog_group_indices(catalog, "Mosaic_ID")
+    number_of_images_to_write = catalog.shape[0]
+
+    if selection is not None:
+        is_selected = calculate_writer_selection_mask(catalog, selection, mosaic_path)
+        statuses[:, ~is_selected] = LEDGER_STATUS_DESELECTED
+        mosaic_indices = {
+            mosaic_id: indices[is_selected[indices]]
+            for mosaic_id, indices in mosaic_indices.items()
+            if is_selected[indices].any()
+        }
+        number_of_images_to_write = int(is_selected.sum())
+
+    log.info(f"Going to write {number_of_images_to_write} images")
+
+    for path, size in zip(filepaths, output_sizes):
+        write_pink_file_header(
+            filepath=path,
+            number_of_images=number_of_images_to_write,
+            image_height=size.image_height,
+            image_width=size.image_width,
+            overwrite=False,
+        )
+
+    number_of_images = np.zeros(len(image_sizes), dtype=int)
+
+    for mosaic_id, hdu in hfits.iterate_mosaics(
+        list(mosaic_indices),
+        mosaic_path,
+        download=download,
+        prefetch=prefetch_mosaics,
+        max_memory_bytes=max_prefetch_memory,
+    ):
+        t0 = time.perf_counter()
+        indices = mosaic_indices[mosaic_id]
+        if hdu is None:
+            statuses[:, indices] = LEDGER_STATUS_MISSING_MOSAIC
+            continue
+
+        coordinates = catalog.iloc[indices][["RA", "DEC"]].values.tolist()
+
+        nan_integral = None
+        if max_nan_fraction is not None:
+            nan_integral = hfits.load_nan_integral_image(
+                mosaic_id=mosaic_id, path=mosaic_path, hdu=hdu
+            )
+
+        mosaic_hash = None
+        if cutout_cache is not None:
+            mosaic_hash = hfits.load_mosaic_hash(
+                mosaic_id=mosaic_id, path=mosaic_path, hdu=hdu
+            )
+
+        tile_store = None
+        if use_tile_store:
+            tile_store = hfits.create_mosaic_tile_store(
+                mosaic_id=mosaic_id, path=mosaic_path, tile_size=tile_size, hdu=hdu
+            )
+
+        image_was_written = write_mosaic_objects_to_pink_file_v2(
+            filepath=filepaths,
+            hdu=hdu,
+            coordinates=coordinates,
+            image_size=image_sizes,
+            min_max_scale=min_max_scale,
+            denoise=denoise,
+            fill_nan=fill_nan,
+            overwrite_header=True,
+            max_nan_fraction=max_nan_fraction,
+            nan_integral=nan_integral,
+            tile_store=tile_store,
+            extraction_order=extraction_order,
+            cutout_cache=cutout_cache,
+            mosaic_hash=mosaic_hash,
+            downsample_factor=downsample_factor,
+            downsample_method=downsample_method,
+        )
+
+        for i, was_written in enumerate(image_was_written):
+            was_written = np.asarray(was_written, dtype=bool)
+            written_indices = indices[was_written]
+            slots[i, written_indices] = number_of_images[i] + np.arange(
+                len(written_indices)
+            )
+            statuses[i, indices] = classify_unwritten_images(
+                hdu,
+                coordinates,
+                image_sizes[i],
+                was_written,
+                max_nan_fraction=max_nan_fraction,
+                nan_integral=nan_integral,
+            )
+            number_of_images[i] += len(written_indices)
+        seconds[indices] = time.perf_counter() - t0
+
+    for path, size, number in zip(filepaths, output_sizes, number_of_images):
+        write_pink_file_header(
+            filepath=path,
+            number_of_images=number,
+            image_height=size.image_height,
+            image_width=size.image_width,
+            overwrite=True,
+        )
+
+        log.info(f"Wrote {number} images to {path}.")
+
+    catalogs_of_written_images = []
+    for path, slot, status in zip(filepaths, slots, statuses):
+        written_positions = np.flatnonzero(slot >= 0)
+        written_positions = written_positions[np.argsort(slot[written_positions])]
+        catalogs_of_written_images.append(catalog.iloc[written_positions])
+
+        if write_ledger:
+            ledger = create_write_ledger(catalog, slot, status, seconds)
+            ledger.to_parquet(create_ledger_filepath(path))
+            log.info(f"Ledger of {path}: {ledger['Reason'].value_counts().to_dict()}")
+
+    if multi_size:
+        return catalogs_of_written_images
+    return catalogs_of_written_images[0]
+
+
+def extract_variable_size_pink_image_data(
+    hdu: PrimaryHDU,
+    coordinates: List[WCSCoordinates],
+    cutout_sizes: np.ndarray,
+    image_size: RectangleSize,
+    min_max_scale: bool = False,
+    denoise: bool = True,
+    fill_nan: bool = False,
+    interpolation_order: int = 1,
+    wcs: Optional[WCS] = None,
+) -> List[Optional[np.ndarray]]:
+    """
+    extracts objects at their own cutout size and resamples them to image_size
+
+    Objects with the same cutout size are extracted and resampled together as one
+    stack of images, so there is no per object interpolation.
+
+    Parameters
+    ----------
+    hdu :  PrimaryHDU
+        PrimaryHDU of mosaic
+    coordinates : List[WCSCoordinates]
+        List of WCSCoordinates of objects in mosaic
+    cutout_sizes : np.ndarray
+        integer size of the square cutout of every object
+    image_size : RectangleSize
+        size of the images the cutouts are resampled to
+    min_max_scale :  bool
+        scales images based on minimum and maximum. Default is False
+    denoise : bool
+        denoises images based on their mean. Default is True
+    fill_nan : bool
+        fills NaN with the mean of the valid pixels. Default is False
+    interpolation_order : int
+        order of the spline interpolation used for resampling. Default is 1
+    wcs : Optional[WCS]
+        WCS of the mosaic. Is created from the header if not provided. Default is None
+
+    Returns
+    ----------
+    List[Optional[np.ndarray]]
+        image data for every object or None if it was not extracted
+    """
+    if not wcs:
+        wcs = WCS(hdu.header)
+
+    images: List[Optional[np.ndarray]] = [None] * len(coordinates)
+    pixel_positions = hfits.calculate_pixel_positions(coordinates, wcs)
+
+    for cutout_size in np.unique(cutout_sizes):
+        indices = np.flatnonzero(cutout_sizes == cutout_size)
+        boxes = hfits.calculate_cutout_boxes(pixel_positions[indices], int(cutout_size))
+
+        inside = hfits.calculate_boxes_inside(boxes, hdu.data.shape)
+        if not inside.all():
+            log.warning(
+                f"{(~inside).sum()} cutouts of size {cutout_size} exceed the mosaic "
+                "and are not added to pink file_stream"
+            )
+        indices = indices[inside]
+        if indices.size == 0:
+            continue
+
+        stack = hfits.create_cutout_stack(
+            hdu.data, hfits.BoxCoordinates(*(side[inside] for side in boxes))
+        ).astype("float32")
+
+        has_nan = np.isnan(stack).any(axis=(1, 2))
+        if fill_nan:
+            means = np.nanmean(stack[has_nan], axis=(1, 2))
+            stack[has_nan] = np.where(
+                np.isnan(stack[has_nan]),
+                means[:, np.newaxis, np.newaxis],
+                stack[has_nan],
+            )
+        elif has_nan.any():
+            log.warning(
+                f"{has_nan.sum()} cutouts of size {cutout_size} contain NaNs "
+                "and are not added to pink file_stream"
+            )
+            stack, indices = stack[~has_nan], indices[~has_nan]
+
+        resampled = himg.resample_images(
+            stack, image_size, order=interpolation_order
+        ).astype("float32")
+
+        for index, image in zip(indices, resampled):
+            images[index] = transform_pink_image_data(
+                image.flatten(),
+                coordinates[index],
+                image_size,
+                min_max_scale=min_max_scale,
+                denoise=denoise,
+            )
+
+    return images
+
+
+def write_catalog_objects_variable_size_pink_file_v2(
+    filepath: str,
+    catalog: pd.DataFrame,
+    mosaic_path: str,
+    image_size: Union[int, RectangleSize],
+    size_factor: float = 1.0,
+    min_cutout_size: int = 16,
+    max_cutout_size: int = 256,
+    cutout_size_step: int = 8,
+    interpolation_order: int = 1,
+    min_max_scale: bool = False,
+    denoise: bool = True,
+    download: bool = False,
+    fill_nan: bool = False,
+    prefetch_mosaics: bool = True,
+    max_prefetch_memory: int = hfits.DEFAULT_MOSAIC_PREFETCH_MEMORY,
+    selection: Optional[CatalogSelection] = None,
+) -> pd.DataFrame:
     """
+    writes objects from a catalog cut at their own size and resampled to image_size
+    in a single pink file of file format version 2
+
+    The cutout size of every object is derived from Maj and E_Maj as in
+    get_sizes_of_object_selection and converted with calculate_cutout_sizes.
 
+    Parameters
+    ----------
+    filepath : str
+        filepath of pink file to be written
+    catalog : pandas.DataFrame
+        catalog with mosaics in the form of a dataframe. Needs the columns RA, DEC,
+        Maj, E_Maj and Mosaic_ID
+    mosaic_path : str
+        folder containing files of mosaics
+    image_size : Union[int, RectangleSize]
+        size of the images written to the pink file
+    size_factor : float
+        factor applied to the object sizes. Default is 1.0
+    min_cutout_size : int
+        minimum size of a cutout in pixels. Default is 16
+    max_cutout_size : int
+        maximum size of a cutout in pixels. Default is 256
+    cutout_size_step : int
+        cutout sizes are rounded up to multiples of this step, which defines the
+        groups of cutouts that are resampled together. Default is 8
+    interpolation_order : int
+        order of the spline interpolation used for resampling. Default is 1
+    min_max_scale :  bool
+        scales images based on minimum and maximum. Default is False
+    denoise : bool
+        denoises images based on their mean. Default  is True
+    download : bool
+        Sets download parameter in load_mosaic. If True, mosaic files are downloaded if they
+        dont exist. Default is False
+    fill_nan : bool
+        fills NaN with the mean of the valid pixels. Default is False
+
+    prefetch_mosaics : bool
+        loads the next mosaic in a background thread while the current one is
+        processed, see iterate_mosaics. Default is True
+    max_prefetch_memory : int
+        maximum size in bytes of the current and the prefetched mosaic together.
+        Default is DEFAULT_MOSAIC_PREFETCH_MEMORY
+    selection : Optional[CatalogSelection]
+        cuts on the catalog columns applied before any mosaic is loaded. Default is None
+
+    Returns
+    ----------
+    pd.DataFrame
+        catalog of the written images with the additional column Cutout_Size
+    """
     if isinstance(image_size, int):
         image_size = RectangleSize(image_height=image_size, image_width=image_size)
 
-    catalog_of_written_images = pd.DataFrame()
+    if selection is not None:
+        catalog = catalog.loc[
+            calculate_writer_selection_mask(catalog, selection, mosaic_path)
+        ]
 
-    mosaic_ids = catalog["Mosaic_ID"].unique().tolist()
-    number_of_images_to_write = catalog.shape[0]
+    catalogs_of_written_images = []
+    number_of_images = 0
 
-    log.info(f"Going to write {number_of_images_to_write} images")
+    log.info(f"Going to write {catalog.shape[0]} images")
 
     write_pink_file_header(
         filepath=filepath,
-        number_of_images=number_of_images_to_write,
+        number_of_images=catalog.shape[0],
         image_height=image_size.image_height,
         image_width=image_size.image_width,
         overwrite=False,
     )
 
-    number_of_images = 0
-
-    for mosaic_id in mosaic_ids:
-        hdu = load_mosaic(mosaic_id=mosaic_id, path=mosaic_path, download=download)
+    mosaic_indices = hfits.calculate_catalog_group_indices(catalog, "Mosaic_ID")
+    for mosaic_id, hdu in hfits.iterate_mosaics(
+        list(mosaic_indices),
+        mosaic_path,
+        download=download,
+        prefetch=prefetch_mosaics,
+        max_memory_bytes=max_prefetch_memory,
+    ):
+        if hdu is None:
+            continue
 
-        catalog_mosaic_subset = catalog[catalog["Mosaic_ID"] == mosaic_id].copy()
-        coordinates = catalog_mosaic_subset[["RA", "DEC"]].values.tolist()
+        catalog_mosaic_subset = catalog.iloc[mosaic_indices[mosaic_id]].copy()
+        sizes = hfits.calculate_object_sizes_in_pixels(
+            catalog_mosaic_subset, hdu.header["CDELT1"]
+        )
+        catalog_mosaic_subset["Cutout_Size"] = hfits.calculate_cutout_sizes(
+            sizes,
+            size_factor=size_factor,
+            min_size=min_cutout_size,
+            max_size=max_cutout_size,
+            size_step=cutout_size_step,
+        )
 
-        image_was_written = write_mosaic_objects_to_pink_file_v2(
-            filepath=filepath,
+        images = extract_variable_size_pink_image_data(
             hdu=hdu,
-            coordinates=coordinates,
+            coordinates=catalog_mosaic_subset[["RA", "DEC"]].values.tolist(),
+            cutout_sizes=catalog_mosaic_subset["Cutout_Size"].values,
             image_size=image_size,
             min_max_scale=min_max_scale,
             denoise=denoise,
             fill_nan=fill_nan,
-            overwrite_header=True,
+            interpolation_order=interpolation_order,
         )
 
-        catalog_mosaic_subset_written = catalog_mosaic_subset[image_was_written]
-        catalog_of_written_images = catalog_of_written_images.append(
-            catalog_mosaic_subset_written
-        )
+        image_was_written = np.full(len(images), False)
+        for i, data in enumerate(images):
+            if data is not None:
+                write_pink_file_v2_data(filepath, data)
+                image_was_written[i] = True
 
-        number_of_images += sum(image_was_written)
+        catalogs_of_written_images.append(catalog_mosaic_subset[image_was_written])
+        number_of_images += image_was_written.sum()
 
     write_pink_file_header(
         filepath=filepath,
@@ -639,7 +1604,10 @@ def write_catalog_objects_pink_file_v2(
     )
 
     log.info(f"Wrote {number_of_images} images to {filepath}.")
-    return catalog_of_written_images
+
+    if not catalogs_of_written_images:
+        return catalog.iloc[:0].assign(Cutout_Size=pd.Series(dtype=int))
+    return pd.concat(catalogs_of_written_images)
 
 
 def write_crossmatch_catalog_to_pink_file(
@@ -900,19 +1868,202 @@ def write_multichannel_pink_file_from_catalog(
 
 
 def write_pink_subset_file(
-    filepath_output_pink: str, filepath_input_pink: str, image_indices: List[int]
+    filepath_output_pink: str,
+    filepath_input_pink: str,
+    image_indices: List[int],
+    downsample_factor: Optional[float] = None,
+    downsample_method: str = "mean",
+    batch_size: int = 1024,
 ):
     header = read_pink_file_header(filepath_input_pink)
     width, height, _ = header.layout
 
-    write_pink_file_header(
+    if downsample_factor is None:
+        write_pink_file_header(
+            filepath=filepath_output_pink,
+            number_of_images=len(image_indices),
+            image_height=height,
+            image_width=width,
+            overwrite=False,
+        )
+
+        for idx in image_indices:
+            image = read_pink_file_image(filepath_input_pink, idx)
+            write_pink_file_v2_data(filepath_output_pink, image.flatten())
+        return
+
+    output_height, output_width = himg.calculate_downsampled_size(
+        RectangleSize(height, width), downsample_factor
+    )
+    write_pink_file_header_for_layout(
         filepath=filepath_output_pink,
         number_of_images=len(image_indices),
-        image_height=height,
-        image_width=width,
-        overwrite=False,
+        image_layout=header.layout._replace(height=output_height, width=output_width),
+    )
+
+    # Images are downsampled in batches to vectorize over the image stack
+    for start in range(0, len(image_indices), batch_size):
+        batch_indices = image_indices[slice(start, start + batch_size)]
+        images = np.stack(
+            read_pink_file_multiple_images(filepath_input_pink, batch_indices)
+        ).astype("float32")
+        images = himg.downsample_images(
+            images, downsample_factor, method=downsample_method
+        )
+        write_pink_file_v2_data(filepath_output_pink, images.flatten())
+
+
+def write_downsampled_pink_file(
+    filepath_output_pink: str,
+    filepath_input_pink: str,
+    downsample_factor: float,
+    downsample_method: str = "mean",
+    batch_size: int = 1024,
+):
+    """
+    writes all images of a pink file downsampled by downsample_factor to a new pink file
+
+    Parameters
+    ----------
+    filepath_output_pink : str
+        filepath of pink file to be written
+    filepath_input_pink : str
+        filepath of pink file to be downsampled
+    downsample_factor : float
+        factor by which height and width are reduced, see
+        image_processing.downsample_images
+    downsample_method : str
+        "mean" or "sum" of the pixels combined by downsampling. Default is "mean"
+    batch_size : int
+        number of images that are read and downsampled at once. Default is 1024
+
+    Returns
+    ----------
+    None
+    """
+    header = read_pink_file_header(filepath_input_pink)
+    write_pink_subset_file(
+        filepath_output_pink,
+        filepath_input_pink,
+        list(range(header.number_of_images)),
+        downsample_factor=downsample_factor,
+        downsample_method=downsample_method,
+        batch_size=batch_size,
+    )
+
+
+def create_orientation_sidecar_filepath(filepath: str) -> str:
+    """
+    creates the filepath of the orientation sidecar of a pink file, e.g. objects.orientations.parquet
+    """
+    return str(Path(filepath).with_suffix(".orientations.parquet"))
+
+
+def write_orientation_normalized_pink_file(
+    filepath_output_pink: str,
+    filepath_input_pink: str,
+    flip: bool = False,
+    channel: int = 0,
+    order: int = 1,
+    batch_size: int = 1024,
+) -> ImageOrientations:
+    """
+    writes all images of a pink file rotated to their principal axis to a new pink file
+
+    The applied angles and flips are stored in a parquet sidecar next to the output
+    file (see create_orientation_sidecar_filepath), so the orientation can be undone
+    with image_processing.restore_image_orientations. Aligned images allow training
+    PINK with fewer rotations.
+
+    Parameters
+    ----------
+    filepath_output_pink : str
+        filepath of pink file to be written
+    filepath_input_pink : str
+        filepath of pink file with the images to be aligned
+    flip : bool
+        mirrors the aligned images so that most of their flux lies towards positive
+        x and y. Default is False
+    channel : int
+        channel whose orientation is used for all channels of multichannel images.
+        Default is 0
+    order : int
+        order of the spline interpolation used for rotating. Default is 1
+    batch_size : int
+        number of images that are read and rotated at once. Default is 1024
+
+    Returns
+    ----------
+    ImageOrientations
+        angles and flips applied to the images
+    """
+    header = read_pink_file_header(filepath_input_pink)
+    layout = header.layout
+    number_of_images = header.number_of_images
+
+    write_pink_file_header_for_layout(
+        filepath=filepath_output_pink,
+        number_of_images=number_of_images,
+        image_layout=layout,
     )
 
-    for idx in image_indices:
-        image = read_pink_file_image(filepath_input_pink, idx)
-        write_pink_file_v2_data(filepath_output_pink, image.flatten())
+    orientations = ImageOrientations(
+        angle=np.zeros(number_of_images),
+        flip_x=np.full(number_of_images, False),
+        flip_y=np.full(number_of_images, False),
+    )
+
+    for start in range(0, number_of_images, batch_size):
+        batch_indices = list(range(start, min(start + batch_size, number_of_images)))
+        images = np.stack(
+            read_pink_file_multiple_images(filepath_input_pink, batch_indices)
+        ).astype("float32")
+        images = images.reshape(len(batch_indices), layout.depth, *images.shape[-2:])
+
+        angles = himg.calculate_principal_axis_angles(images[:, channel])
+        images = himg.rotate_images(
+            images.reshape(-1, *images.shape[-2:]),
+            np.repeat(-angles, layout.depth),
+            order=order,
+        ).reshape(images.shape)
+        if flip:
+            flip_x, flip_y = himg.calculate_orientation_flips(images[:, channel])
+        else:
+            flip_x = np.full(len(batch_indices), False)
+            flip_y = np.full(len(batch_indices), False)
+        batch_orientations = ImageOrientations(angles, flip_x, flip_y)
+
+        images = images.reshape(-1, *images.shape[-2:])
+        images = himg.flip_images(
+            images,
+            np.repeat(batch_orientations.flip_x, layout.depth),
+            np.repeat(batch_orientations.flip_y, layout.depth),
+        )
+
+        write_pink_file_v2_data(filepath_output_pink, images.flatten())
+
+        batch = slice(batch_indices[0], batch_indices[-1] + 1)
+        for values, batch_values in zip(orientations, batch_orientations):
+            values[batch] = batch_values
+
+    pd.DataFrame(
+        {
+            "Angle": orientations.angle,
+            "Flip_X": orientations.flip_x,
+            "Flip_Y": orientations.flip_y,
+        }
+    ).to_parquet(create_orientation_sidecar_filepath(filepath_output_pink))
+
+    return orientations
+
+
+def read_orientation_sidecar(filepath: str) -> ImageOrientations:
+    """
+    reads the orientations written by write_orientation_normalized_pink_file for a pink file
+    """
+    orientations = pd.read_parquet(create_orientation_sidecar_filepath(filepath))
+    return ImageOrientations(
+        angle=orientations["Angle"].values,
+        flip_x=orientations["Flip_X"].values,
+        flip_y=orientations["Flip_Y"].values,
+    )
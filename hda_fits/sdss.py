@@ -17,7 +17,7 @@ from reproject import reproject_interp
 from hda_fits import fits as hfits
 
 from .logging_config import logging
-from .types import RectangleSize, SDSSFields, WCSCoordinates
+from .types import RectangleSize, SDSSFields, SpatialIndex, WCSCoordinates
 
 log = logging.getLogger(__name__)
 log.setLevel(logging.DEBUG)
@@ -27,6 +27,8 @@ CROSSMATCH_CATALOG_FILENAME = "shimwell_sdss_crossmatch_catalog.parquet"
 SDSS_FIELD_COLUMNS = ["run", "cam_col", "field"]
 MOSAIC_CDELT1 = -0.00041666666666666
 MOSAIC_CDELT2 = 0.000416666666666666
+CROSSMATCH_MATCH_COLUMNS = ["Match_Index", "Match_Separation", "Match_Count"]
+DEFAULT_CROSSMATCH_RADIUS = 5.0
 
 
 def query_sdss_fields(
@@ -277,6 +279,98 @@ def create_empty_crossmatch_catalog(
     shimwell_catalog.to_parquet(filepath_crossmatch_catalog)
 
 
+def crossmatch_catalogs(
+    catalog: pd.DataFrame,
+    optical_catalog: pd.DataFrame,
+    radius: float = DEFAULT_CROSSMATCH_RADIUS,
+    ra_column: str = "ra",
+    dec_column: str = "dec",
+    optical_index: SpatialIndex = None,
+) -> pd.DataFrame:
+    """Matches every object of the catalog to its nearest optical counterpart
+
+    The optical catalog is any local table with RA and DEC in degrees.
+    Adds the columns Match_Index (row position in optical_catalog),
+    Match_Separation (arcsec) and Match_Count (number of optical sources
+    within radius arcsec, values larger than 1 flag ambiguous matches).
+    Objects without a counterpart within radius get <NA>, NaN and 0.
+    If the optical catalog has the columns run, cam_col and field they
+    are copied from the nearest match.
+    """
+    if optical_index is None:
+        optical_index = hfits.create_spatial_index(
+            optical_catalog[[ra_column, dec_column]].values
+        )
+
+    coordinates = catalog[["RA", "DEC"]].values
+    separations, indices = hfits.query_nearest_neighbours(
+        optical_index, coordinates, k=1, max_radius=radius
+    )
+    separations, indices = separations[:, 0], indices[:, 0]
+    matched = np.isfinite(separations)
+
+    crossmatch_catalog = catalog.copy()
+    match_index = pd.array(indices, dtype="Int64")
+    match_index[~matched] = pd.NA
+    crossmatch_catalog["Match_Index"] = match_index
+    crossmatch_catalog["Match_Separation"] = np.where(matched, separations, np.nan)
+    crossmatch_catalog["Match_Count"] = hfits.count_cone(
+        optical_index, coordinates, radius
+    )
+
+    for column in SDSS_FIELD_COLUMNS:
+        values = pd.array([None] * len(catalog), dtype="Int64")
+        if column in optical_catalog.columns:
+            values[matched] = optical_catalog[column].values[indices[matched]]
+        crossmatch_catalog[column] = values
+
+    log.info(
+        f"Matched {matched.sum()} of {len(catalog)} objects within {radius} arcsec, "
+        f"{(crossmatch_catalog['Match_Count'] > 1).sum()} with multiple counterparts"
+    )
+    return crossmatch_catalog
+
+
+def create_crossmatch_catalog(
+    path: str,
+    path_shimwell: str,
+    optical_catalog: pd.DataFrame,
+    radius: float = DEFAULT_CROSSMATCH_RADIUS,
+    ra_column: str = "ra",
+    dec_column: str = "dec",
+    overwrite: bool = False,
+) -> pd.DataFrame:
+    """Crossmatches the shimwell catalog offline and writes the crossmatch catalog
+
+    Writes the columns of `create_empty_crossmatch_catalog` followed by
+    the match columns CROSSMATCH_MATCH_COLUMNS of `crossmatch_catalogs`.
+    The SDSS fields of objects without a counterpart stay empty, so they
+    can still be filled by `fill_sdss_shimwell_crossmatch_catalog`.
+    """
+    filepath_crossmatch_catalog = Path(path) / CROSSMATCH_CATALOG_FILENAME
+    if filepath_crossmatch_catalog.exists() and not overwrite:
+        log.error("Crossmatch crossmatch_catalog already exists. Returning..")
+        return
+
+    shimwell_catalog = hfits.read_shimwell_catalog(path_shimwell, reduced=True)
+    crossmatch_catalog = crossmatch_catalogs(
+        shimwell_catalog,
+        optical_catalog,
+        radius=radius,
+        ra_column=ra_column,
+        dec_column=dec_column,
+    )
+    crossmatch_catalog = crossmatch_catalog[
+        shimwell_catalog.columns.tolist()
+        + SDSS_FIELD_COLUMNS
+        + CROSSMATCH_MATCH_COLUMNS
+    ]
+
+    log.info(f"Writing crossmatch catalog to {filepath_crossmatch_catalog}")
+    crossmatch_catalog.to_parquet(filepath_crossmatch_catalog)
+    return crossmatch_catalog
+
+
 def load_crossmatch_catalog(path: str):
     filepath_crossmatch_catalog = Path(path) / CROSSMATCH_CATALOG_FILENAME
     return pd.read_parquet(filepath_crossmatch_catalog)
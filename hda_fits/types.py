@@ -1,4 +1,8 @@
-from typing import Literal, NamedTuple
+from typing import List, Literal, NamedTuple, Optional, Tuple
+
+import numpy as np
+from astropy.io.fits import Header
+from scipy.spatial import cKDTree
 
 
 class WCSCoordinates(NamedTuple):
@@ -74,6 +78,169 @@ class BoxCoordinates(NamedTuple):
     left: int
 
 
+class IntegralImages(NamedTuple):
+    """
+    A class to represent the summed-area tables of a mosaic. Inherits from NamedTuple.
+
+    Attributes
+    ----------
+    nan : np.ndarray
+        summed-area table of the NaN pixels
+    sum : np.ndarray
+        summed-area table of the pixel values, NaNs counted as zero
+    sum_of_squares : np.ndarray
+        summed-area table of the squared pixel values, NaNs counted as zero
+    """
+
+    nan: np.ndarray
+    sum: np.ndarray
+    sum_of_squares: np.ndarray
+
+
+class MosaicTileStore(NamedTuple):
+    """
+    A class to represent a mosaic re-tiled into square tiles. Inherits from NamedTuple.
+
+    Attributes
+    ----------
+    tiles : np.ndarray
+        (memory-mapped) array of shape (rows, columns, tile_size, tile_size)
+    header : Header
+        FITS header of the mosaic containing its WCS
+    tile_size : int
+        height and width of a single tile in pixels
+    shape : Tuple[int, int]
+        height and width of the original mosaic in pixels
+    """
+
+    tiles: np.ndarray
+    header: Header
+    tile_size: int
+    shape: Tuple[int, int]
+
+
+class CutoutCacheStats(NamedTuple):
+    """
+    A class to represent the usage statistics of a cutout cache. Inherits from NamedTuple.
+
+    Attributes
+    ----------
+    hits : int
+        number of cutouts read from the cache
+    misses : int
+        number of cutouts not found in the cache
+    evictions : int
+        number of cutouts removed to keep the cache below its maximum size
+    entries : int
+        number of cutouts in the cache
+    size_bytes : int
+        size of the chunk files of the cache in bytes
+    """
+
+    hits: int
+    misses: int
+    evictions: int
+    entries: int
+    size_bytes: int
+
+
+class ImageOrientations(NamedTuple):
+    """
+    A class to represent the orientation normalization applied to a stack of images.
+    Inherits from NamedTuple.
+
+    Attributes
+    ----------
+    angle : np.ndarray
+        angle in degrees of the principal axis of every image, the images were rotated by -angle
+    flip_x : np.ndarray
+        boolean mask of the images mirrored along the x axis after the rotation
+    flip_y : np.ndarray
+        boolean mask of the images mirrored along the y axis after the rotation
+    """
+
+    angle: np.ndarray
+    flip_x: np.ndarray
+    flip_y: np.ndarray
+
+
+class SpatialIndex(NamedTuple):
+    """
+    A class to represent a KD-tree over the unit vectors of sky coordinates.
+    Inherits from NamedTuple.
+
+    Attributes
+    ----------
+    tree : cKDTree
+        KD-tree over the unit vectors of shape (N, 3), distances are chord lengths
+    coordinates : np.ndarray
+        RA and DEC in degrees of shape (N, 2) in the order of the indexed catalog
+    """
+
+    tree: cKDTree
+    coordinates: np.ndarray
+
+
+class CatalogSelection(NamedTuple):
+    """
+    A class to represent cuts on the columns of the shimwell catalog. Inherits from NamedTuple.
+    Cuts set to None are not applied.
+
+    Attributes
+    ----------
+    min_peak_flux : Optional[float]
+        minimum Peak_flux in mJy/beam
+    min_total_flux : Optional[float]
+        minimum Total_flux in mJy
+    max_isl_rms : Optional[float]
+        maximum Isl_rms in mJy/beam
+    min_snr : Optional[float]
+        minimum signal to noise ratio Peak_flux / Isl_rms
+    min_size : Optional[float]
+        minimum size Maj + E_Maj in pixels of the mosaic
+    max_size : Optional[float]
+        maximum size Maj + E_Maj in pixels of the mosaic
+    s_codes : Optional[List[str]]
+        accepted source types S_Code, e.g. ["S", "M"]
+    """
+
+    min_peak_flux: Optional[float] = None
+    min_total_flux: Optional[float] = None
+    max_isl_rms: Optional[float] = None
+    min_snr: Optional[float] = None
+    min_size: Optional[float] = None
+    max_size: Optional[float] = None
+    s_codes: Optional[List[str]] = None
+
+
+class DownloadResult(NamedTuple):
+    """
+    A class to represent the outcome of a file download. Inherits from NamedTuple.
+
+    Attributes
+    ----------
+    url : str
+        url the file was downloaded from
+    filepath : str
+        local filepath of the file
+    status : str
+        "downloaded", "skipped" if the file existed already, or "failed"
+    size : int
+        size of the file in bytes, -1 if the download failed
+    sha256 : str
+        hex digest of the SHA-256 checksum of the file, empty if the download failed
+    error : str
+        error message if the download failed, empty otherwise
+    """
+
+    url: str
+    filepath: str
+    status: str
+    size: int
+    sha256: str
+    error: str
+
+
 class PinkHeader(NamedTuple):
     """
     A class to represent header information in pink file. Inherits from NamedTuple.
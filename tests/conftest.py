@@ -1,3 +1,6 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
 
 import numpy as np
@@ -111,7 +114,9 @@ def shimwell_catalog_df(catalog_filepath, shimwell_catalog):
 
 @pytest.fixture(scope="module")
 def missing_filter_df(test_data_dir):
-    missing_filter_path = test_data_dir / "panstarrs" / "objects_with_missing_gri_filters.parquet"
+    missing_filter_path = (
+        test_data_dir / "panstarrs" / "objects_with_missing_gri_filters.parquet"
+    )
     missing_filter_catalog = pd.read_parquet(missing_filter_path)
     assert missing_filter_catalog is not None
     return missing_filter_catalog
@@ -289,3 +294,101 @@ def catalog_p205_p218_95px(sources_p205_p218, shimwell_catalog_df):
     ]
     assert catalog_subset.shape[0] == 10
     return catalog_subset
+
+
+class StandInRequestHandler(BaseHTTPRequestHandler):
+    """Serves the files of the server with Range support, latency and injected errors"""
+
+    def do_GET(self):
+        server = self.server
+        path = self.path.split("?")[0]
+        with server.lock:
+            server.requests.append((self.path, dict(self.headers)))
+            injected_statuses = server.injected_statuses.get(path, [])
+            status = injected_statuses.pop(0) if injected_statuses else None
+        time.sleep(server.latency)
+
+        if status is not None:
+            self.send_response(status)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        content = server.files.get(path)
+        if content is None:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        start = 0
+        range_header = self.headers.get("Range")
+        if range_header and server.support_range:
+            start = int(range_header.split("=")[1].split("-")[0])
+            if start >= len(content):
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{len(content)}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header(
+                "Content-Range", f"bytes {start}-{len(content) - 1}/{len(content)}"
+            )
+        else:
+            self.send_response(200)
+
+        self.send_header("Content-Length", str(len(content) - start))
+        self.end_headers()
+        self.wfile.write(content[start:])
+
+    def do_POST(self):
+        server = self.server
+        path = self.path.split("?")[0]
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        with server.lock:
+            server.requests.append((self.path, dict(self.headers)))
+            injected_statuses = server.injected_statuses.get(path, [])
+            status = injected_statuses.pop(0) if injected_statuses else None
+        time.sleep(server.latency)
+
+        if status is not None:
+            self.send_response(status)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        handler = server.post_handlers.get(path)
+        if handler is None:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        content = handler(body)
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def http_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInRequestHandler)
+    server.lock = threading.Lock()
+    server.files = {}
+    server.post_handlers = {}
+    server.requests = []
+    server.injected_statuses = {}
+    server.latency = 0.0
+    server.support_range = True
+    server.url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
@@ -1,4 +1,14 @@
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import pytest
+from astropy.io import fits as astropy_fits
+from astropy.wcs import WCS
+
 from hda_fits import fits
+from hda_fits.fits import WCSCoordinates
 from hda_fits.logging_config import logging
 
 log = logging.getLogger(__name__)
@@ -10,6 +20,62 @@ def test_read_shimwell_catalog(catalog_filepath):
     assert catalog is not None
 
 
+def test_read_shimwell_catalog_from_parquet_cache(
+    tmp_path, catalog_filepath, shimwell_catalog_df
+):
+    filepath = tmp_path / catalog_filepath.name
+    shutil.copy(catalog_filepath, filepath)
+    columns = ["Source_Name", "RA", "DEC", "Mosaic_ID"]
+    filters = [("Mosaic_ID", "in", ["P205+55"]), ("S_Code", "==", "S")]
+
+    catalog = fits.read_shimwell_catalog(
+        filepath, columns=columns, filters=filters, cache=True
+    )
+    assert fits.create_catalog_cache_filepath(filepath).exists()
+
+    expected = shimwell_catalog_df[
+        (shimwell_catalog_df.Mosaic_ID == "P205+55")
+        & (shimwell_catalog_df.S_Code == "S")
+    ]
+    assert list(catalog.columns) == columns
+    assert catalog.Source_Name.tolist() == expected.Source_Name.tolist()
+    np.testing.assert_array_equal(catalog.RA.values, expected.RA.values)
+
+    uncached = fits.read_shimwell_catalog(filepath, columns=columns, filters=filters)
+    assert uncached.Source_Name.tolist() == catalog.Source_Name.tolist()
+
+    reduced = fits.read_shimwell_catalog(filepath, reduced=True, cache=True)
+    assert list(reduced.columns) == fits.SHIMWELL_REDUCED_COLUMNS
+    assert len(reduced) == len(shimwell_catalog_df)
+
+
+def test_compact_catalog(shimwell_catalog_df, mosaic_ids):
+    catalog = fits.compact_catalog(shimwell_catalog_df)
+
+    assert catalog.Mosaic_ID.dtype == "category"
+    assert catalog.S_Code.dtype == "category"
+    assert catalog.Maj.dtype == np.float32
+    assert catalog.RA.dtype == np.float64
+    assert catalog.Source_Name.tolist() == shimwell_catalog_df.Source_Name.tolist()
+    assert (
+        catalog.memory_usage(deep=True).sum()
+        < shimwell_catalog_df.memory_usage(deep=True).sum()
+    )
+
+    selection = fits.select_catalog_categories(catalog, "S_Code", ["M", "C"])
+    expected = shimwell_catalog_df[shimwell_catalog_df.S_Code.isin(["M", "C"])]
+    assert selection.index.equals(expected.index)
+
+    for frame in [catalog, shimwell_catalog_df]:
+        indices = fits.calculate_catalog_group_indices(frame, "Mosaic_ID")
+        assert list(indices) == shimwell_catalog_df.Mosaic_ID.unique().tolist()
+        for mosaic_id in mosaic_ids:
+            expected_indices = np.flatnonzero(
+                shimwell_catalog_df.Mosaic_ID.values == mosaic_id
+            )
+            np.testing.assert_array_equal(indices[mosaic_id], expected_indices)
+
+
 def test_load_mosaic(mosaic_id, test_mosaic_dir):
     catalog = fits.load_mosaic(mosaic_id=mosaic_id, path=test_mosaic_dir)
     assert catalog is not None
@@ -84,3 +150,459 @@ def test_rectangular_cutout_creation(
     )
 
     assert cutout.data.shape == size
+
+
+def test_cutout_nan_fractions_match_extracted_cutouts(
+    mosaic_hdu_and_wcs_with_nan,
+    example_object_world_coordinates,
+    example_object_world_coordinates_outside,
+):
+    hdu, wcs = mosaic_hdu_and_wcs_with_nan
+    size = 20
+    ra, dec = example_object_world_coordinates
+    coordinates = [
+        example_object_world_coordinates,
+        WCSCoordinates(ra, dec - 0.05),
+        example_object_world_coordinates_outside,
+    ]
+
+    nan_fractions = fits.calculate_cutout_nan_fractions(hdu, coordinates, size, wcs=wcs)
+
+    cutout = fits.create_cutout2D(hdu, coordinates[0], size, wcs)
+    assert np.isclose(nan_fractions[0], np.isnan(cutout.data).sum() / size**2)
+    assert nan_fractions[0] > 0
+    assert nan_fractions[1] == 0
+    assert nan_fractions[2] == 1
+
+
+def test_nan_integral_image_is_cached_next_to_mosaic(
+    tmp_path, mosaic_id, mosaic_hdu_and_wcs_with_nan
+):
+    hdu, _ = mosaic_hdu_and_wcs_with_nan
+    nan_integral = fits.load_nan_integral_image(mosaic_id, tmp_path, hdu=hdu)
+
+    assert (tmp_path / f"{mosaic_id}-mosaic.nan-integral.npy").exists()
+    assert nan_integral.shape == (hdu.data.shape[0] + 1, hdu.data.shape[1] + 1)
+    assert nan_integral[-1, -1] == np.isnan(hdu.data).sum()
+    assert (fits.load_nan_integral_image(mosaic_id, tmp_path) == nan_integral).all()
+
+
+def test_mosaic_hash_is_cached_until_mosaic_changes(
+    tmp_path, mosaic_id, test_mosaic_dir
+):
+    mosaic_filepath = fits.create_mosaic_filepath(mosaic_id, tmp_path)
+    shutil.copy(
+        fits.create_mosaic_filepath(mosaic_id, test_mosaic_dir), mosaic_filepath
+    )
+
+    mosaic_hash = fits.load_mosaic_hash(mosaic_id, tmp_path)
+    assert mosaic_hash == fits.calculate_mosaic_hash(
+        fits.load_mosaic(mosaic_id, tmp_path)
+    )
+    hash_filepath = fits.create_mosaic_hash_filepath(mosaic_id, tmp_path)
+    assert os.path.exists(hash_filepath)
+    with open(hash_filepath) as f:
+        identity = f.read().rpartition(" ")[0]
+
+    # the sidecar is trusted as long as the size and mtime of the mosaic match
+    with open(hash_filepath, "w") as f:
+        f.write(f"{identity} cached")
+    assert fits.load_mosaic_hash(mosaic_id, tmp_path) == "cached"
+
+    with open(hash_filepath, "w") as f:
+        f.write("0 0 stale")
+    assert fits.load_mosaic_hash(mosaic_id, tmp_path) == mosaic_hash
+
+
+def test_cutout_statistics_match_extracted_cutouts(
+    mosaic_hdu_and_wcs, example_object_world_coordinates
+):
+    hdu, wcs = mosaic_hdu_and_wcs
+    size = fits.RectangleSize(image_height=30, image_width=20)
+    ra, dec = example_object_world_coordinates
+    coordinates = [example_object_world_coordinates, WCSCoordinates(ra, dec - 0.05)]
+
+    statistics = fits.calculate_cutout_statistics(hdu, coordinates, size, wcs=wcs)
+
+    for coordinate, (_, row) in zip(coordinates, statistics.iterrows()):
+        cutout = fits.create_cutout2D(hdu, coordinate, size, wcs).data
+        assert np.isclose(row.cutout_mean, cutout.mean())
+        assert np.isclose(row.cutout_std, cutout.std())
+        assert np.isclose(row.cutout_snr, cutout.mean() / cutout.std())
+        assert row.cutout_nan_fraction == 0
+
+
+def test_catalog_cutout_statistics(
+    tmp_path, mosaic_filepath, mosaic_id, catalog_p205_p218_95px
+):
+    shutil.copy(mosaic_filepath, tmp_path)
+
+    statistics = fits.calculate_catalog_cutout_statistics(
+        catalog_p205_p218_95px, tmp_path, 95
+    )
+
+    assert (statistics.index == catalog_p205_p218_95px.index).all()
+    is_p205 = (catalog_p205_p218_95px.Mosaic_ID == mosaic_id).values
+    assert statistics[is_p205].notna().all().all()
+    assert statistics[~is_p205].isna().all().all()
+    assert (tmp_path / f"{mosaic_id}-mosaic.sum-of-squares-integral.npy").exists()
+
+
+def test_tile_store_cutouts_match_cutout2D(tmp_path, mosaic_id, mosaic_hdu_and_wcs):
+    hdu, wcs = mosaic_hdu_and_wcs
+    tile_store = fits.create_mosaic_tile_store(
+        mosaic_id, tmp_path, tile_size=64, hdu=hdu
+    )
+
+    assert tile_store.tiles.shape == (7, 7, 64, 64)
+    assert fits.load_mosaic_tile_store(mosaic_id, tmp_path, 64).shape == (400, 400)
+
+    pixel_positions = [(10.3, 5.7), (63.5, 64.5), (200.0, 130.2), (395.1, 399.6)]
+    for size in [20, fits.RectangleSize(image_height=95, image_width=70)]:
+        for position in pixel_positions:
+            coordinates = wcs.wcs_pix2world([position], 0)[0]
+            cutout = fits.create_cutout2D(hdu, coordinates, size, wcs)
+            data = fits.create_cutout2D_from_tile_store(
+                tile_store, coordinates, size, wcs
+            )
+            assert np.array_equal(data, cutout.data.astype("float32"))
+
+
+def test_sin_pixel_positions_match_wcslib(mosaic_hdu_and_wcs):
+    hdu, wcs = mosaic_hdu_and_wcs
+    assert fits.is_plain_sin_projection(wcs)
+
+    pixels = np.random.default_rng(0).uniform(-500, 900, (10000, 2))
+    coordinates = wcs.wcs_pix2world(pixels, 0)
+    coordinates[0] = np.nan
+    coordinates[1] = wcs.wcs.crval + [180, 0]
+    coordinates[1, 1] *= -1
+
+    pixel_positions = fits.calculate_pixel_positions(coordinates, wcs)
+    expected = wcs.wcs_world2pix(coordinates, 0)
+
+    assert np.isnan(pixel_positions[:2]).all()
+    assert np.isnan(expected[:2]).all()
+    assert np.allclose(pixel_positions[2:], expected[2:], atol=1e-8, rtol=0)
+
+    # positions on rounding boundaries are identical to wcslib
+    boundary_coordinates = wcs.wcs_pix2world([(63.5, 64.5), (200.0, 130.2)], 0)
+    assert np.array_equal(
+        fits.calculate_pixel_positions(boundary_coordinates, wcs),
+        wcs.wcs_world2pix(boundary_coordinates, 0),
+    )
+
+    header = hdu.header.copy()
+    header["CTYPE1"], header["CTYPE2"] = "RA---TAN", "DEC--TAN"
+    assert not fits.is_plain_sin_projection(WCS(header))
+
+
+def test_plan_extraction_order():
+    pixel_positions = np.array([[3, 3], [0, 0], [1, 0], [0, 1], [2, 2], [np.nan, 0]])
+
+    morton_order = fits.plan_extraction_order(pixel_positions, order="morton")
+    assert morton_order.tolist() == [1, 2, 3, 4, 0, 5]
+
+    tile_order = fits.plan_extraction_order(pixel_positions, "tile", tile_size=2)
+    assert tile_order.tolist() == [1, 2, 3, 4, 0, 5]
+
+    with pytest.raises(ValueError):
+        fits.plan_extraction_order(pixel_positions, order="random")
+
+
+def test_calculate_cutout_sizes():
+    sizes = np.array([3.2, 17.0, 24.0, 25.5, 1000.0])
+
+    cutout_sizes = fits.calculate_cutout_sizes(
+        sizes, size_factor=1.0, min_size=16, max_size=256, size_step=8
+    )
+
+    assert cutout_sizes.tolist() == [16, 24, 24, 32, 256]
+    assert cutout_sizes.dtype.kind == "i"
+
+
+def test_cutout_cache_roundtrip_and_persistence(tmp_path):
+    key = fits.create_cutout_cache_key("abc", WCSCoordinates(205.1, 55.2), 20)
+    assert key == fits.create_cutout_cache_key("abc", (205.1, 55.2), (20, 20))
+    assert key != fits.create_cutout_cache_key("abc", (205.1, 55.2), 21)
+
+    data = np.arange(400, dtype=np.float64).reshape(20, 20)
+    cache = fits.CutoutCache(tmp_path / "cache")
+    assert cache.get(key) is None
+    cache.put(key, data)
+    assert np.array_equal(cache.get(key), data.flatten())
+    cache.flush()
+
+    cache = fits.CutoutCache(tmp_path / "cache")
+    cached = cache.get(key)
+    assert cached.dtype == np.float32
+    assert np.array_equal(cached, data.flatten())
+    assert cache.stats() == (1, 0, 0, 1, 1600)
+
+
+def test_cutout_cache_evicts_least_recently_used_chunks(tmp_path):
+    cache = fits.CutoutCache(
+        tmp_path / "cache", max_size_bytes=3 * 1600, chunk_size_bytes=1600
+    )
+    data = np.ones((20, 20))
+
+    for key in ["a", "b", "c"]:
+        cache.put(key, data)
+    cache.get("a")
+    cache.put("d", data)
+
+    assert "b" not in cache
+    assert all(key in cache for key in ["a", "c", "d"])
+    stats = cache.stats()
+    assert stats.evictions == 1
+    assert stats.size_bytes <= 3 * 1600
+    assert len(list((tmp_path / "cache").glob("chunk-*.bin"))) == 3
+
+
+def test_cutout_hdu_copies_header_only(
+    mosaic_hdu_and_wcs, example_object_world_coordinates
+):
+    hdu, wcs = mosaic_hdu_and_wcs
+    cutout = fits.create_cutout2D(hdu, example_object_world_coordinates, 50, wcs)
+
+    hdu_cutout = fits.create_cutout2D_as_updated_hdu(
+        hdu, example_object_world_coordinates, 50, wcs
+    )
+
+    assert np.shares_memory(hdu_cutout.data, hdu.data)
+    assert np.array_equal(hdu_cutout.data, cutout.data)
+    assert hdu_cutout.header["NAXIS1"] == hdu_cutout.header["NAXIS2"] == 50
+    assert hdu_cutout.header["CRPIX1"] == cutout.wcs.wcs.crpix[0]
+    assert hdu_cutout.header["BUNIT"] == hdu.header["BUNIT"]
+    assert hdu.header["NAXIS1"] == hdu.data.shape[1]
+
+
+@pytest.mark.parametrize("multi_extension", [False, True])
+def test_write_cutouts_to_fits_file(
+    tmp_path, mosaic_hdu_and_wcs, example_object_world_coordinates, multi_extension
+):
+    hdu, wcs = mosaic_hdu_and_wcs
+    size = 30
+    ra, dec = example_object_world_coordinates
+    coordinates = [
+        example_object_world_coordinates,
+        WCSCoordinates(ra + 0.02, dec - 0.01),
+        WCSCoordinates(*wcs.wcs_pix2world([[395.0, 200.0]], 0)[0]),
+    ]
+    filepath = tmp_path / "cutouts.fits"
+
+    inside = fits.write_cutouts_to_fits_file(
+        filepath, hdu, coordinates, size, multi_extension=multi_extension
+    )
+    assert inside.tolist() == [True, True, False]
+
+    with astropy_fits.open(filepath) as hdul:
+        if multi_extension:
+            cutouts = [hdul[i + 1].data for i in range(len(coordinates))]
+        else:
+            cutouts = hdul[0].data
+            assert cutouts.shape == (3, size, size)
+
+        for i, coord in enumerate(coordinates):
+            cutout = fits.create_cutout2D(hdu, coord, size, wcs)
+            cutout_wcs = fits.read_cutout_wcs(filepath, i)
+            if inside[i]:
+                assert np.array_equal(cutouts[i], cutout.data)
+            else:
+                assert np.isnan(cutouts[i]).any()
+            assert np.allclose(
+                cutout_wcs.wcs_world2pix([coord], 0),
+                cutout.wcs.wcs_world2pix([coord], 0),
+            )
+
+
+@pytest.mark.parametrize("max_memory_bytes", [0, fits.DEFAULT_MOSAIC_PREFETCH_MEMORY])
+def test_iterate_mosaics_with_prefetch(test_mosaic_dir, max_memory_bytes):
+    mosaic_ids = ["P205+55", "P000+00", "P218+55", "P205+55"]
+
+    mosaics = list(
+        fits.iterate_mosaics(
+            mosaic_ids, test_mosaic_dir, max_memory_bytes=max_memory_bytes
+        )
+    )
+
+    assert [mosaic_id for mosaic_id, _ in mosaics] == mosaic_ids
+    assert mosaics[1][1] is None
+    for mosaic_id, hdu in mosaics:
+        if hdu is not None:
+            expected = fits.load_mosaic(mosaic_id, test_mosaic_dir)
+            assert np.array_equal(hdu.data, expected.data, equal_nan=True)
+
+
+def test_spatial_index_queries_match_brute_force(tmp_path, shimwell_catalog_df):
+    catalog = shimwell_catalog_df.iloc[:2000]
+    coordinates = catalog[["RA", "DEC"]].values
+    radius = 120
+
+    filepath = tmp_path / "catalog.fits"
+    index = fits.load_spatial_index(filepath, catalog=catalog)
+    assert fits.create_spatial_index_filepath(filepath).exists()
+    index = fits.load_spatial_index(filepath)
+    np.testing.assert_array_equal(index.coordinates, coordinates)
+
+    vectors = fits.calculate_unit_vectors(coordinates)
+    separations = fits.convert_chord_to_arcsec(
+        np.linalg.norm(vectors[:, None, :] - vectors[None, :, :], axis=-1)
+    )
+
+    cones = fits.query_cone(index, coordinates[:50], radius)
+    for cone, separation in zip(cones, separations[:50]):
+        np.testing.assert_array_equal(cone, np.flatnonzero(separation <= radius))
+
+    nearest_separations, nearest_indices = fits.query_nearest_neighbours(
+        index, coordinates[:50], k=2
+    )
+    np.testing.assert_array_equal(nearest_indices[:, 0], np.arange(50))
+    expected = np.sort(separations[:50], axis=1)[:, 1]
+    np.testing.assert_allclose(nearest_separations[:, 1], expected, atol=1e-6)
+
+    pairs, pair_separations = fits.query_pairs_within(index, radius)
+    expected_pairs = np.argwhere(np.triu(separations <= radius, k=1))
+    np.testing.assert_array_equal(pairs, expected_pairs)
+    np.testing.assert_allclose(
+        pair_separations, separations[tuple(expected_pairs.T)], atol=1e-6
+    )
+
+
+def test_partitioned_catalog(tmp_path, shimwell_catalog_df, mosaic_ids):
+    manifest = fits.write_partitioned_catalog(
+        shimwell_catalog_df, tmp_path, band_width=0.5
+    )
+    assert manifest["Rows"].sum() == len(shimwell_catalog_df)
+    assert set(manifest["Mosaic_ID"]) == set(mosaic_ids)
+    assert len(manifest) > len(mosaic_ids)
+
+    catalog = fits.read_partitioned_catalog(tmp_path, mosaic_ids=mosaic_ids[:1])
+    expected = shimwell_catalog_df[shimwell_catalog_df.Mosaic_ID == mosaic_ids[0]]
+    assert sorted(catalog.Source_Name) == sorted(expected.Source_Name)
+
+    region = (205.0, 206.0, 54.5, 55.0)
+    catalog = fits.read_partitioned_catalog(
+        tmp_path, region=region, columns=["Source_Name"]
+    )
+    mask = fits.calculate_region_mask(
+        shimwell_catalog_df.RA.values, shimwell_catalog_df.DEC.values, region
+    )
+    assert list(catalog.columns) == ["Source_Name"]
+    assert sorted(catalog.Source_Name) == sorted(shimwell_catalog_df.Source_Name[mask])
+
+    batches = list(fits.iterate_partitioned_catalog(tmp_path, batch_size=1000))
+    assert max(len(batch) for batch in batches) <= 1000
+    assert sum(len(batch) for batch in batches) == len(shimwell_catalog_df)
+
+    empty = fits.read_partitioned_catalog(tmp_path, region=(0, 1, -10, -9))
+    assert empty.empty and "Source_Name" in empty.columns
+
+
+@pytest.mark.parametrize("policy", ["brightest", "first"])
+def test_deduplicate_catalog(policy):
+    # groups of 1 to 3 sources, 0.1 degree apart, with duplicates a few arcsec away
+    ra, dec, flux, expected_groups = [], [], [], []
+    for group in range(30):
+        for member in range(group % 3 + 1):
+            ra.append(150 + 0.1 * group + member * 3 / 3600)
+            dec.append(60 + member * 2 / 3600)
+            flux.append(1.0 + member)
+            expected_groups.append(group)
+    catalog = pd.DataFrame(
+        {"Source_Name": np.arange(len(ra)), "RA": ra, "DEC": dec, "Total_flux": flux}
+    )
+
+    grouped = fits.assign_duplicate_groups(catalog, size=60, policy=policy)
+    np.testing.assert_array_equal(grouped["Group_ID"], expected_groups)
+    np.testing.assert_array_equal(
+        grouped["Group_Size"], np.array(expected_groups) % 3 + 1
+    )
+
+    deduplicated = fits.deduplicate_catalog(catalog, size=60, policy=policy)
+    assert len(deduplicated) == 30
+    assert deduplicated["Group_ID"].is_unique
+    expected_flux = np.arange(30) % 3 + 1 if policy == "brightest" else np.ones(30)
+    np.testing.assert_array_equal(deduplicated["Total_flux"], expected_flux)
+
+    # small cutouts do not overlap enough
+    assert len(fits.deduplicate_catalog(catalog, size=5)) == len(catalog)
+
+
+def test_select_catalog_objects(shimwell_catalog_df, mosaic_ids, test_mosaic_dir):
+    catalog = shimwell_catalog_df
+    cdelts = fits.read_mosaic_cdelts(mosaic_ids, test_mosaic_dir)
+    np.testing.assert_allclose(np.abs(list(cdelts.values())), fits.DEFAULT_MOSAIC_CDELT)
+
+    selection = fits.CatalogSelection(
+        min_total_flux=1.0, min_snr=10, max_size=10, s_codes=["S"]
+    )
+    selected = fits.select_catalog_objects(catalog, selection, cdelts)
+
+    snr = catalog.Peak_flux / catalog.Isl_rms
+    sizes = (catalog.Maj + catalog.E_Maj) / 1.5
+    expected = catalog[
+        (catalog.Total_flux >= 1.0)
+        & (snr >= 10)
+        & (sizes <= 10)
+        & (catalog.S_Code == "S")
+    ]
+    assert 0 < len(selected) < len(catalog)
+    assert selected.index.equals(expected.index)
+
+    columns = fits.calculate_catalog_selection_columns(catalog, cdelts)
+    np.testing.assert_allclose(columns["SNR"], snr)
+    np.testing.assert_allclose(columns["Size_Pixels"], sizes)
+
+
+def test_download_files_resumes_and_skips(tmp_path, http_server):
+    rng = np.random.default_rng(0)
+    contents = {f"/{i}.fits": rng.bytes(100_000 + i) for i in range(3)}
+    http_server.files.update(contents)
+    downloads = [(http_server.url + name, name[1:]) for name in contents]
+
+    # an interrupted download of the first file
+    (tmp_path / "0.fits.part").write_bytes(contents["/0.fits"][:40_000])
+
+    results = fits.download_files(downloads, tmp_path, max_workers=3, chunk_size=4096)
+    assert [result.status for result in results] == ["downloaded"] * 3
+    for name, content in contents.items():
+        assert (tmp_path / name[1:]).read_bytes() == content
+    assert not list(tmp_path.glob("*.part"))
+    ranges = [headers.get("Range") for _, headers in http_server.requests]
+    assert "bytes=40000-" in ranges
+
+    manifest = fits.read_download_manifest(tmp_path)
+    assert sorted(manifest["size"]) == sorted(len(c) for c in contents.values())
+
+    number_of_requests = len(http_server.requests)
+    results = fits.download_files(downloads, tmp_path)
+    assert [result.status for result in results] == ["skipped"] * 3
+    assert len(http_server.requests) == number_of_requests
+
+
+def test_download_file_resumable_verifies_checksum(tmp_path, http_server):
+    http_server.files["/mosaic.fits"] = b"x" * 1000
+    url = http_server.url + "/mosaic.fits"
+
+    with pytest.raises(ValueError):
+        fits.download_file_resumable(tmp_path / "mosaic.fits", url, expected_sha256="0")
+    assert not (tmp_path / "mosaic.fits").exists()
+
+    http_server.injected_statuses["/mosaic.fits"] = [503]
+    results = fits.download_files([(url, "mosaic.fits")], tmp_path)
+    assert results[0].status == "failed"
+    manifest = fits.read_download_manifest(tmp_path)
+    assert manifest["status"].tolist() == ["failed"]
+
+    results = fits.download_files([(url, "mosaic.fits")], tmp_path)
+    assert results[0].status == "downloaded"
+    manifest = fits.read_download_manifest(tmp_path)
+    assert manifest["status"].tolist() == ["downloaded"]
+    (tmp_path / "mosaic.fits").unlink()
+
+    http_server.support_range = False
+    (tmp_path / "mosaic.fits.part").write_bytes(b"y" * 10)
+    result = fits.download_file_resumable(tmp_path / "mosaic.fits", url)
+    assert result.size == 1000
+    assert (tmp_path / "mosaic.fits").read_bytes() == b"x" * 1000
@@ -22,3 +22,74 @@ def test_max_weight_in_middle():
         6,
         6,
     )
+
+
+def test_resample_images_to_fixed_grid():
+    images = np.random.default_rng(0).random((3, 40, 40))
+
+    resampled = himg.resample_images(images, 20)
+    assert resampled.shape == (3, 20, 20)
+    assert np.isclose(resampled.mean(), images.mean(), atol=0.01)
+
+    assert np.array_equal(himg.resample_images(images, 40), images)
+
+
+def test_downsample_images_block_mean_and_sum():
+    images = np.arange(2 * 9 * 9, dtype=np.float32).reshape(2, 9, 9)
+
+    downsampled = himg.downsample_images(images, 2)
+    assert downsampled.shape == (2, 4, 4)
+    assert downsampled[0, 0, 0] == images[0, 0:2, 0:2].mean()
+    assert downsampled[1, 3, 3] == images[1, 6:8, 6:8].mean()
+
+    summed = himg.downsample_images(images[0], 3, method="sum")
+    assert summed.shape == (3, 3)
+    assert np.isclose(summed.sum(), images[0].sum())
+
+
+def test_downsample_images_fractional_factor():
+    images = np.ones((3, 30, 30))
+
+    downsampled = himg.downsample_images(images, 1.5, method="sum")
+    assert downsampled.shape == (3, 20, 20)
+    assert np.allclose(downsampled, 2.25)
+    assert himg.calculate_downsampled_size(30, 1.5) == (20, 20)
+
+
+def create_elongated_sources(angles, size=41):
+    y, x = np.mgrid[:size, :size] - (size - 1) / 2
+    images = []
+    for angle in np.radians(angles):
+        u = x * np.cos(angle) + y * np.sin(angle)
+        v = -x * np.sin(angle) + y * np.cos(angle)
+        images.append(np.exp(-(u**2) / 80 - v**2 / 10))
+    return np.array(images)
+
+
+def test_normalize_image_orientations_aligns_principal_axis():
+    angles = [0.0, 30.0, -60.0, 85.0]
+    images = create_elongated_sources(angles)
+
+    assert np.allclose(himg.calculate_principal_axis_angles(images), angles, atol=0.5)
+
+    images_aligned, orientations = himg.normalize_image_orientations(images)
+    assert np.allclose(orientations.angle, angles, atol=0.5)
+    assert np.allclose(
+        himg.calculate_principal_axis_angles(images_aligned), 0, atol=0.5
+    )
+    assert np.allclose(images_aligned, create_elongated_sources([0.0] * 4), atol=0.05)
+
+    images_restored = himg.restore_image_orientations(images_aligned, orientations)
+    assert np.allclose(images_restored, images, atol=0.05)
+
+
+def test_normalize_image_orientations_with_flips():
+    y, x = np.mgrid[:41, :41] - 20
+    image = np.exp(-(x**2) / 20 - y**2 / 10) + 0.5 * np.exp(-((x - 8) ** 2 + y**2) / 10)
+    images = np.array([image, image[:, ::-1]])
+
+    images_aligned, orientations = himg.normalize_image_orientations(images, flip=True)
+
+    assert orientations.flip_x.tolist() == [False, True]
+    assert orientations.flip_y.tolist() == [False, False]
+    assert np.allclose(images_aligned[1], images_aligned[0], atol=1e-6)
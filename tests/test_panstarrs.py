@@ -1,6 +1,15 @@
 import os
+import re
+import time
+from io import BytesIO
 
+import numpy as np
+import pandas as pd
+import pytest
+import requests
+from astropy.io import fits
 from astropy.io.fits.hdu.image import PrimaryHDU
+from astropy.table import Table
 
 from hda_fits import fits as hfits
 from hda_fits import panstarrs as ps
@@ -122,3 +131,295 @@ def test_write_read_panstarrs_objects_to_pink_file(tmp_path, catalog_filepath):
     assert header.number_of_images == 2
     assert header.layout == Layout(95, 95, 1)
     assert example_data.shape == (95, 95)
+
+
+def test_token_bucket_spaces_requests():
+    rate_limiter = ps.TokenBucket(rate=50)
+    t0 = time.monotonic()
+    for _ in range(11):
+        rate_limiter.acquire()
+    assert time.monotonic() - t0 >= 10 / 50 * 0.9
+
+
+def test_fetch_url_retries_server_errors(http_server):
+    http_server.files["/cutout.fits"] = b"data"
+    http_server.injected_statuses["/cutout.fits"] = [503, 429]
+    session = ps.create_session(max_retries=3, backoff_factor=0.01)
+
+    content = ps.fetch_url(http_server.url + "/cutout.fits", session)
+    assert content == b"data"
+    assert len(http_server.requests) == 3
+
+    http_server.injected_statuses["/cutout.fits"] = [503] * 4
+    assert ps.fetch_url(http_server.url + "/cutout.fits", session) is None
+
+
+def test_panstarrs_image_loader_from_local_server(tmp_path, http_server):
+    bands = ["g", "r", "i"]
+    for i, band in enumerate(bands):
+        buffer = BytesIO()
+        PrimaryHDU(np.full((4, 4), i, dtype=np.float32)).writeto(buffer)
+        http_server.files[f"/{band}.fits"] = buffer.getvalue()
+    table = Table(
+        {
+            "RA": [1.0] * 3,
+            "DEC": [2.0] * 3,
+            "filter": bands,
+            "url": [f"{http_server.url}/{band}.fits" for band in bands],
+            "Source_Name": ["source"] * 3,
+        }
+    )
+
+    ps.panstarrs_image_loader(table, tmp_path, requests_per_second=100)
+    for band in bands:
+        assert (tmp_path / f"source_filter={band}.fits").exists()
+
+    ps.panstarrs_image_loader(
+        table, tmp_path, seperate_channels=False, requests_per_second=100
+    )
+    np.testing.assert_allclose(fits.getdata(tmp_path / "source.fits"), 1.0)
+
+    # the deprecated sleep_time of 5 s per 500 requests is a rate of 100 per second
+    deprecated_directory = tmp_path / "deprecated"
+    deprecated_directory.mkdir()
+    with pytest.warns(DeprecationWarning, match="requests_per_second=100"):
+        ps.panstarrs_image_loader(table, deprecated_directory, sleep_time=5)
+    assert len(list(deprecated_directory.glob("*.fits"))) == len(bands)
+
+
+def test_fetch_panstarrs_cutouts_concurrently_and_resumable(tmp_path, http_server):
+    http_server.latency = 0.2
+    number_of_sources = 8
+    bands = ["g", "r"]
+    rows = []
+    for i in range(number_of_sources):
+        for band in bands:
+            path = f"/fitscut?source={i}&band={band}"
+            http_server.files[path.split("?")[0]] = b"cutout"
+            rows.append((f"{http_server.url}{path}", f"source{i}", band))
+    url_table = Table(rows=rows, names=["url", "Source_Name", "filter"])
+    http_server.injected_statuses["/fitscut"] = [500]
+
+    t0 = time.monotonic()
+    manifest = ps.fetch_panstarrs_cutouts(
+        url_table,
+        tmp_path,
+        max_workers=8,
+        requests_per_second=None,
+        session=ps.create_session(max_retries=0),
+    )
+    # sequential fetching would take 16 * 0.2 s
+    assert time.monotonic() - t0 < 16 * 0.2 / 2
+
+    assert (manifest["status"] == "fetched").sum() == len(rows) - 1
+    assert (manifest["status"] == "failed").sum() == 1
+    assert len(list(tmp_path.glob("*.fits"))) == len(rows) - 1
+    assert ps.read_fetch_manifest(tmp_path).shape[0] == len(rows)
+
+    number_of_requests = len(http_server.requests)
+    manifest = ps.fetch_panstarrs_cutouts(url_table, tmp_path, requests_per_second=None)
+    assert (manifest["status"] == "fetched").all()
+    assert len(http_server.requests) == number_of_requests + 1
+    assert len(list(tmp_path.glob("*.fits"))) == len(rows)
+
+
+def stand_in_ps1filenames(body):
+    """Answers with stack images of the requested filters out of g and r for every
+    position with a positive DEC"""
+    filters = re.search(rb'name="filters"\r\n\r\n(\w+)\r\n', body).group(1).decode()
+    positions = re.findall(rb"^(-?[\d.]+) (-?[\d.]+)\r?$", body, flags=re.MULTILINE)
+    lines = ["projcell subcell ra dec filter mjd type filename shortname badflag"]
+    for ra, dec in positions:
+        if float(dec) < 0:
+            continue
+        for band in [band for band in filters if band in "gr"]:
+            filename = f"/rings.v3.skycell/{ra.decode()}.stk.{band}.unconv.fits"
+            lines.append(
+                f"1000 10 {float(ra):.6f} {float(dec):.6f} {band} 0 stack "
+                f"{filename} {filename[1:]} 0"
+            )
+    return "\n".join(lines).encode()
+
+
+def test_resolve_ps1filenames_in_chunks_with_cache(tmp_path, http_server, monkeypatch):
+    http_server.post_handlers["/ps1filenames.py"] = stand_in_ps1filenames
+    monkeypatch.setattr(ps, "ps1filename", http_server.url + "/ps1filenames.py")
+    ra = np.array([10.1, 10.2, 10.3, 10.4, 10.5, 10.1])
+    dec = np.array([1.0, 2.0, -3.0, 4.0, 5.0, 1.0])
+
+    resolved = ps.resolve_ps1filenames(
+        ra, dec, filters="gr", cache_directory=tmp_path, chunk_size=2
+    )
+    # five unique positions in chunks of two
+    assert len(http_server.requests) == 3
+    assert resolved["position"].tolist() == [0, 0, 1, 1, 3, 3, 4, 4, 5, 5]
+    np.testing.assert_allclose(resolved["RA"], ra[resolved["position"]])
+    assert resolved["filename"].str.endswith(".unconv.fits").all()
+    assert (tmp_path / ps.PS1FILENAMES_CACHE_FILENAME).exists()
+
+    cached = ps.resolve_ps1filenames(
+        ra, dec, filters="gr", cache_directory=tmp_path, chunk_size=2
+    )
+    assert len(http_server.requests) == 3
+    pd.testing.assert_frame_equal(cached, resolved)
+
+    ps.resolve_ps1filenames(
+        np.append(ra, 10.6),
+        np.append(dec, 6.0),
+        filters="g",
+        cache_directory=tmp_path,
+    )
+    assert len(http_server.requests) == 4
+    assert ps.read_ps1filenames_cache(tmp_path).shape[0] == 11
+
+
+def test_resolve_ps1filenames_with_more_filters_than_cached(
+    tmp_path, http_server, monkeypatch
+):
+    bodies = []
+
+    def recording_stand_in(body):
+        bodies.append(body)
+        return stand_in_ps1filenames(body)
+
+    http_server.post_handlers["/ps1filenames.py"] = recording_stand_in
+    monkeypatch.setattr(ps, "ps1filename", http_server.url + "/ps1filenames.py")
+    catalog = pd.DataFrame(
+        {"Source_Name": ["a", "b"], "RA": [10.1, 10.2], "DEC": [1.0, 2.0]}
+    )
+
+    ps.resolve_ps1filenames(
+        catalog["RA"], catalog["DEC"], filters="g", cache_directory=tmp_path
+    )
+    table = ps.get_images_panstarrs(
+        catalog, tmp_path, filters="gr", return_table_only=True
+    )
+
+    assert len(bodies) == 2
+    assert b'name="filters"\r\n\r\nr\r\n' in bodies[1]
+    assert table["Source_Name"].tolist() == ["a", "a", "b", "b"]
+    assert table["filter"].tolist() == ["g", "r", "g", "r"]
+    cache = ps.read_ps1filenames_cache(tmp_path)
+    assert not cache.duplicated(ps.PS1FILENAMES_UNIQUE_COLUMNS).any()
+
+
+def test_resolve_ps1filenames_caches_resolved_chunks_on_failure(
+    tmp_path, http_server, monkeypatch
+):
+    http_server.post_handlers["/ps1filenames.py"] = stand_in_ps1filenames
+    http_server.injected_statuses["/ps1filenames.py"] = [503]
+    monkeypatch.setattr(ps, "ps1filename", http_server.url + "/ps1filenames.py")
+    ra = np.array([10.1, 10.2, 10.3, 10.4, 10.5, 10.6])
+    dec = np.array([1.0, 2.0, 3.0, 4.0, 5.0, 6.0])
+    session = ps.create_session(max_retries=0)
+
+    with pytest.raises(requests.exceptions.RequestException):
+        ps.resolve_ps1filenames(
+            ra,
+            dec,
+            filters="g",
+            cache_directory=tmp_path,
+            chunk_size=2,
+            session=session,
+        )
+    assert len(http_server.requests) == 3
+    cache = ps.read_ps1filenames_cache(tmp_path)
+    assert cache["RA_Key"].nunique() == 4
+
+    resolved = ps.resolve_ps1filenames(
+        ra, dec, filters="g", cache_directory=tmp_path, chunk_size=2, session=session
+    )
+    assert len(http_server.requests) == 4
+    assert resolved["position"].tolist() == list(range(6))
+
+
+def test_get_images_panstarrs_table_from_resolved_filenames(
+    tmp_path, http_server, monkeypatch
+):
+    http_server.post_handlers["/ps1filenames.py"] = stand_in_ps1filenames
+    monkeypatch.setattr(ps, "ps1filename", http_server.url + "/ps1filenames.py")
+    catalog = pd.DataFrame(
+        {
+            "Source_Name": ["a", "b", "c"],
+            "RA": [10.1, 10.2, 10.3],
+            "DEC": [1.0, -2.0, 3.0],
+        }
+    )
+
+    table = ps.get_images_panstarrs(
+        catalog, tmp_path, filters="gr", return_table_only=True
+    )
+    assert table["Source_Name"].tolist() == ["a", "a", "c", "c"]
+    assert table["filter"].tolist() == ["g", "r", "g", "r"]
+    assert all("&ra=10.3&dec=3.0&" in url for url in table["url"][2:])
+
+
+def test_ps1_zones_cover_projection_cells():
+    zones = ps.create_ps1_zones()
+    assert zones["NBAND"].sum() == 2644
+    assert zones.loc[zones["DEC"] == -30, "PROJCELL"].item() == 635
+    assert zones["NBAND"].max() == 90
+
+
+def test_calculate_ps1_skycells():
+    zones = ps.create_ps1_zones()
+    zone = zones[zones["DEC"] == 50].iloc[0]
+    cell_width = 360 / zone["NBAND"]
+    # centers of the projection cells are at the corner of skycells 44, 45, 54 and 55
+    ra = np.array([3, 3, 3, 3]) * cell_width + np.array([-0.01, 0.01, -0.01, 0.01])
+    dec = np.array([50.01, 50.01, 49.99, 49.99])
+
+    projcell, subcell = ps.calculate_ps1_skycells(ra, dec)
+    assert (projcell == zone["PROJCELL"] + 3).all()
+    assert subcell.tolist() == [55, 54, 45, 44]
+
+    projcell, subcell = ps.calculate_ps1_skycells(
+        np.array([359.999, 0.001]), np.array([50.0, 50.0])
+    )
+    assert projcell.tolist() == [zone["PROJCELL"], zone["PROJCELL"]]
+    assert ps.calculate_ps1_skycells(np.array([0.0]), np.array([90.0]))[0] == [2643]
+
+
+def test_create_ps1_filenames_offline():
+    resolved = ps.create_ps1_filenames(
+        np.array([224.98, 50.0]), np.array([51.8, -40.0]), filters="gr"
+    )
+    assert resolved["position"].tolist() == [0, 0]
+    assert resolved["filename"].tolist() == [
+        "/rings.v3.skycell/2326/090/rings.v3.skycell.2326.090.stk.g.unconv.fits",
+        "/rings.v3.skycell/2326/090/rings.v3.skycell.2326.090.stk.r.unconv.fits",
+    ]
+    assert resolved["shortname"][0] == "rings.v3.skycell.2326.090.stk.g.unconv.fits"
+
+
+def test_validate_ps1_filenames_against_cache(tmp_path):
+    ra = np.array([224.98, 10.5])
+    dec = np.array([51.8, 30.0])
+    offline = ps.create_ps1_filenames(ra, dec, filters="g")
+    keys = ps.create_coordinate_keys(ra, dec)
+    cache = offline.drop(columns=["position", "RA", "DEC"])
+    cache.insert(0, "RA_Key", keys[:, 0])
+    cache.insert(1, "DEC_Key", keys[:, 1])
+    cache.insert(2, "imagetypes", "stack")
+    cache.loc[1, "filename"] = "/rings.v3.skycell/0001/000/other.fits"
+    ps.write_ps1filenames_cache(
+        tmp_path, cache.reindex(columns=ps.PS1FILENAMES_CACHE_COLUMNS)
+    )
+
+    validation = ps.validate_ps1_filenames(tmp_path)
+    assert validation["Match"].tolist() == [True, False]
+    assert validation["Offline_Filename"][1] == offline["filename"][1]
+
+
+def test_get_images_panstarrs_offline(tmp_path, http_server, monkeypatch):
+    monkeypatch.setattr(ps, "ps1filename", http_server.url + "/ps1filenames.py")
+    catalog = pd.DataFrame(
+        {"Source_Name": ["a", "b"], "RA": [224.98, 10.5], "DEC": [51.8, 30.0]}
+    )
+
+    table = ps.get_images_panstarrs(
+        catalog, tmp_path, filters="gri", return_table_only=True, offline=True
+    )
+    assert len(http_server.requests) == 0
+    assert table["Source_Name"].tolist() == ["a"] * 3 + ["b"] * 3
+    assert all("red=/rings.v3.skycell/2326/090/" in url for url in table["url"][:3])
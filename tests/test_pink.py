@@ -1,8 +1,13 @@
 import os
+import shutil
 import struct
 
+import numpy as np
+
 import hda_fits as hfits
-from hda_fits import fits, pink
+from hda_fits import fits
+from hda_fits import image_processing as himg
+from hda_fits import pink
 from hda_fits.logging_config import logging
 from hda_fits.types import Layout, PinkHeader
 
@@ -304,3 +309,406 @@ def test_read_pink_file_image_invalid_index(test_pink_file):
         assert e is not None
 
     assert image is None
+
+
+def test_write_mosaic_objects_to_pink_file_v2_with_max_nan_fraction(
+    tmp_path,
+    mosaic_hdu_and_wcs_with_nan,
+    example_object_world_coordinates,
+    example_object_world_coordinates_outside,
+):
+    hdu, _ = mosaic_hdu_and_wcs_with_nan
+    tmp_filepath = tmp_path / "test_file.pink"
+    coordinates = [
+        example_object_world_coordinates,
+        example_object_world_coordinates_outside,
+    ]
+
+    image_was_written = hfits.write_mosaic_objects_to_pink_file_v2(
+        filepath=tmp_filepath,
+        hdu=hdu,
+        coordinates=coordinates,
+        image_size=20,
+        max_nan_fraction=0.0,
+    )
+    assert image_was_written == [False, False]
+
+    image_was_written = hfits.write_mosaic_objects_to_pink_file_v2(
+        filepath=tmp_filepath,
+        hdu=hdu,
+        coordinates=coordinates,
+        image_size=20,
+        max_nan_fraction=0.1,
+    )
+    assert image_was_written == [True, False]
+    assert not np.isnan(pink.read_pink_file_image(tmp_filepath, 0)).any()
+
+
+def test_write_mosaic_objects_to_pink_file_v2_from_tile_store(
+    tmp_path, mosaic_id, mosaic_hdu_and_wcs, example_object_world_coordinates
+):
+    hdu, _ = mosaic_hdu_and_wcs
+    tile_store = fits.create_mosaic_tile_store(mosaic_id, tmp_path, 128, hdu=hdu)
+    filepath_hdu = tmp_path / "test_file_hdu.pink"
+    filepath_tiles = tmp_path / "test_file_tiles.pink"
+
+    for filepath, store in [(filepath_hdu, None), (filepath_tiles, tile_store)]:
+        image_was_written = hfits.write_mosaic_objects_to_pink_file_v2(
+            filepath=filepath,
+            hdu=hdu,
+            coordinates=[example_object_world_coordinates],
+            image_size=95,
+            tile_store=store,
+        )
+        assert image_was_written == [True]
+
+    assert filepath_hdu.read_bytes() == filepath_tiles.read_bytes()
+
+
+def test_write_mosaic_objects_to_pink_file_v2_in_extraction_order(
+    tmp_path, mosaic_hdu_and_wcs, example_object_world_coordinates
+):
+    hdu, wcs = mosaic_hdu_and_wcs
+    pixel_positions = [(350, 40), (20, 380), (-10, 10), (200, 200), (60, 60)]
+    coordinates = wcs.wcs_pix2world(pixel_positions, 0).tolist()
+    filepaths = []
+
+    for extraction_order in [None, "morton", "tile"]:
+        filepath = tmp_path / f"test_file_{extraction_order}.pink"
+        image_was_written = hfits.write_mosaic_objects_to_pink_file_v2(
+            filepath=filepath,
+            hdu=hdu,
+            coordinates=coordinates,
+            image_size=30,
+            extraction_order=extraction_order,
+        )
+        assert image_was_written == [True, True, False, True, True]
+        filepaths.append(filepath)
+
+    assert filepaths[0].read_bytes() == filepaths[1].read_bytes()
+    assert filepaths[0].read_bytes() == filepaths[2].read_bytes()
+
+
+def test_write_mosaic_objects_to_pink_file_v2_with_multiple_sizes(
+    tmp_path, mosaic_hdu_and_wcs_with_nan
+):
+    hdu, wcs = mosaic_hdu_and_wcs_with_nan
+    pixel_positions = [(350.5, 40.2), (385, 200), (200, 200), (60.7, 60.1)]
+    coordinates = wcs.wcs_pix2world(pixel_positions, 0).tolist()
+    image_sizes = [20, 31, fits.RectangleSize(image_height=64, image_width=15)]
+
+    masks = hfits.write_mosaic_objects_to_pink_file_v2(
+        filepath=tmp_path / "test_file.pink",
+        hdu=hdu,
+        coordinates=coordinates,
+        image_size=image_sizes,
+        fill_nan=True,
+    )
+
+    for image_size, mask, suffix in zip(
+        image_sizes, masks, ["20x20", "31x31", "64x15"]
+    ):
+        filepath = tmp_path / f"test_file_{suffix}.pink"
+        filepath_single = tmp_path / f"test_file_single_{suffix}.pink"
+        mask_single = hfits.write_mosaic_objects_to_pink_file_v2(
+            filepath=filepath_single,
+            hdu=hdu,
+            coordinates=coordinates,
+            image_size=image_size,
+            fill_nan=True,
+        )
+        assert mask == mask_single
+        assert filepath.read_bytes() == filepath_single.read_bytes()
+
+    assert masks[0] == [True, True, True, True]
+    assert masks[1] == [True, False, True, True]
+
+
+def test_write_catalog_to_pink_file_with_multiple_sizes(
+    tmp_path, test_mosaic_dir, catalog_p205_p218_95px
+):
+    filepaths = [tmp_path / "test_file_64.pink", tmp_path / "test_file_95.pink"]
+
+    catalogs_written = hfits.write_catalog_objects_pink_file_v2(
+        filepath=filepaths,
+        catalog=catalog_p205_p218_95px,
+        mosaic_path=test_mosaic_dir,
+        image_size=[64, 95],
+    )
+
+    assert len(catalogs_written) == 2
+    assert catalogs_written[1].shape[0] == 5
+    assert catalogs_written[0].shape[0] >= catalogs_written[1].shape[0]
+    for filepath, catalog_written in zip(filepaths, catalogs_written):
+        header = pink.read_pink_file_header(filepath)
+        assert header.number_of_images == catalog_written.shape[0]
+
+
+def test_write_catalog_to_pink_file_with_variable_cutout_sizes(
+    tmp_path, test_mosaic_dir, catalog_p205_p218_95px
+):
+    filepath = tmp_path / "test_file_variable.pink"
+
+    catalog_written = hfits.write_catalog_objects_variable_size_pink_file_v2(
+        filepath=filepath,
+        catalog=catalog_p205_p218_95px,
+        mosaic_path=test_mosaic_dir,
+        image_size=32,
+        fill_nan=True,
+    )
+
+    header = pink.read_pink_file_header(filepath)
+    assert header.number_of_images == catalog_written.shape[0] > 0
+    assert header.layout.width == header.layout.height == 32
+    assert (catalog_written.Cutout_Size % 8 == 0).all()
+    assert (catalog_written.Cutout_Size >= 16).all()
+
+    image = pink.read_pink_file_image(filepath, header.number_of_images - 1)
+    assert image.shape == (32, 32)
+    assert np.isfinite(image).all()
+
+
+def test_write_catalog_to_pink_file_with_cutout_cache(
+    tmp_path, test_mosaic_dir, catalog_p205_p218_95px, monkeypatch
+):
+    filepath = tmp_path / "test_file.pink"
+    filepath_cached = tmp_path / "test_file_cached.pink"
+    mosaic_path = tmp_path / "mosaics"
+    shutil.copytree(test_mosaic_dir, mosaic_path)
+
+    cutout_cache = fits.CutoutCache(tmp_path / "cache")
+    catalog_written = hfits.write_catalog_objects_pink_file_v2(
+        filepath=filepath,
+        catalog=catalog_p205_p218_95px,
+        mosaic_path=mosaic_path,
+        image_size=95,
+        cutout_cache=cutout_cache,
+    )
+    assert cutout_cache.stats().hits == 0
+    assert len(list(mosaic_path.glob("*-mosaic.hash"))) == 2
+
+    def fail_to_hash(hdu):
+        raise AssertionError("mosaic was hashed again")
+
+    monkeypatch.setattr(fits, "calculate_mosaic_hash", fail_to_hash)
+    cutout_cache = fits.CutoutCache(tmp_path / "cache")
+    catalog_written_cached = hfits.write_catalog_objects_pink_file_v2(
+        filepath=filepath_cached,
+        catalog=catalog_p205_p218_95px,
+        mosaic_path=mosaic_path,
+        image_size=95,
+        cutout_cache=cutout_cache,
+    )
+
+    assert cutout_cache.stats().hits == catalog_written.shape[0]
+    assert catalog_written_cached.equals(catalog_written)
+    assert filepath_cached.read_bytes() == filepath.read_bytes()
+
+
+def test_write_catalog_to_pink_file_downsampled(
+    tmp_path, test_mosaic_dir, catalog_p205_p218_95px
+):
+    filepath = tmp_path / "test_file.pink"
+    filepath_downsampled = tmp_path / "test_file_downsampled.pink"
+    filepath_transformed = tmp_path / "test_file_transformed.pink"
+
+    hfits.write_catalog_objects_pink_file_v2(
+        filepath=filepath,
+        catalog=catalog_p205_p218_95px,
+        mosaic_path=test_mosaic_dir,
+        image_size=96,
+    )
+    catalog_written = hfits.write_catalog_objects_pink_file_v2(
+        filepath=filepath_downsampled,
+        catalog=catalog_p205_p218_95px,
+        mosaic_path=test_mosaic_dir,
+        image_size=96,
+        downsample_factor=4,
+    )
+    pink.write_downsampled_pink_file(
+        filepath_transformed, filepath, downsample_factor=4, batch_size=2
+    )
+
+    header = pink.read_pink_file_header(filepath_downsampled)
+    assert header.number_of_images == catalog_written.shape[0]
+    assert header.layout == Layout(width=24, height=24, depth=1)
+    assert pink.read_pink_file_header(filepath_transformed) == header
+
+    image = pink.read_pink_file_image(filepath, 0)
+    image_downsampled = pink.read_pink_file_image(filepath_downsampled, 0)
+    assert np.allclose(
+        image_downsampled, image.reshape(24, 4, 24, 4).mean(axis=(1, 3)), atol=1e-6
+    )
+    assert filepath_transformed.read_bytes() == filepath_downsampled.read_bytes()
+
+
+def test_write_orientation_normalized_pink_file(tmp_path):
+    filepath = tmp_path / "test_file.pink"
+    filepath_aligned = tmp_path / "test_file_aligned.pink"
+
+    y, x = np.mgrid[:31, :31] - 15
+    images = []
+    for angle in np.radians([0.0, 45.0, -30.0]):
+        u = x * np.cos(angle) + y * np.sin(angle)
+        v = -x * np.sin(angle) + y * np.cos(angle)
+        images.append(np.exp(-(u**2) / 40 - v**2 / 8).astype("float32"))
+
+    pink.write_pink_file_header(filepath, 3, 31, 31)
+    for image in images:
+        pink.write_pink_file_v2_data(filepath, image.flatten())
+
+    orientations = pink.write_orientation_normalized_pink_file(
+        filepath_aligned, filepath, flip=True, batch_size=2
+    )
+
+    assert pink.read_pink_file_header(filepath_aligned) == pink.read_pink_file_header(
+        filepath
+    )
+    assert np.allclose(orientations.angle, [0.0, 45.0, -30.0], atol=0.5)
+
+    orientations_sidecar = pink.read_orientation_sidecar(filepath_aligned)
+    for values, values_sidecar in zip(orientations, orientations_sidecar):
+        assert np.array_equal(values, values_sidecar)
+
+    images_aligned = np.stack(
+        pink.read_pink_file_multiple_images(filepath_aligned, [0, 1, 2])
+    )
+    assert np.allclose(images_aligned[1], images[0], atol=0.05)
+    assert np.allclose(images_aligned[2], images[0], atol=0.05)
+
+    images_normalized, _ = himg.normalize_image_orientations(
+        np.stack(images), flip=True
+    )
+    assert np.allclose(images_aligned, images_normalized)
+
+
+def test_write_catalog_to_pink_file_with_and_without_prefetch(
+    tmp_path, test_mosaic_dir, catalog_p205_p218_95px
+):
+    filepaths = [tmp_path / "test_file_prefetch.pink", tmp_path / "test_file.pink"]
+
+    catalogs_written = [
+        hfits.write_catalog_objects_pink_file_v2(
+            filepath=filepath,
+            catalog=catalog_p205_p218_95px,
+            mosaic_path=test_mosaic_dir,
+            image_size=95,
+            prefetch_mosaics=prefetch_mosaics,
+        )
+        for filepath, prefetch_mosaics in zip(filepaths, [True, False])
+    ]
+
+    assert catalogs_written[0].equals(catalogs_written[1])
+    assert filepaths[0].read_bytes() == filepaths[1].read_bytes()
+
+
+def test_write_catalog_to_pink_file_with_compact_catalog(
+    tmp_path, test_mosaic_dir, catalog_p205_p218_95px
+):
+    filepaths = [tmp_path / "test_file_compact.pink", tmp_path / "test_file.pink"]
+    catalogs = [fits.compact_catalog(catalog_p205_p218_95px), catalog_p205_p218_95px]
+
+    catalogs_written = [
+        hfits.write_catalog_objects_pink_file_v2(
+            filepath=filepath,
+            catalog=catalog,
+            mosaic_path=test_mosaic_dir,
+            image_size=95,
+        )
+        for filepath, catalog in zip(filepaths, catalogs)
+    ]
+
+    assert catalogs_written[0].index.equals(catalogs_written[1].index)
+    assert filepaths[0].read_bytes() == filepaths[1].read_bytes()
+
+
+def test_write_catalog_to_pink_file_ledger(
+    tmp_path,
+    test_mosaic_dir,
+    catalog_p205_p218_95px,
+    sources_p205_p218_full_95px,
+    sources_p205_p218_partial_95px,
+):
+    tmp_filepath = tmp_path / "test_file.pink"
+    catalog = catalog_p205_p218_95px.copy()
+    missing = catalog["Source_Name"] == sources_p205_p218_partial_95px[0]
+    catalog.loc[missing, "Mosaic_ID"] = "P000+00"
+
+    catalog_written = hfits.write_catalog_objects_pink_file_v2(
+        filepath=tmp_filepath,
+        catalog=catalog,
+        mosaic_path=test_mosaic_dir,
+        image_size=95,
+    )
+    ledger = pink.read_write_ledger(tmp_filepath)
+
+    assert ledger.index.equals(catalog.index)
+    assert ledger["Source_Name"].tolist() == catalog["Source_Name"].tolist()
+
+    written = ledger[ledger["Status"] == pink.LEDGER_STATUS_WRITTEN]
+    assert sorted(written["Source_Name"]) == sorted(sources_p205_p218_full_95px)
+    assert sorted(written["Slot"]) == list(range(len(catalog_written)))
+    assert (
+        written.sort_values("Slot")["Source_Name"].tolist()
+        == catalog_written["Source_Name"].tolist()
+    )
+
+    skipped = ledger[ledger["Status"] != pink.LEDGER_STATUS_WRITTEN]
+    assert (skipped["Slot"] == -1).all()
+    assert (ledger.loc[missing, "Reason"] == "missing mosaic").all()
+    assert (skipped.loc[~missing, "Reason"] == "outside of mosaic").all()
+    assert (written["Mosaic_Seconds"] > 0).all()
+
+
+def test_write_catalog_to_pink_file_ledger_without_source_names(
+    tmp_path, test_mosaic_dir, catalog_p205_p218_95px
+):
+    tmp_filepath = tmp_path / "test_file.pink"
+    catalog = catalog_p205_p218_95px[["RA", "DEC", "Mosaic_ID"]]
+
+    catalog_written = hfits.write_catalog_objects_pink_file_v2(
+        filepath=tmp_filepath,
+        catalog=catalog,
+        mosaic_path=test_mosaic_dir,
+        image_size=95,
+    )
+    ledger = pink.read_write_ledger(tmp_filepath)
+
+    assert "Source_Name" not in ledger.columns
+    assert ledger.index.equals(catalog.index)
+    written = ledger[ledger["Status"] == pink.LEDGER_STATUS_WRITTEN]
+    assert written.sort_values("Slot").index.equals(catalog_written.index)
+
+
+def test_write_catalog_to_pink_file_with_selection(
+    tmp_path, test_mosaic_dir, catalog_p205_p218_95px
+):
+    filepaths = [tmp_path / "test_file_selection.pink", tmp_path / "test_file.pink"]
+    selection = fits.CatalogSelection(min_snr=20)
+    is_selected = (
+        catalog_p205_p218_95px.Peak_flux / catalog_p205_p218_95px.Isl_rms >= 20
+    ).values
+    assert 0 < is_selected.sum() < len(is_selected)
+
+    catalog_written = hfits.write_catalog_objects_pink_file_v2(
+        filepath=filepaths[0],
+        catalog=catalog_p205_p218_95px,
+        mosaic_path=test_mosaic_dir,
+        image_size=95,
+        selection=selection,
+    )
+    catalog_written_preselected = hfits.write_catalog_objects_pink_file_v2(
+        filepath=filepaths[1],
+        catalog=catalog_p205_p218_95px[is_selected],
+        mosaic_path=test_mosaic_dir,
+        image_size=95,
+    )
+
+    assert catalog_written.equals(catalog_written_preselected)
+    assert filepaths[0].read_bytes() == filepaths[1].read_bytes()
+
+    ledger = pink.read_write_ledger(filepaths[0])
+    assert (
+        ledger["Status"].values[~is_selected] == pink.LEDGER_STATUS_DESELECTED
+    ).all()
+    assert (ledger["Status"].values[is_selected] != pink.LEDGER_STATUS_DESELECTED).all()
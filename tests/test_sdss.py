@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+
+from hda_fits import fits, sdss
+from hda_fits.logging_config import logging
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+
+def test_create_crossmatch_catalog(tmp_path, catalog_filepath, shimwell_catalog_df):
+    rng = np.random.default_rng(0)
+    number_of_objects = len(shimwell_catalog_df)
+
+    # every second object gets a counterpart 1 arcsec north, every tenth a second one
+    matched = np.arange(0, number_of_objects, 2)
+    doubled = np.arange(0, number_of_objects, 10)
+    positions = shimwell_catalog_df[["RA", "DEC"]].values
+    optical = np.concatenate(
+        [positions[matched] + [0, 1 / 3600], positions[doubled] + [0, -2 / 3600]]
+    )
+    permutation = rng.permutation(len(optical))
+    optical_catalog = pd.DataFrame(
+        {
+            "ra": optical[permutation, 0],
+            "dec": optical[permutation, 1],
+            "run": np.arange(len(optical)),
+            "cam_col": 1,
+            "field": 2,
+        }
+    )
+
+    crossmatch_catalog = sdss.create_crossmatch_catalog(
+        tmp_path, catalog_filepath, optical_catalog, radius=3
+    )
+    loaded = sdss.load_crossmatch_catalog(tmp_path)
+    assert loaded.shape == crossmatch_catalog.shape
+    assert (
+        loaded.columns[-6:].tolist()
+        == sdss.SDSS_FIELD_COLUMNS + sdss.CROSSMATCH_MATCH_COLUMNS
+    )
+
+    # only objects without another radio source within 10 arcsec are unambiguous
+    index = fits.create_spatial_index(positions)
+    separations, _ = fits.query_nearest_neighbours(index, positions, k=2)
+    isolated = separations[:, 1] > 10
+    matched = matched[isolated[matched]]
+    doubled = doubled[isolated[doubled]]
+
+    has_match = np.zeros(number_of_objects, dtype=bool)
+    has_match[matched] = True
+    has_match[doubled] = True
+    np.testing.assert_array_equal(
+        (loaded["Match_Count"] > 0)[isolated], has_match[isolated]
+    )
+    np.testing.assert_array_equal(
+        loaded["Match_Index"].isna()[isolated], ~has_match[isolated]
+    )
+    np.testing.assert_array_equal(loaded["run"].isna()[isolated], ~has_match[isolated])
+
+    np.testing.assert_allclose(loaded["Match_Separation"].values[matched], 1, atol=1e-3)
+    assert (loaded["Match_Count"].values[doubled] == 2).all()
+
+    match_index = loaded["Match_Index"].values[matched].astype(int)
+    np.testing.assert_array_equal(
+        loaded["run"].values[matched].astype(int),
+        optical_catalog["run"].values[match_index],
+    )